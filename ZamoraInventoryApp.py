@@ -12,7 +12,7 @@ from flask import (
     get_flashed_messages,
 )
 import io
-import matplotlib.pyplot as plt
+from matplotlib.figure import Figure
 from datetime import datetime, timedelta
 import pandas as pd
 import time
@@ -24,14 +24,19 @@ from matplotlib.backends.backend_agg import FigureCanvasAgg as FigureCanvas
 import os
 import uuid
 import tempfile
+import threading
 import stat
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
 from werkzeug.utils import secure_filename
 
 from sku_matcher import judge_same_product
 from pdf_parser import parse_pdf
+from json_patch import apply_patch, JsonPatchError
 from db import (
-    init_db, save_parsed_document, list_invoices, delete_invoice,
-    load_catalog_to_memory, get_catalog_df, refresh_catalog,
+    init_db, save_parsed_document, list_invoices, delete_invoice, find_invoice_by_hash,
+    create_parse_job, update_parse_job, get_parse_job, count_active_parse_jobs, delete_parse_job,
+    load_catalog_to_memory, get_catalog_df, get_catalog_generation, get_catalog_window, refresh_catalog,
     get_user, list_users, add_user, set_user_active, set_user_role,
     increment_failed_attempts, reset_failed_attempts,
     log_login, get_login_history,
@@ -40,7 +45,7 @@ from db import (
     get_template_versions_db, restore_template_version_db, count_templates_db,
     save_estimate_db, get_estimate_db, list_estimates_db,
     delete_estimate_db, duplicate_estimate_db,
-    search_estimate_catalog, upsert_estimate_catalog, clear_estimate_catalog_usage,
+    search_estimate_catalog, sync_estimate_catalog, clear_estimate_catalog_usage, dedupe_estimate_catalog,
     deduplicate_catalog_usage, clean_lps_description_suffixes, fix_foamcore_descriptions, move_estimate_db,
     get_material_list_total,
     add_attachment, get_attachments, delete_attachment, delete_attachments_for_estimate,
@@ -51,8 +56,14 @@ from db import (
     add_fixture_spec, get_fixture_specs, delete_fixture_spec,
     add_row_attachment, get_row_attachments, delete_row_attachment,
     pop_turso_sync_error,
+    backfill_price_rollup, rebuild_price_rollup, get_price_rollup, count_products_by_supplier,
+    get_product_groups, backfill_price_stats, rebuild_price_stats,
+    backfill_spend_cube, query_spend, SPEND_DIMENSIONS, backfill_listing_summaries, run_retention,
+    get_retention_last,
 )
 import r2_utils
+import graph_cache
+import parse_cache
 import tempfile
 
 # Additional imports for login functionality
@@ -72,8 +83,13 @@ import data_utils as du
 app = Flask(__name__)
 init_db()
 deduplicate_catalog_usage()
+dedupe_estimate_catalog()
 clean_lps_description_suffixes()
 fix_foamcore_descriptions()
+backfill_price_rollup()
+backfill_price_stats()
+backfill_spend_cube()
+backfill_listing_summaries()
 load_catalog_to_memory()
 app.secret_key = config.SECRET_KEY
 
@@ -195,18 +211,6 @@ SUPPLY_CODES = {
 REVERSE_SUPPLY_CODES = {v: k for k, v in SUPPLY_CODES.items()}
 
 
-def _ensure_supply_loaded(supply: str):
-    loaders = {
-        "supply1": du.load_default_file,
-        "supply2": du.load_supply2_file,
-        "supply3": du.load_supply3_file,
-        "supply4": du.load_supply4_file,
-    }
-    loader = loaders.get(supply)
-    if loader:
-        loader()
-
-
 def default_nav_links() -> list[dict[str, str]]:
     """Return the default navigation links for the React shell."""
     links = [
@@ -214,6 +218,7 @@ def default_nav_links() -> list[dict[str, str]]:
         {"label": "View All",      "href": url_for("view_all"),        "page": "view_all"},
         {"label": "Search",        "href": url_for("search"),          "page": "search"},
         {"label": "Analyze",       "href": url_for("analyze"),         "page": "analyze"},
+        {"label": "Compare",       "href": url_for("compare"),         "page": "compare"},
         {"label": "Material List", "href": url_for("templates_list"),  "page": "templates"},
         {"label": "Estimates",     "href": url_for("estimates_list"),  "page": "estimates"},
         {"label": "Upload PDF",    "href": url_for("upload_pdf"),      "page": "upload_pdf"},
@@ -302,18 +307,11 @@ def _search_supply_data(
 
 def _analyze_price_changes(supply: str, start_date: str, end_date: str) -> dict:
     """Run the price change analysis and return JSON-serializable results."""
-    _ensure_supply_loaded(supply)
-    current_df = du.get_current_dataframe(supply)
-    if current_df is None:
-        return {"rows": [], "columns": []}
-
     try:
-        start = pd.to_datetime(start_date)
-        end = pd.to_datetime(end_date)
+        filtered = get_catalog_window(SUPPLY_CODES.get(supply, supply), start_date, end_date)
     except Exception:
         return {"rows": [], "columns": []}
 
-    filtered = current_df[(current_df["Date"] >= start) & (current_df["Date"] <= end)]
     if filtered.empty:
         return {"rows": [], "columns": []}
 
@@ -372,22 +370,8 @@ def _template_entry(t: dict) -> dict:
         mtime = datetime.strptime(t["updated_at"], "%Y-%m-%d %H:%M:%S").timestamp()
     except Exception:
         mtime = 0.0
-    try:
-        content   = json.loads(t["data"])
-        products  = content.get("products", []) if isinstance(content, dict) else content
-        item_count = len(products)
-        subtotal  = 0.0
-        for item in products:
-            try:
-                total = item.get("total")
-                subtotal += float(total) if total is not None else (
-                    float(item.get("last_price") or item.get("Last Price") or 0)
-                    * float(item.get("quantity", 0))
-                )
-            except (TypeError, ValueError):
-                pass
-    except Exception:
-        products, item_count, subtotal = [], 0, 0.0
+    item_count = t.get("item_count") or 0
+    subtotal   = t.get("subtotal") or 0.0
     tax = subtotal * config.TAX_RATE
     return {
         "id":             t["id"],
@@ -430,17 +414,12 @@ def favicon():
 @app.route("/")
 @login_required
 def index():
-    _df = get_catalog_df()
-    def _unique_count(code):
-        if _df is None or _df.empty:
-            return 0
-        return int(_df[_df["Supply"] == code]["Description"].nunique())
-
+    counts = count_products_by_supplier()
     stats = {
-        "supply1Count": _unique_count("BPS"),
-        "supply2Count": _unique_count("S2"),
-        "supply3Count": _unique_count("LPS"),
-        "supply4Count": _unique_count("BOND"),
+        "supply1Count": counts.get("BPS", 0),
+        "supply2Count": counts.get("S2", 0),
+        "supply3Count": counts.get("LPS", 0),
+        "supply4Count": counts.get("BOND", 0),
     }
 
     initial = {
@@ -630,10 +609,47 @@ def api_sku_judge():
         app.logger.exception("SKU judge error")
         return jsonify({"error": str(e)}), 500
 
+_GRAPH_MAX_AGE = 300   # seconds browsers may reuse a chart before revalidating
+
+
+def _graph_size(raw: str | None) -> tuple[float, float]:
+    """Parse a ``WxH`` size in inches, clamped to something sane; default 8x6."""
+    try:
+        w, h = (float(v) for v in (raw or "").lower().split("x", 1))
+    except ValueError:
+        return 8.0, 6.0
+    return min(max(w, 2.0), 20.0), min(max(h, 2.0), 20.0)
+
+
+def _render_price_graph(item_df: pd.DataFrame, description: str, size: tuple[float, float]) -> bytes:
+    """Render the price-over-time PNG with the OO Figure API (no pyplot global state)."""
+    fig = Figure(figsize=size)
+    ax = fig.add_subplot()
+    ax.plot(item_df["Date"], item_df["Price per Unit"], marker="o")
+    ax.set_title(f"Prices Over Time for '{description}'")
+    ax.set_xlabel("Date")
+    ax.set_ylabel("Price per Unit")
+    ax.grid(True)
+    for label in ax.get_xticklabels():
+        label.set_rotation(45)
+        label.set_horizontalalignment("right")
+    fig.tight_layout()
+
+    output = io.BytesIO()
+    FigureCanvas(fig).print_png(output)
+    return output.getvalue()
+
+
 @app.route("/graph")
 @login_required
 def graph():
-    """Generate a graph of Price per Unit over time for a given description from the selected supply."""
+    """
+    Generate a graph of Price per Unit over time for a given description from the selected supply.
+
+    PNGs are cached on disk keyed by (supplier, description, catalog generation,
+    size), so repeat views skip the DataFrame filter and matplotlib entirely.
+    The key doubles as the ETag.
+    """
     supply = request.args.get("supply", "supply1")
     description = request.args.get("description")
     if not description:
@@ -641,35 +657,36 @@ def graph():
         return redirect(url_for("index"))
 
     supplier_code = SUPPLY_CODES.get(supply)
-    df = get_catalog_df()
-    if df is None or df.empty:
-        flash("⚠ No data available.")
-        return redirect(url_for("index"))
+    size = _graph_size(request.args.get("size"))
+    key = graph_cache.make_key(
+        supplier_code, description.lower(), get_catalog_generation(), f"{size[0]:g}x{size[1]:g}"
+    )
 
-    item_df = df[
-        (df["Description"].str.lower() == description.lower()) &
-        (df["Supply"] == supplier_code)
-    ].copy()
+    fh = graph_cache.open_cached(key)
+    if fh is None:
+        df = get_catalog_df()
+        if df is None or df.empty:
+            flash("⚠ No data available.")
+            return redirect(url_for("index"))
 
-    if item_df.empty:
-        flash("⚠ No data available for the selected description.")
-        return redirect(url_for("view_all", supply=supply))
+        item_df = df[
+            (df["Description"].str.lower() == description.lower()) &
+            (df["Supply"] == supplier_code)
+        ]
 
-    item_df = item_df.dropna(subset=["Date"]).sort_values(by="Date")
-    fig, ax = plt.subplots(figsize=(8, 6))
-    ax.plot(item_df["Date"], item_df["Price per Unit"], marker="o")
-    ax.set_title(f"Prices Over Time for '{description}'")
-    ax.set_xlabel("Date")
-    ax.set_ylabel("Price per Unit")
-    ax.grid(True)
-    plt.xticks(rotation=45, ha="right")
-    plt.tight_layout()
+        if item_df.empty:
+            flash("⚠ No data available for the selected description.")
+            return redirect(url_for("view_all", supply=supply))
 
-    output = io.BytesIO()
-    FigureCanvas(fig).print_png(output)
-    plt.close(fig)
-    output.seek(0)
-    return send_file(output, mimetype="image/png")
+        item_df = item_df.dropna(subset=["Date"]).sort_values(by="Date")
+        png = _render_price_graph(item_df, description, size)
+        graph_cache.put(key, png)
+        fh = io.BytesIO(png)
+
+    resp = send_file(fh, mimetype="image/png", etag=key, conditional=True, max_age=_GRAPH_MAX_AGE)
+    resp.cache_control.public = False
+    resp.cache_control.private = True
+    return resp
 
 @app.route("/graph_data")
 @login_required
@@ -712,88 +729,311 @@ def analyze():
         "endDate":       default_end.isoformat(),
         "supplyOptions": supply_options,
         "priceIntelApi": url_for("price_intelligence_api"),
+        "priceIntelHistoryApi": url_for("price_intelligence_history_api"),
     }
     return render_app("analyze", initial)
 
 
+def _summarize_movers(movers: list[dict]) -> dict:
+    total     = len(movers)
+    went_up   = sum(1 for m in movers if m["pct_change"] > 0)
+    went_down = sum(1 for m in movers if m["pct_change"] < 0)
+    avg_chg   = round(sum(m["pct_change"] for m in movers) / total, 2) if total else 0
+    return {
+        "total":          total,
+        "went_up":        went_up,
+        "went_down":      went_down,
+        "flat":           total - went_up - went_down,
+        "avg_change_pct": avg_chg,
+    }
+
+
+def _rollup_history(grp: list[dict]) -> list[dict]:
+    """One averaged point per month from price_rollup_monthly rows."""
+    months: dict[str, list[float]] = {}
+    for r in grp:
+        acc = months.setdefault(r["month"], [0.0, 0])
+        acc[0] += float(r["price_sum"] or 0)
+        acc[1] += int(r["line_count"] or 0)
+    return [
+        {"date": f"{m}-01", "price": round(total / n, 4), "invoice_no": ""}
+        for m, (total, n) in sorted(months.items()) if n
+    ]
+
+
+def _rollup_mover(grp: list[dict]) -> dict | None:
+    """Mover summary for one product's rollup rows (no history)."""
+    first = min(grp, key=lambda r: r["first_date"])
+    last  = max(grp, key=lambda r: r["last_date"])
+    first_price = float(first["first_price"] or 0)
+    last_price  = float(last["last_price"] or 0)
+    if first_price <= 0:
+        return None
+    return {
+        "description":      last["display_description"] or last["description"],
+        "item_number":      str(last.get("item_number") or ""),
+        "first_price":      round(first_price, 4),
+        "last_price":       round(last_price, 4),
+        "abs_change":       round(last_price - first_price, 4),
+        "pct_change":       round(((last_price - first_price) / first_price) * 100, 2),
+        "first_date":       first["first_date"],
+        "last_date":        last["last_date"],
+        "first_invoice_no": str(first.get("first_invoice_no") or ""),
+        "last_invoice_no":  str(last.get("last_invoice_no") or ""),
+        "purchase_count":   sum(int(r["line_count"] or 0) for r in grp),
+    }
+
+
+def _purchase_history(grp: pd.DataFrame) -> list[dict]:
+    """One point per purchase from a date-sorted catalog group."""
+    return [
+        {"date": d, "price": round(float(p), 4), "invoice_no": str(inv or "")}
+        for d, p, inv in zip(
+            grp["Date"].dt.strftime("%Y-%m-%d"),
+            grp["Price per Unit"],
+            grp["Invoice No."] if "Invoice No." in grp.columns else [""] * len(grp),
+        )
+    ]
+
+
+def _purchase_mover(desc: str, grp: pd.DataFrame) -> dict | None:
+    """Mover summary for one product's date-sorted catalog rows (no history)."""
+    first_row   = grp.iloc[0]
+    last_row    = grp.iloc[-1]
+    first_price = float(first_row["Price per Unit"])
+    last_price  = float(last_row["Price per Unit"])
+    if first_price <= 0:
+        return None
+    return {
+        "description":      desc,
+        "item_number":      str(first_row.get("Item Number") or ""),
+        "first_price":      round(first_price, 4),
+        "last_price":       round(last_price, 4),
+        "abs_change":       round(last_price - first_price, 4),
+        "pct_change":       round(((last_price - first_price) / first_price) * 100, 2),
+        "first_date":       first_row["Date"].strftime("%Y-%m-%d"),
+        "last_date":        last_row["Date"].strftime("%Y-%m-%d"),
+        "first_invoice_no": str(first_row.get("Invoice No.") or ""),
+        "last_invoice_no":  str(last_row.get("Invoice No.") or ""),
+        "purchase_count":   len(grp),
+    }
+
+
+def _price_intel_groups(supply: str, start_date: str | None, end_date: str | None, granularity: str):
+    """
+    Group the requested window by product for price intelligence.
+
+    Returns ``(groups, mover_fn, history_fn, key_fn)``: ``groups`` maps a group
+    key to that product's rows, ``mover_fn(key, grp)`` builds the mover summary,
+    ``history_fn(grp)`` builds its price history and ``key_fn(description)``
+    maps a description sent by the client back to a group key.
+    ``granularity=month`` reads the monthly rollup (range widened to whole
+    months); anything else scans the in-memory catalog per purchase.
+    """
+    if granularity == "month":
+        rows = get_price_rollup(
+            supplier=None if supply == "all" else supply,
+            start_month=start_date[:7] if start_date else None,
+            end_month=end_date[:7] if end_date else None,
+        )
+        groups: dict = {}
+        for r in rows:
+            groups.setdefault(r["description"], []).append(r)
+        return (groups, lambda _key, grp: _rollup_mover(grp), _rollup_history,
+                lambda d: (d or "").strip().lower())
+
+    # The time index is already date-sorted and groupby keeps row order,
+    # so every group comes out date-sorted
+    wdf = get_catalog_window(supply, start_date, end_date)
+    wdf = wdf[wdf["Price per Unit"].fillna(0) > 0]
+    groups = {desc: grp for desc, grp in wdf.groupby("Description")}
+    return groups, _purchase_mover, _purchase_history, lambda d: d
+
+
+def _price_intel_args():
+    return (
+        request.args.get("supply", "LPS"),
+        request.args.get("start_date"),
+        request.args.get("end_date"),
+        request.args.get("granularity", "purchase"),
+    )
+
+
 @app.route("/api/price-intelligence")
 @login_required
 def price_intelligence_api():
-    supply     = request.args.get("supply", "LPS")
-    start_date = request.args.get("start_date")
-    end_date   = request.args.get("end_date")
+    """
+    Price movers for a supplier and date range.
 
-    df = get_catalog_df()
-    empty_summary = {"total": 0, "went_up": 0, "went_down": 0, "flat": 0, "avg_change_pct": 0}
-    if df is None or df.empty:
-        return jsonify({"movers": [], "summary": empty_summary})
+    ``granularity=month`` answers from the monthly rollup table: the date range
+    is widened to whole months and each mover's history has one point per
+    month.  The default ``purchase`` granularity scans the in-memory catalog
+    and returns every purchase.
 
-    wdf = df.copy()
-    if supply != "all":
-        wdf = wdf[wdf["Supply"] == supply]
+    ``mode=summary`` leaves out each mover's ``history`` array; the client then
+    loads it on demand from /api/price-intelligence/history.
+    ``format=ndjson`` streams the full report for exports: a summary line
+    followed by one mover (with history) per line.
+    """
+    supply, start_date, end_date, granularity = _price_intel_args()
+    groups, mover_fn, history_fn, _ = _price_intel_groups(supply, start_date, end_date, granularity)
 
-    wdf["Date"] = pd.to_datetime(wdf["Date"], errors="coerce")
-    wdf = wdf.dropna(subset=["Date", "Price per Unit"])
-    wdf = wdf[wdf["Price per Unit"] > 0]
+    movers = []
+    for key, grp in groups.items():
+        m = mover_fn(key, grp)
+        if m is not None:
+            m["_key"] = key
+            movers.append(m)
+    movers.sort(key=lambda x: x["pct_change"], reverse=True)
+    summary = _summarize_movers(movers)
+
+    if request.args.get("format") == "ndjson":
+        def _stream():
+            yield json.dumps({"summary": summary}) + "\n"
+            for m in movers:
+                key = m.pop("_key")
+                m["history"] = history_fn(groups[key])
+                yield json.dumps(m) + "\n"
+        return app.response_class(_stream(), mimetype="application/x-ndjson")
+
+    include_history = request.args.get("mode") != "summary"
+    for m in movers:
+        key = m.pop("_key")
+        if include_history:
+            m["history"] = history_fn(groups[key])
+    return jsonify({"movers": movers, "summary": summary})
+
+
+@app.route("/api/price-intelligence/history", methods=["GET", "POST"])
+@login_required
+def price_intelligence_history_api():
+    """
+    Price history for a batch of descriptions, keyed by description.
 
-    if start_date:
-        wdf = wdf[wdf["Date"] >= pd.to_datetime(start_date)]
-    if end_date:
-        wdf = wdf[wdf["Date"] <= pd.to_datetime(end_date)]
+    Takes the same supply/start_date/end_date/granularity arguments as
+    /api/price-intelligence; descriptions come from repeated ``description``
+    query args or a JSON body ``{"descriptions": [...]}``.
+    """
+    supply, start_date, end_date, granularity = _price_intel_args()
+    descriptions = request.args.getlist("description")
+    if request.method == "POST":
+        body = request.get_json(force=True, silent=True) or {}
+        descriptions += [d for d in body.get("descriptions", []) if isinstance(d, str)]
+    if not descriptions:
+        return jsonify({"history": {}})
 
-    if wdf.empty:
-        return jsonify({"movers": [], "summary": empty_summary})
+    groups, _, history_fn, key_fn = _price_intel_groups(supply, start_date, end_date, granularity)
+    history = {}
+    for desc in descriptions:
+        grp = groups.get(key_fn(desc))
+        history[desc] = history_fn(grp) if grp is not None else []
+    return jsonify({"history": history})
 
-    movers = []
-    for desc, grp in wdf.groupby("Description"):
-        grp         = grp.sort_values("Date")
-        first_row   = grp.iloc[0]
-        last_row    = grp.iloc[-1]
-        first_price = float(first_row["Price per Unit"])
-        last_price  = float(last_row["Price per Unit"])
-        if first_price <= 0:
-            continue
-        pct_change = round(((last_price - first_price) / first_price) * 100, 2)
-        abs_change = round(last_price - first_price, 4)
-        history = [
-            {
-                "date":       row["Date"].strftime("%Y-%m-%d"),
-                "price":      round(float(row["Price per Unit"]), 4),
-                "invoice_no": str(row.get("Invoice No.") or ""),
-            }
-            for _, row in grp.iterrows()
-        ]
-        movers.append({
-            "description":      desc,
-            "item_number":      str(first_row.get("Item Number") or ""),
-            "first_price":      round(first_price, 4),
-            "last_price":       round(last_price, 4),
-            "abs_change":       abs_change,
-            "pct_change":       pct_change,
-            "first_date":       first_row["Date"].strftime("%Y-%m-%d"),
-            "last_date":        last_row["Date"].strftime("%Y-%m-%d"),
-            "first_invoice_no": str(first_row.get("Invoice No.") or ""),
-            "last_invoice_no":  str(last_row.get("Invoice No.") or ""),
-            "purchase_count":   len(grp),
-            "history":          history,
+
+@app.route("/api/spend")
+@login_required
+def spend_api():
+    """
+    Spend analytics from the precomputed spend cube.
+
+    Query args:
+      group_by     comma list of supplier, month, job, description (default supplier)
+      supplier     exact supplier code          job   exact job name ('' = no job)
+      q            substring of the description
+      start_date / end_date (or start_month / end_month) — whole months, inclusive
+      sort         spend | quantity | lines (default spend)    limit (default 500, max 5000)
+
+    Returns the grouped rows plus a grand total for the same slice.
+    """
+    group_by = [d.strip() for d in request.args.get("group_by", "supplier").split(",") if d.strip()]
+    unknown = [d for d in group_by if d not in SPEND_DIMENSIONS]
+    if unknown:
+        return jsonify({"error": f"Unknown group_by dimension(s): {', '.join(unknown)}"}), 400
+
+    start = request.args.get("start_month") or request.args.get("start_date")
+    end   = request.args.get("end_month") or request.args.get("end_date")
+    try:
+        limit = min(max(int(request.args.get("limit", 500)), 1), 5000)
+    except ValueError:
+        return jsonify({"error": "limit must be an integer"}), 400
+
+    slice_args = dict(
+        supplier=request.args.get("supplier") or None,
+        job=request.args.get("job"),
+        description=request.args.get("q") or None,
+        start_month=start[:7] if start else None,
+        end_month=end[:7] if end else None,
+    )
+    rows = query_spend(group_by, sort=request.args.get("sort", "spend"), limit=limit, **slice_args)
+    total = query_spend([], **slice_args)[0]
+    return jsonify({"group_by": group_by, "rows": rows, "total": total})
+
+
+@app.route("/compare")
+@login_required
+def compare():
+    """Cross-supplier comparison of products grouped by build_product_groups.py."""
+    return render_app("compare", {"compareApi": url_for("compare_api")})
+
+
+@app.route("/api/compare")
+@login_required
+def compare_api():
+    """
+    Equivalence groups with each member's latest price, cheapest first.
+
+    Groups come from the product_groups table; prices are the most recent
+    purchase of each (supplier, description) in the in-memory catalog.
+    """
+    rows = get_product_groups()
+    if not rows:
+        return jsonify({"groups": []})
+
+    latest: dict[tuple, dict] = {}
+    df = get_catalog_df()
+    if df is not None and not df.empty:
+        ldf = df.dropna(subset=["Price per Unit"])
+        ldf = ldf[ldf["Price per Unit"] > 0].sort_values("Date", kind="stable")
+        ldf = ldf.drop_duplicates(subset=["Supply", "Description"], keep="last")
+        for sup, desc, price, date, item_no in zip(
+            ldf["Supply"], ldf["Description"], ldf["Price per Unit"], ldf["Date"], ldf["Item Number"]
+        ):
+            latest[(sup, desc)] = {"last_price": round(float(price), 4), "last_date": date,
+                                   "item_number": str(item_no or "")}
+
+    by_group: dict[int, dict] = {}
+    for r in rows:
+        g = by_group.setdefault(int(r["group_id"]), {
+            "group_id":   int(r["group_id"]),
+            "method":     r["method"],
+            "confidence": float(r["confidence"] or 0),
+            "members":    [],
+        })
+        info = latest.get((r["supplier"], r["description"]), {})
+        g["members"].append({
+            "supplier":    r["supplier"],
+            "description": r["description"],
+            "item_number": info.get("item_number", ""),
+            "last_price":  info.get("last_price"),
+            "last_date":   info.get("last_date"),
         })
 
-    total     = len(movers)
-    went_up   = sum(1 for m in movers if m["pct_change"] > 0)
-    went_down = sum(1 for m in movers if m["pct_change"] < 0)
-    avg_chg   = round(sum(m["pct_change"] for m in movers) / total, 2) if total else 0
-    movers.sort(key=lambda x: x["pct_change"], reverse=True)
+    groups = []
+    for g in by_group.values():
+        priced = [m for m in g["members"] if m["last_price"] is not None]
+        if not priced:
+            continue
+        priced.sort(key=lambda m: m["last_price"])
+        g["members"] = priced + [m for m in g["members"] if m["last_price"] is None]
+        lo, hi = priced[0]["last_price"], priced[-1]["last_price"]
+        g["cheapest_supplier"] = priced[0]["supplier"]
+        g["savings"]    = round(hi - lo, 4)
+        g["spread_pct"] = round((hi - lo) / lo * 100, 2) if lo else 0
+        groups.append(g)
+
+    groups.sort(key=lambda g: g["spread_pct"], reverse=True)
+    return jsonify({"groups": groups})
 
-    return jsonify({
-        "movers": movers,
-        "summary": {
-            "total":          total,
-            "went_up":        went_up,
-            "went_down":      went_down,
-            "flat":           total - went_up - went_down,
-            "avg_change_pct": avg_chg,
-        },
-    })
 
 @app.route("/product_detail", methods=["GET"])
 @login_required
@@ -939,22 +1179,26 @@ def material_list():
     viewer_email = session.get("email", "")
     viewer_role  = session.get("role", "user")
     db_templates = list_templates_db(viewer_email, viewer_role)
-    custom_templates = {}
+    custom_templates = set()
     template_folders = set()
     for t in db_templates:
         folder    = t.get("folder", "")
         tname     = t["name"]
-        full_name = f"{folder}/{tname}" if folder else tname
+        custom_templates.add(f"{folder}/{tname}" if folder else tname)
         if folder:
             template_folders.add(folder)
+    # Only the selected template's data is fetched
+    raw_template = None
+    if list_option in custom_templates:
+        opt_folder, opt_name = _split_template_path(list_option)
+        selected = get_template_db(opt_name, opt_folder, viewer_email, viewer_role)
         try:
-            custom_templates[full_name] = json.loads(t["data"])
+            raw_template = json.loads(selected["data"]) if selected else None
         except Exception:
-            pass
+            raw_template = None
     list_option_lower = list_option.lower()
     project_info = {"contractor": "", "address": "", "date": ""}
-    if list_option in custom_templates:
-        raw_template = custom_templates[list_option]
+    if raw_template is not None:
         if isinstance(raw_template, dict):
             project_info = raw_template.get("project_info", project_info)
             raw_list = raw_template.get("products", [])
@@ -1035,7 +1279,7 @@ def material_list():
         "listOption": list_option,
         "products": product_list,
         "projectInfo": project_info,
-        "customTemplates": sorted(custom_templates.keys()),
+        "customTemplates": sorted(custom_templates),
         "templateFolders": sorted(template_folders),
         "templateName": template_name,
         "templateFolder": template_folder,
@@ -1369,15 +1613,10 @@ def _estimate_entry(e: dict) -> dict:
         mtime = datetime.strptime(e["updated_at"], "%Y-%m-%d %H:%M:%S").timestamp()
     except Exception:
         mtime = 0.0
-    try:
-        content  = json.loads(e["data"])
-        sections = content.get("sections", [])
-        row_count = sum(len(s.get("rows", [])) for s in sections)
-        plumbing_total = content.get("plumbing_total", 0.0)
-        gas_total      = content.get("gas_total", 0.0)
-        grand_total    = content.get("grand_total", plumbing_total)
-    except Exception:
-        row_count, plumbing_total, gas_total, grand_total = 0, 0.0, 0.0, 0.0
+    row_count      = e.get("row_count") or 0
+    plumbing_total = e.get("plumbing_total") or 0.0
+    gas_total      = e.get("gas_total") or 0.0
+    grand_total    = e.get("grand_total") or 0.0
     return {
         "id":             e["id"],
         "name":           name,
@@ -1506,6 +1745,7 @@ def estimate_builder():
         "estimateFolder": "" if name else pre_folder,
         "content":        content,
         "saveUrl":        url_for("save_estimate"),
+        "patchUrl":       url_for("patch_estimate"),
         "exportPdfUrl":   url_for("export_estimate_pdf"),
         "exportXlsUrl":   url_for("export_estimate_excel"),
         "catalogUrl":     url_for("api_estimate_catalog"),
@@ -1522,59 +1762,46 @@ def estimate_builder():
     })
 
 
-@app.route("/save_estimate", methods=["POST"])
-@login_required
-def save_estimate():
-    estimate_name = request.form.get("estimate_name", "").strip()
-    data_json     = request.form.get("estimate_data", "")
-    if not estimate_name or not data_json:
-        return jsonify({"ok": False, "error": "Missing name or data"}), 400
+def _scenario_totals(scenario: dict) -> None:
+    """Recompute a scenario's plumbing / gas / grand totals from its section rows."""
+    secs = scenario.get("sections", [])
+    plumbing_total = sum(
+        float(r.get("total") or 0)
+        for s in secs if not s.get("is_gas") and not s.get("below_line")
+        for r in s.get("rows", [])
+    )
+    gas_total = sum(
+        float(r.get("total") or 0)
+        for s in secs if s.get("is_gas")
+        for r in s.get("rows", [])
+    )
+    scenario["plumbing_total"] = round(plumbing_total, 2)
+    scenario["gas_total"]      = round(gas_total, 2)
+    scenario["grand_total"]    = round(plumbing_total + gas_total, 2)
 
-    folder, ename = _split_template_path(estimate_name)
 
-    # Keep totals up to date
+def _sync_estimate_catalog(display_name: str, content: dict) -> None:
+    """Replace this estimate's catalog usage with its current rows (one write batch)."""
     try:
-        content = json.loads(data_json)
-        content = _normalize_estimate_content(content)
-        for scenario in content.get("scenarios", []):
-            secs = scenario.get("sections", [])
-            plumbing_total = sum(
-                float(r.get("total") or 0)
-                for s in secs if not s.get("is_gas") and not s.get("below_line")
-                for r in s.get("rows", [])
-            )
-            gas_total = sum(
-                float(r.get("total") or 0)
-                for s in secs if s.get("is_gas")
-                for r in s.get("rows", [])
-            )
-            scenario["plumbing_total"] = round(plumbing_total, 2)
-            scenario["gas_total"]      = round(gas_total, 2)
-            scenario["grand_total"]    = round(plumbing_total + gas_total, 2)
-        data_json = json.dumps(content)
+        sync_estimate_catalog(display_name, [
+            {
+                "description":  row["description"].strip(),
+                "unit_cost":    float(row.get("unit_cost") or 0),
+                "comments":     row.get("comments", ""),
+                "add_comments": row.get("add_comments", ""),
+                "category":     section.get("name", ""),
+            }
+            for scenario in content.get("scenarios", [])
+            for section in scenario.get("sections", [])
+            for row in section.get("rows", [])
+            if row.get("description", "").strip()
+        ])
     except Exception:
         pass
 
-    # Sync catalog: wipe old usage for this estimate, then re-add all current rows
-    try:
-        display_name = f"{folder}/{ename}" if folder else ename
-        clear_estimate_catalog_usage(display_name)
-        for scenario in content.get("scenarios", []):
-            for section in scenario.get("sections", []):
-                for row in section.get("rows", []):
-                    if row.get("description", "").strip():
-                        upsert_estimate_catalog(
-                            description   = row["description"].strip(),
-                            unit_cost     = float(row.get("unit_cost") or 0),
-                            comments      = row.get("comments", ""),
-                            add_comments  = row.get("add_comments", ""),
-                            category      = section.get("name", ""),
-                            estimate_name = display_name,
-                        )
-    except Exception:
-        pass
 
-    # Sync fixture catalog and save any new fixture types
+def _sync_estimate_fixtures(display_name: str, content: dict) -> None:
+    """Sync the fixture catalog and save any new fixture types."""
     try:
         fixture_packages = content.get("fixture_packages", [])
         sync_fixture_catalog(display_name, fixture_packages)
@@ -1588,12 +1815,111 @@ def save_estimate():
     except Exception as _fe:
         print(f"[save_estimate] fixture sync error: {_fe}")
 
-    est_key = f"{folder}/{ename}" if folder else ename
-    tid = save_estimate_db(ename, folder, session["email"], session.get("role", "user"), data_json)
-    if tid is None:
+
+@app.route("/save_estimate", methods=["POST"])
+@login_required
+def save_estimate():
+    estimate_name = request.form.get("estimate_name", "").strip()
+    data_json     = request.form.get("estimate_data", "")
+    if not estimate_name or not data_json:
+        return jsonify({"ok": False, "error": "Missing name or data"}), 400
+
+    folder, ename = _split_template_path(estimate_name)
+    display_name  = f"{folder}/{ename}" if folder else ename
+
+    # Keep totals up to date
+    content = {}
+    try:
+        content = json.loads(data_json)
+        content = _normalize_estimate_content(content)
+        for scenario in content.get("scenarios", []):
+            _scenario_totals(scenario)
+        data_json = json.dumps(content)
+    except Exception:
+        pass
+
+    _sync_estimate_catalog(display_name, content)
+    _sync_estimate_fixtures(display_name, content)
+
+    saved = save_estimate_db(ename, folder, session["email"], session.get("role", "user"), data_json)
+    if saved is None:
         return jsonify({"ok": False, "error": "Access denied"}), 403
-    sync_warn = pop_turso_sync_error(est_key)
-    return jsonify({"ok": True, "id": tid, **({"sync_warning": sync_warn} if sync_warn else {})})
+    sync_warn = pop_turso_sync_error(display_name)
+    return jsonify({"ok": True, "id": saved["id"], "revision": saved["revision"],
+                    **({"sync_warning": sync_warn} if sync_warn else {})})
+
+
+@app.route("/api/estimates/patch", methods=["POST"])
+@login_required
+def patch_estimate():
+    """
+    Incremental save: apply RFC 6902 operations to the estimate as stored at
+    ``revision``.  Only scenarios the patch touches get their totals
+    recomputed, and the catalogs are only resynced when rows or fixture
+    packages changed.  A revision mismatch (or a patch that doesn't apply)
+    answers 409 with the current revision — the client then does a full
+    /save_estimate.
+    """
+    body          = request.get_json(force=True, silent=True) or {}
+    estimate_name = str(body.get("estimate_name", "")).strip()
+    revision      = body.get("revision")
+    patch         = body.get("patch")
+    if not estimate_name or not isinstance(revision, int) or not isinstance(patch, list):
+        return jsonify({"ok": False, "error": "Missing name, revision or patch"}), 400
+
+    folder, ename = _split_template_path(estimate_name)
+    display_name  = f"{folder}/{ename}" if folder else ename
+    email, role   = session["email"], session.get("role", "user")
+
+    e = get_estimate_db(ename, folder, email, role, local=True)
+    if e is None:
+        return jsonify({"ok": False, "conflict": True, "error": "Estimate not found"}), 409
+    current = int(e["revision"] or 0)
+    if current != revision:
+        return jsonify({"ok": False, "conflict": True, "revision": current}), 409
+    try:
+        content = apply_patch(json.loads(e["data"]), patch)
+    except (JsonPatchError, ValueError) as exc:     # bad patch, or a stored blob that isn't JSON
+        return jsonify({"ok": False, "conflict": True, "revision": current, "error": str(exc)}), 409
+    if not isinstance(content, dict):
+        return jsonify({"ok": False, "conflict": True, "revision": current,
+                        "error": "Patched estimate is not an object"}), 409
+
+    # Top-level keys and scenario indexes the patch touched ("*" = every scenario)
+    touched, scenarios = set(), set()
+    for op in patch:
+        for path in (op.get("path"), op.get("from")):
+            if not isinstance(path, str):
+                continue
+            parts = path.split("/")
+            key   = parts[1] if len(parts) > 1 else ""
+            touched.add(key)
+            if key == "":
+                scenarios.add("*")
+            elif key == "scenarios":
+                scenarios.add(parts[2] if len(parts) > 3 and parts[2].isdigit() else "*")
+    try:
+        content = _normalize_estimate_content(content)
+        for i, scenario in enumerate(content.get("scenarios", [])):
+            if "*" in scenarios or str(i) in scenarios:
+                _scenario_totals(scenario)
+    except (AttributeError, TypeError, ValueError) as exc:   # malformed scenario, section or total
+        return jsonify({"ok": False, "conflict": True, "revision": current,
+                        "error": f"Patched estimate is malformed: {exc}"}), 409
+
+    saved = save_estimate_db(ename, folder, email, role, json.dumps(content), revision=revision)
+    if saved is None:
+        return jsonify({"ok": False, "conflict": True, "error": "Estimate changed while saving"}), 409
+
+    # Only resync once the save has won, so a losing patch can't leave the
+    # catalogs describing content that was never stored
+    if touched & {"", "scenarios"}:
+        _sync_estimate_catalog(display_name, content)
+    if touched & {"", "fixture_packages"}:
+        _sync_estimate_fixtures(display_name, content)
+    sync_warn = pop_turso_sync_error(display_name)
+    return jsonify({"ok": True, "id": saved["id"], "revision": saved["revision"],
+                    **({"sync_warning": sync_warn} if sync_warn else {})})
 
 
 @app.route("/delete_estimate/<path:name>", methods=["POST"])
@@ -2507,6 +2833,7 @@ def admin_users():
         add_url=url_for("admin_add_user"),
         toggle_url=url_for("admin_toggle_user"),
         role_url=url_for("admin_set_role"),
+        retention=get_retention_last(),
     )
 
 
@@ -2591,6 +2918,98 @@ def admin_migrate_templates():
     return redirect(url_for("admin_users"))
 
 
+@app.route("/admin/rebuild_price_rollup", methods=["POST"])
+@admin_required
+def admin_rebuild_price_rollup():
+    """Recompute the monthly price rollup from raw invoice lines."""
+    try:
+        written = rebuild_price_rollup()
+        flash(f"Price rollup rebuilt: {written} monthly rows.", "success")
+    except Exception as e:
+        app.logger.error(f"Price rollup rebuild error: {e}")
+        flash(f"Price rollup rebuild failed: {e}", "danger")
+    return redirect(url_for("admin_users"))
+
+
+@app.route("/admin/rebuild_price_stats", methods=["POST"])
+@admin_required
+def admin_rebuild_price_stats():
+    """Replay invoice history to recompute running price stats and outlier flags."""
+    try:
+        result = rebuild_price_stats()
+        flash(f"Price stats rebuilt: {result['products']} products, {result['flagged']} lines flagged.", "success")
+    except Exception as e:
+        app.logger.error(f"Price stats rebuild error: {e}")
+        flash(f"Price stats rebuild failed: {e}", "danger")
+    return redirect(url_for("admin_users"))
+
+
+@app.route("/admin/build_product_groups", methods=["POST"])
+@admin_required
+def admin_build_product_groups():
+    """Start the cross-supplier grouping job in the background (LLM calls can take minutes)."""
+    from build_product_groups import build
+
+    def _run():
+        try:
+            stats = build(use_llm=True, save=True)
+            stats.pop("sample", None)
+            app.logger.info(f"Product groups rebuilt: {stats}")
+        except Exception as e:
+            app.logger.error(f"Product group build error: {e}")
+
+    threading.Thread(target=_run, daemon=True).start()
+    flash("Product grouping started — the Compare page updates when it finishes.", "success")
+    return redirect(url_for("admin_users"))
+
+
+# ── Retention ─────────────────────────────────────────────────────────────────
+# Prunes version history and login events every RETENTION_INTERVAL_HOURS on a
+# daemon thread; admins can also start a run.  Every worker process runs the
+# loop, so the database lease in run_retention lets one run at a time, and a
+# worker skips its turn when another already ran within the interval.  The
+# last run's stats (stored in the database) are shown on the user management
+# page.
+
+def _run_retention() -> dict | None:
+    stats = run_retention(config.VERSION_KEEP_ALL_HOURS, config.VERSION_KEEP_HOURLY_DAYS,
+                          config.LOGIN_HISTORY_KEEP_DAYS, config.RETENTION_BATCH_SIZE)
+    if stats is not None:
+        app.logger.info(f"Retention run: {stats}")
+    return stats
+
+
+def _retention_loop() -> None:
+    while True:
+        time.sleep(config.RETENTION_INTERVAL_HOURS * 3600)
+        try:
+            due = (datetime.utcnow() - timedelta(hours=config.RETENTION_INTERVAL_HOURS)).strftime("%Y-%m-%d %H:%M:%S")
+            if get_retention_last().get("started_at", "") <= due:
+                _run_retention()
+        except Exception as e:
+            app.logger.error(f"Retention run failed: {e}")
+
+
+if config.RETENTION_INTERVAL_HOURS > 0:
+    threading.Thread(target=_retention_loop, daemon=True, name="retention").start()
+
+
+@app.route("/admin/run_retention", methods=["POST"])
+@admin_required
+def admin_run_retention():
+    """Start a retention run in the background; stats appear on the admin page when it finishes."""
+    def _run():
+        try:
+            if _run_retention() is None:
+                app.logger.info("Retention run skipped — one is already in progress.")
+        except Exception as e:
+            app.logger.error(f"Retention run failed: {e}")
+
+    threading.Thread(target=_run, daemon=True).start()
+    flash("Version retention started — reload this page to see what was reclaimed.", "success")
+    return redirect(url_for("admin_users"))
+
+
 @app.route("/admin/login_history")
 @admin_required
 def admin_login_history():
@@ -2613,9 +3032,12 @@ def admin_login_history():
 def upload_pdf():
     """
     GET  — show the upload page (history of imported docs + upload form)
-    POST — accept a PDF, parse it, save to DB, return result
+    POST — accept a PDF and parse it (nothing is saved).  With form field
+           async=1 a cache miss is queued as a background job: the response is
+           202 with a job id, polled at /api/jobs/<id>.
     """
     _SUPPLIERS = [
+        {"code": "AUTO", "label": "Auto-detected"},
         {"code": "LPS",  "label": "Lion Plumbing Supply"},
         {"code": "BPS",  "label": "Berger Plumbing Supply"},
         {"code": "S2",   "label": "Supply 2"},
@@ -2629,6 +3051,7 @@ def upload_pdf():
             "uploadUrl": url_for("upload_pdf"),
             "deleteUrl": url_for("delete_invoice_route"),
             "confirmUrl": url_for("confirm_upload"),
+            "batchUploadUrl": url_for("upload_pdf_batch"),
             "suppliers": _SUPPLIERS,
         }
         return render_app("upload_pdf", initial)
@@ -2642,26 +3065,115 @@ def upload_pdf():
         return jsonify({"success": False, "error": "Please upload a PDF file"}), 400
 
     supplier = request.form.get("supplier", "LPS")
+    run_async = request.form.get("async") == "1"
 
-    with tempfile.NamedTemporaryFile(suffix=".pdf", delete=False) as tmp:
-        pdf_file.save(tmp.name)
-        tmp_path = tmp.name
+    tmp_path, sha256 = parse_cache.spool(pdf_file.stream)
+    queued = False
 
     try:
-        parsed = parse_pdf(tmp_path, supplier=supplier)
+        existing = find_invoice_by_hash(sha256)
+        if existing:
+            return jsonify(_hash_duplicate_payload(existing)), 409
+        parsed = parse_cache.get(sha256, supplier)
+        if parsed is None and run_async:
+            if count_active_parse_jobs(config.PDF_JOB_STALE_SECONDS) >= config.PDF_JOB_MAX_PENDING:
+                return jsonify({"success": False, "error": "The parser is busy. Please try again shortly."}), 429
+            job_id = uuid.uuid4().hex
+            create_parse_job(job_id, pdf_file.filename, supplier, sha256,
+                             session.get("email", ""), config.PDF_JOB_TTL_SECONDS)
+            _get_job_executor().submit(_run_parse_job, job_id, tmp_path, supplier, sha256)
+            queued = True
+            return jsonify({
+                "success": True,
+                "queued": True,
+                "job_id": job_id,
+                "status_url": url_for("parse_job_status", job_id=job_id),
+            }), 202
+        if parsed is None:
+            parsed = parse_pdf(tmp_path, supplier=supplier)
+            parse_cache.put(sha256, supplier, parsed)
     except ValueError as e:
         return jsonify({"success": False, "error": str(e)}), 400
     except Exception as e:
         app.logger.error(f"PDF parse error: {e}")
         return jsonify({"success": False, "error": "Failed to parse PDF. Check server logs."}), 500
+    finally:
+        if not queued:      # a queued job's worker owns (and removes) the temp file
+            try:
+                os.unlink(tmp_path)
+            except Exception:
+                pass
+
+    return jsonify(_parsed_payload(parsed, sha256))
+
+
+# ── Background parse jobs ─────────────────────────────────────────────────────
+# A small thread pool bounds how many uploads parse at once; each thread hands
+# the CPU-bound parse to the shared process pool and records the outcome in the
+# parse_jobs table, so any web worker can answer /api/jobs/<id>.
+
+_job_executor: ThreadPoolExecutor | None = None
+_job_executor_lock = threading.Lock()
+
+
+def _get_job_executor() -> ThreadPoolExecutor:
+    global _job_executor
+    with _job_executor_lock:
+        if _job_executor is None:
+            _job_executor = ThreadPoolExecutor(max_workers=max(1, config.PDF_JOB_WORKERS),
+                                               thread_name_prefix="pdf-job")
+        return _job_executor
+
+
+def _run_parse_job(job_id: str, path: str, supplier: str, sha256: str) -> None:
+    """Worker thread: parse one queued upload and store the result on the job."""
+    try:
+        update_parse_job(job_id, "running")
+        parsed = _get_pdf_pool().submit(parse_pdf, path, supplier, False).result()
+        parse_cache.put(sha256, supplier, parsed)
+        update_parse_job(job_id, "done", result=_parsed_payload(parsed, sha256))
+    except ValueError as e:
+        update_parse_job(job_id, "failed", error=str(e))
+    except Exception as e:
+        if isinstance(e, BrokenProcessPool):
+            _reset_pdf_pool()
+        app.logger.error(f"PDF parse job {job_id} failed: {e}")
+        update_parse_job(job_id, "failed", error="Failed to parse PDF. Check server logs.")
     finally:
         try:
-            os.unlink(tmp_path)
+            os.unlink(path)
         except Exception:
             pass
 
+
+@app.route("/api/jobs/<job_id>")
+@login_required
+def parse_job_status(job_id):
+    """
+    Status of a background parse job: queued | running | done | failed.
+    A done job carries the /upload_pdf parse payload as ``result``.
+    """
+    job = get_parse_job(job_id, config.PDF_JOB_STALE_SECONDS)
+    if job is None or (job["created_by"] != session.get("email") and session.get("role") != "admin"):
+        return jsonify({"success": False, "error": "Job not found or expired."}), 404
     return jsonify({
+        "success":    job["status"] != "failed",
+        "id":         job["id"],
+        "status":     job["status"],
+        "filename":   job["filename"],
+        "created_at": job["created_at"],
+        "updated_at": job["updated_at"],
+        "expires_at": job["expires_at"],
+        "result":     job["result"],
+        "error":      job["error"],
+    })
+
+
+def _parsed_payload(parsed: dict, sha256: str = "") -> dict:
+    """Response body for a successfully parsed (not yet saved) PDF."""
+    return {
         "success": True,
+        "sha256": sha256,
         "doc_type": parsed["doc_type"],
         "order_number": parsed["order_number"],
         "date": parsed["date"],
@@ -2669,7 +3181,141 @@ def upload_pdf():
         "supplier": parsed["supplier"],
         "item_count": len(parsed["items"]),
         "items": parsed["items"],
-    })
+    }
+
+
+def _hash_duplicate_payload(existing: dict) -> dict:
+    """Response body for an upload whose exact file was already imported."""
+    return {
+        "success": False,
+        "duplicate": True,
+        "invoice_id": existing["id"],
+        "error": (f"This file was already imported as {existing['doc_type']} "
+                  f"{existing['order_number']} ({existing.get('filename') or 'unnamed'})."),
+    }
+
+
+_pdf_pool: ProcessPoolExecutor | None = None
+_pdf_pool_lock = threading.Lock()
+
+
+def _get_pdf_pool() -> ProcessPoolExecutor:
+    """Shared parser process pool, created on first batch upload."""
+    global _pdf_pool
+    with _pdf_pool_lock:
+        if _pdf_pool is None:
+            _pdf_pool = ProcessPoolExecutor(max_workers=max(1, config.PDF_PARSE_WORKERS))
+        return _pdf_pool
+
+
+def _reset_pdf_pool() -> None:
+    """Drop a pool whose worker died so the next batch starts a fresh one."""
+    global _pdf_pool
+    with _pdf_pool_lock:
+        if _pdf_pool is not None:
+            _pdf_pool.shutdown(wait=False, cancel_futures=True)
+        _pdf_pool = None
+
+
+@app.route("/upload_pdf/batch", methods=["POST"])
+@login_required
+def upload_pdf_batch():
+    """
+    Parse many PDFs at once (nothing is saved).
+
+    Files come in as repeated ``pdf_files`` fields with one ``supplier``.
+    Parsing runs in a process pool sized to the CPU count, and results stream
+    back as each file finishes — NDJSON by default, server-sent events with
+    ``?format=sse``.  Every message carries the file's ``index`` and
+    ``filename`` plus the /upload_pdf parse result (or ``error``); the last one
+    is a ``{"done": true, ...}`` summary.
+    """
+    files = [f for f in request.files.getlist("pdf_files") if f and f.filename]
+    if not files:
+        return jsonify({"success": False, "error": "No files uploaded"}), 400
+    if len(files) > config.PDF_BATCH_MAX_FILES:
+        return jsonify({
+            "success": False,
+            "error": f"At most {config.PDF_BATCH_MAX_FILES} files per batch.",
+        }), 400
+
+    supplier = request.form.get("supplier", "LPS")
+    use_sse  = request.args.get("format") == "sse"
+
+    # Spool uploads to disk now — the request body is gone once streaming starts
+    jobs: list[tuple[int, str, str | None, str]] = []
+    for idx, f in enumerate(files):
+        if not f.filename.lower().endswith(".pdf"):
+            jobs.append((idx, f.filename, None, ""))
+            continue
+        jobs.append((idx, f.filename, *parse_cache.spool(f.stream)))
+
+    def _message(payload: dict) -> str:
+        if use_sse:
+            return f"data: {json.dumps(payload)}\n\n"
+        return json.dumps(payload) + "\n"
+
+    def _stream():
+        started = time.perf_counter()
+        ok = failed = 0
+        futures = {}
+        try:
+            pool = _get_pdf_pool()
+            for idx, name, path, sha256 in jobs:
+                if path is None:
+                    failed += 1
+                    yield _message({"index": idx, "filename": name, "success": False,
+                                    "error": "Not a PDF file"})
+                    continue
+                existing = find_invoice_by_hash(sha256)
+                if existing:
+                    failed += 1
+                    yield _message({"index": idx, "filename": name, **_hash_duplicate_payload(existing)})
+                    continue
+                cached = parse_cache.get(sha256, supplier)
+                if cached is not None:
+                    ok += 1
+                    yield _message({"index": idx, "filename": name, **_parsed_payload(cached, sha256)})
+                    continue
+                futures[pool.submit(parse_pdf, path, supplier, False)] = (idx, name, sha256)
+
+            for fut in as_completed(futures):
+                idx, name, sha256 = futures[fut]
+                try:
+                    parsed = fut.result()
+                    parse_cache.put(sha256, supplier, parsed)
+                    body = _parsed_payload(parsed, sha256)
+                    ok += 1
+                except ValueError as e:
+                    body = {"success": False, "error": str(e)}
+                    failed += 1
+                except Exception as e:
+                    if isinstance(e, BrokenProcessPool):
+                        _reset_pdf_pool()
+                    app.logger.error(f"PDF parse error ({name}): {e}")
+                    body = {"success": False, "error": "Failed to parse PDF. Check server logs."}
+                    failed += 1
+                yield _message({"index": idx, "filename": name, **body})
+
+            yield _message({
+                "done": True, "files": len(jobs), "succeeded": ok, "failed": failed,
+                "seconds": round(time.perf_counter() - started, 2),
+            })
+        finally:
+            for fut in futures:
+                fut.cancel()
+            for _, _, path, _ in jobs:
+                if path:
+                    try:
+                        os.unlink(path)
+                    except Exception:
+                        pass
+
+    mimetype = "text/event-stream" if use_sse else "application/x-ndjson"
+    resp = app.response_class(_stream(), mimetype=mimetype)
+    resp.headers["Cache-Control"] = "no-cache"
+    resp.headers["X-Accel-Buffering"] = "no"
+    return resp
 
 
 @app.route("/delete_invoice", methods=["POST"])
@@ -2696,6 +3342,7 @@ def confirm_upload():
     print(f"confirm_upload received: {body}")
     parsed = body.get("parsed")
     filename = body.get("filename", "")
+    job_id = body.get("job_id")
 
     if not parsed or not isinstance(parsed, dict):
         return jsonify({"success": False, "error": "No parsed data provided."}), 400
@@ -2705,7 +3352,11 @@ def confirm_upload():
     if missing:
         return jsonify({"success": False, "error": f"Missing fields: {missing}"}), 400
 
-    invoice_id = save_parsed_document(parsed, filename=filename)
+    anomalies: list[dict] = []
+    invoice_id = save_parsed_document(parsed, filename=filename, anomalies=anomalies)
+
+    if job_id:
+        delete_parse_job(str(job_id), session["email"])    # the parsed result has served its purpose
 
     if invoice_id == -1:
         return jsonify({
@@ -2724,6 +3375,7 @@ def confirm_upload():
         "date": parsed.get("date", ""),
         "job_name": parsed.get("job_name", ""),
         "item_count": len(parsed["items"]),
+        "price_anomalies": anomalies,
     })
 
 
@@ -0,0 +1,197 @@
+"""
+bench_pdf_parser.py — Benchmark pdf_parser over the bundled invoice corpus and
+check its output against golden JSON.
+
+The corpus is every PDF in "Invoices berger/" plus Invoice_473658-01.pdf
+(skipped when the folder already holds a file of that name).
+Each file is timed in stages — open (the text backend's open), extract_text
+(all pages), detect (registry detectors on page 0) and parse (regex line
+matching over the page texts) — and the full parse_pdf output is compared
+with golden/pdf_parser/<file>.json, so a speed change that alters any parsed
+item fails the run.  By default every format uses its registered backend;
+--backend forces one for comparison.
+
+Usage:
+    python bench_pdf_parser.py                   # benchmark + golden check
+    python bench_pdf_parser.py --repeat 3        # best of 3 runs per file
+    python bench_pdf_parser.py --backend pdfplumber  # force a text backend
+    python bench_pdf_parser.py --memory          # also report tracemalloc peak
+    python bench_pdf_parser.py --update-golden   # rewrite the golden files
+    python bench_pdf_parser.py --json            # machine-readable summary
+"""
+
+import argparse
+import glob
+import json
+import os
+import resource
+import sys
+import time
+import tracemalloc
+
+BASE_DIR   = os.path.dirname(os.path.abspath(__file__))
+GOLDEN_DIR = os.path.join(BASE_DIR, "golden", "pdf_parser")
+STAGES     = ("open", "extract_text", "detect", "parse")
+
+
+def corpus() -> list:
+    files = sorted(glob.glob(os.path.join(BASE_DIR, "Invoices berger", "*.pdf")))
+    sample = os.path.join(BASE_DIR, "Invoice_473658-01.pdf")
+    # Golden files are named by basename; skip the sample if the folder has it too
+    if os.path.exists(sample) and os.path.basename(sample) not in {os.path.basename(f) for f in files}:
+        files.append(sample)
+    return files
+
+
+def _golden_path(filepath: str) -> str:
+    return os.path.join(GOLDEN_DIR, os.path.splitext(os.path.basename(filepath))[0] + ".json")
+
+
+def time_stages(filepath: str, backend: str | None = None) -> tuple[dict, int, str]:
+    """
+    Run parse_pdf's steps by hand, timing each.
+    Returns (seconds per stage, page count, backend the parser read).
+    """
+    import pdf_parser
+
+    t = dict.fromkeys(STAGES, 0.0)
+    name = backend or pdf_parser.DETECT_BACKENDS[0]
+    while True:
+        opener, _page_text = pdf_parser._BACKENDS[name]
+        t0 = time.perf_counter()
+        with opener(filepath) as doc:
+            t1 = time.perf_counter()
+            texts = pdf_parser._page_texts(filepath, doc, name, parallel=False)
+            t2 = time.perf_counter()
+        t["open"] += t1 - t0
+        t["extract_text"] += t2 - t1
+
+        t0 = time.perf_counter()
+        supplier = pdf_parser.detect_supplier(texts[0] if texts else "")
+        t["detect"] += time.perf_counter() - t0
+        if backend or supplier is None or pdf_parser.parser_backend(supplier) == name:
+            break
+        name = pdf_parser.parser_backend(supplier)   # format reads with another backend
+
+    _detect, parse, _backend = pdf_parser._PARSERS[supplier]
+    t0 = time.perf_counter()
+    parse(texts)
+    t["parse"] += time.perf_counter() - t0
+    return t, len(texts), name
+
+
+def check_golden(filepath: str, parsed: dict, update: bool) -> str:
+    """'ok', 'updated', 'missing' or 'DIFF' for one file."""
+    path = _golden_path(filepath)
+    if update:
+        os.makedirs(GOLDEN_DIR, exist_ok=True)
+        with open(path, "w", encoding="utf-8") as fh:
+            json.dump(parsed, fh, indent=1, sort_keys=True)
+            fh.write("\n")
+        return "updated"
+    if not os.path.exists(path):
+        return "missing"
+    with open(path, encoding="utf-8") as fh:
+        golden = json.load(fh)
+    # Round-trip so tuples/float formatting compare the way they were stored
+    return "ok" if golden == json.loads(json.dumps(parsed)) else "DIFF"
+
+
+def run(files: list, repeat: int = 1, memory: bool = False, update_golden: bool = False,
+        backend: str | None = None) -> dict:
+    from pdf_parser import parse_pdf
+
+    totals  = dict.fromkeys(STAGES, 0.0)
+    used    = {}
+    pages   = 0
+    items   = 0
+    results = {"ok": [], "updated": [], "missing": [], "DIFF": [], "error": []}
+    peak    = 0
+    wall    = 0.0
+
+    for filepath in files:
+        name = os.path.basename(filepath)
+        try:
+            best = None
+            for _ in range(max(1, repeat)):
+                stages, n_pages, read_with = time_stages(filepath, backend)
+                if best is None or sum(stages.values()) < sum(best.values()):
+                    best = stages
+            for k in STAGES:
+                totals[k] += best[k]
+            pages += n_pages
+            used[read_with] = used.get(read_with, 0) + 1
+
+            t0 = time.perf_counter()
+            parsed = parse_pdf(filepath, parallel=False, backend=backend)
+            wall += time.perf_counter() - t0
+            items += len(parsed["items"])
+
+            if memory:
+                # Separate pass — tracemalloc slows allocation-heavy pdfminer several-fold
+                tracemalloc.start()
+                parse_pdf(filepath, parallel=False, backend=backend)
+                peak = max(peak, tracemalloc.get_traced_memory()[1])
+                tracemalloc.stop()
+        except Exception as e:
+            results["error"].append(f"{name}: {e}")
+            continue
+        results[check_golden(filepath, parsed, update_golden)].append(name)
+
+    staged = sum(totals.values())
+    return {
+        "files":              len(files),
+        "pages":              pages,
+        "items":              items,
+        "backends":           used,
+        "stage_seconds":      {k: round(v, 4) for k, v in totals.items()},
+        "stage_share":        {k: round(v / staged, 3) if staged else 0 for k, v in totals.items()},
+        "pages_per_second":   round(pages / staged, 2) if staged else 0,
+        "parse_pdf_seconds":  round(wall, 4),
+        "peak_traced_bytes":  peak if memory else None,
+        "max_rss_kb":         resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        "golden":             {k: len(v) for k, v in results.items()},
+        "golden_failures":    results["DIFF"] + results["missing"] + results["error"],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark pdf_parser against the invoice corpus.")
+    parser.add_argument("--repeat", type=int, default=1, help="Time each file N times, keep the best (default 1).")
+    parser.add_argument("--memory", action="store_true", help="Track peak Python allocations per parse (slower).")
+    parser.add_argument("--update-golden", action="store_true", help="Rewrite golden/pdf_parser/*.json.")
+    parser.add_argument("--backend", choices=["pdfplumber", "pypdf"],
+                        help="Force a text backend instead of each format's registered one.")
+    parser.add_argument("--json", action="store_true", help="Print the summary as JSON.")
+    args = parser.parse_args()
+
+    files = corpus()
+    if not files:
+        print("No PDFs found in the corpus.")
+        sys.exit(1)
+
+    stats = run(files, repeat=args.repeat, memory=args.memory, update_golden=args.update_golden,
+                backend=args.backend)
+
+    if args.json:
+        print(json.dumps(stats, indent=2))
+    else:
+        print(f"\n{stats['files']} files, {stats['pages']} pages, {stats['items']} items, "
+              f"backends {stats['backends']}\n")
+        for k in STAGES:
+            print(f"  {k:<14} {stats['stage_seconds'][k]:>9.4f}s  {stats['stage_share'][k]:>6.1%}")
+        print(f"\n  pages/sec      {stats['pages_per_second']:>9}")
+        print(f"  parse_pdf      {stats['parse_pdf_seconds']:>9.4f}s (end to end)")
+        if stats["peak_traced_bytes"] is not None:
+            print(f"  peak traced    {stats['peak_traced_bytes'] / 1024 / 1024:>9.2f} MB (largest single parse)")
+        print(f"  max RSS        {stats['max_rss_kb'] / 1024:>9.1f} MB")
+        print(f"\n  golden         {stats['golden']}")
+        for failure in stats["golden_failures"]:
+            print(f"    ✗ {failure}")
+
+    if stats["golden_failures"] and not args.update_golden:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
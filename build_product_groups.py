@@ -0,0 +1,70 @@
+"""
+build_product_groups.py — Cluster equivalent products across suppliers.
+
+Parses every distinct catalog description once, compares only plausible
+cross-supplier pairs (same material / type / schedule / sizes), and asks the
+LLM judge only about pairs the attribute rules cannot settle.
+
+Usage:
+    python build_product_groups.py                 # dry run — print stats and sample groups
+    python build_product_groups.py --save          # replace the product_groups table
+    python build_product_groups.py --no-llm        # rules only, no OpenAI calls
+    python build_product_groups.py --workers 16    # concurrent LLM requests
+"""
+
+import argparse
+import time
+
+
+def build(use_llm: bool = True, use_web: bool = False, workers: int = 8, save: bool = False) -> dict:
+    """Cluster the in-memory catalog and optionally store the groups; returns stats."""
+    from db import get_catalog_df, load_catalog_to_memory, replace_product_groups
+    from sku_matcher import cluster_equivalents
+
+    if get_catalog_df() is None:
+        load_catalog_to_memory()
+    df = get_catalog_df()
+    pairs = [] if df is None or df.empty else (
+        df[["Supply", "Description"]].dropna().drop_duplicates().itertuples(index=False, name=None)
+    )
+
+    t0 = time.perf_counter()
+    groups, stats = cluster_equivalents(pairs, use_llm=use_llm, use_web=use_web, max_workers=workers)
+    stats["seconds"] = round(time.perf_counter() - t0, 2)
+    if save:
+        stats["rows_written"] = replace_product_groups(groups)
+    stats["sample"] = groups[:10]
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Cluster equivalent products across suppliers.")
+    parser.add_argument("--save", action="store_true", help="Replace the product_groups table.")
+    parser.add_argument("--no-llm", action="store_true", help="Skip the LLM judge for undecidable pairs.")
+    parser.add_argument("--web", action="store_true", help="Give the LLM judge web search snippets.")
+    parser.add_argument("--workers", type=int, default=8, help="Concurrent LLM requests (default 8).")
+    args = parser.parse_args()
+
+    if args.save:
+        from db import init_db
+        init_db()
+
+    stats = build(use_llm=not args.no_llm, use_web=args.web, workers=args.workers, save=args.save)
+    sample = stats.pop("sample")
+
+    print(f"\n{'DRY RUN — ' if not args.save else ''}product grouping finished in {stats['seconds']}s\n")
+    for key in ("items", "blocks", "pairs", "exact", "rules_same", "rules_different",
+                "undecided", "llm_calls", "llm_same", "groups", "rows_written"):
+        if key in stats:
+            print(f"  {key:<16} {stats[key]:>8}")
+
+    if sample:
+        print("\nSample groups:")
+        for g in sample:
+            print(f"  [{g['method']}, {g['confidence']}]")
+            for supplier, desc in g["members"]:
+                print(f"      {supplier:<5} {desc}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,52 @@
+"""
+compact_versions.py
+
+Delta-encodes template and estimate version history.  Every full snapshot
+that isn't a keyframe is rewritten as a compressed JSON patch against the
+version before it; reading a version rebuilds it transparently.
+
+    python compact_versions.py                      # compact both tables
+    python compact_versions.py --dry-run            # report the saving only
+    python compact_versions.py --keyframe-every 20  # longer patch chains
+
+Safe to re-run — versions already stored as patches are left alone.  Exits
+with an error while a retention run holds the version history lease.
+"""
+
+import argparse
+import sys
+
+from db import USE_TURSO, VERSION_KEYFRAME_EVERY, compact_versions, init_db
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Delta-encode template and estimate version history.")
+    parser.add_argument("--dry-run", action="store_true",
+                        help="Report what would be saved without writing.")
+    parser.add_argument("--keyframe-every", type=int, default=VERSION_KEYFRAME_EVERY,
+                        help=f"Keep a full snapshot every N versions (default {VERSION_KEYFRAME_EVERY}).")
+    args = parser.parse_args()
+    if args.keyframe_every < 1:
+        parser.error("--keyframe-every must be at least 1")
+
+    print(f"Mode: {'Turso cloud' if USE_TURSO else 'Local SQLite'}{' (dry run)' if args.dry_run else ''}")
+    init_db()
+
+    before = after = 0
+    for table in ("templates", "estimates"):
+        try:
+            s = compact_versions(table, keyframe_every=args.keyframe_every, dry_run=args.dry_run)
+        except RuntimeError as e:       # a retention run holds the lease
+            print(f"ERROR: {e}")
+            sys.exit(1)
+        before += s["bytes_before"]
+        after  += s["bytes_after"]
+        saved = s["bytes_before"] - s["bytes_after"]
+        print(f"  {table:<9} {s['versions']:,} versions, {s['converted']:,} delta-encoded"
+              f" in {s['documents']:,} document(s): {s['bytes_before']:,} → {s['bytes_after']:,} bytes"
+              f" ({saved / max(s['bytes_before'], 1):.0%} saved)")
+    print(f"Total {before:,} → {after:,} bytes ({(before - after) / max(before, 1):.0%} saved)")
+
+
+if __name__ == "__main__":
+    main()
@@ -28,6 +28,45 @@ os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 TEMPLATE_DATA_DIR = os.path.join(BASE_DIR, "data")
 os.makedirs(TEMPLATE_DATA_DIR, exist_ok=True)
 
+# Rendered /graph PNGs.  Least-recently-used files are evicted once the
+# directory grows past GRAPH_CACHE_MAX_BYTES.
+GRAPH_CACHE_DIR = os.environ.get("GRAPH_CACHE_DIR", os.path.join(BASE_DIR, "cache", "graphs"))
+GRAPH_CACHE_MAX_BYTES = int(os.environ.get("GRAPH_CACHE_MAX_BYTES", 50 * 1024 * 1024))
+
+# Batch PDF upload: parser processes (default one per CPU core) and the most
+# files accepted in one request.
+PDF_PARSE_WORKERS = int(os.environ.get("PDF_PARSE_WORKERS", os.cpu_count() or 2))
+PDF_BATCH_MAX_FILES = int(os.environ.get("PDF_BATCH_MAX_FILES", 100))
+
+# Parsed-PDF results keyed by file SHA-256 + parser version, so re-uploading
+# the same file skips pdfplumber.  Oldest entries go past PARSE_CACHE_MAX_ENTRIES.
+PARSE_CACHE_DIR = os.environ.get("PARSE_CACHE_DIR", os.path.join(BASE_DIR, "cache", "parses"))
+PARSE_CACHE_MAX_ENTRIES = int(os.environ.get("PARSE_CACHE_MAX_ENTRIES", 500))
+
+# Background parse jobs for /upload_pdf: concurrent parses, most jobs queued or
+# running at once (beyond that uploads get 429), how long unconfirmed results
+# are kept, and when a job that stopped moving is declared dead.
+PDF_JOB_WORKERS = int(os.environ.get("PDF_JOB_WORKERS", 2))
+PDF_JOB_MAX_PENDING = int(os.environ.get("PDF_JOB_MAX_PENDING", 20))
+PDF_JOB_TTL_SECONDS = int(os.environ.get("PDF_JOB_TTL_SECONDS", 3600))
+PDF_JOB_STALE_SECONDS = int(os.environ.get("PDF_JOB_STALE_SECONDS", 900))
+
+# Watch-folder ingestion (watch_pdf_folders.py): "SUPPLIER=folder;SUPPLIER=folder",
+# plus the state file that makes restarts incremental.
+WATCH_FOLDERS = os.environ.get("WATCH_FOLDERS", "BPS=" + os.path.join(BASE_DIR, "Invoices berger"))
+WATCH_STATE_FILE = os.environ.get("WATCH_STATE_FILE", os.path.join(BASE_DIR, "data", "watch_state.json"))
+
+# Retention for template/estimate version history: every version from the last
+# VERSION_KEEP_ALL_HOURS, the newest per hour for VERSION_KEEP_HOURLY_DAYS,
+# then the newest per day.  Login events older than LOGIN_HISTORY_KEEP_DAYS are
+# dropped.  The job runs every RETENTION_INTERVAL_HOURS (0 = admin action only),
+# deleting RETENTION_BATCH_SIZE rows per transaction.
+VERSION_KEEP_ALL_HOURS = int(os.environ.get("VERSION_KEEP_ALL_HOURS", 24))
+VERSION_KEEP_HOURLY_DAYS = int(os.environ.get("VERSION_KEEP_HOURLY_DAYS", 7))
+LOGIN_HISTORY_KEEP_DAYS = int(os.environ.get("LOGIN_HISTORY_KEEP_DAYS", 365))
+RETENTION_INTERVAL_HOURS = float(os.environ.get("RETENTION_INTERVAL_HOURS", 24))
+RETENTION_BATCH_SIZE = int(os.environ.get("RETENTION_BATCH_SIZE", 200))
+
 EXCEL_FILENAME = "Final_Extracted_Data_Fixed_Logic4.xlsx"
 DEFAULT_FILE = os.path.join(UPLOAD_FOLDER, EXCEL_FILENAME)
 
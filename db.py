@@ -2,8 +2,17 @@
 db.py — Turso (libSQL) database layer for Zamora Inventory App
 
 Tables:
-  invoices      — one row per uploaded document (invoice or bid)
+  invoices      — one row per uploaded document (invoice or bid); sha256 of the source PDF
   invoice_items — one row per line item in a document
+  price_rollup_monthly — per supplier / product / month price aggregates
+  product_groups — cross-supplier equivalence groups (same product, different suppliers)
+  price_stats   — running price count / mean / variance / last price per product
+  spend_cube    — quantity / spend / line count per supplier × month × job × product
+  parse_jobs    — background PDF parse queue (local SQLite only — per server instance)
+  template_versions / estimate_versions — save history; full keyframes plus
+                  compressed JSON-patch deltas (base_id) once compacted
+  maintenance_leases — one row per maintenance job: which process holds it,
+                  until when, and the stats of its last run
 
 Credentials come from environment variables:
   TURSO_URL    = libsql://your-db-name.turso.io  (or https://)
@@ -13,17 +22,25 @@ Local fallback: if TURSO_URL is not set, falls back to local SQLite
 at data/zamora.db (useful for local dev without Turso).
 """
 
+import base64
+import hashlib
 import json
 import os
 import sqlite3
 import threading
 import time
-from datetime import datetime
+import uuid
+import zlib
+from contextlib import contextmanager
+from datetime import datetime, timedelta
 from typing import Optional
 
 import httpx
+import numpy as np
 import pandas as pd
 
+from json_patch import apply_patch, make_patch
+
 
 # ── Driver selection ──────────────────────────────────────────────────────────
 
@@ -146,12 +163,44 @@ def _turso_batch(statements: list[tuple]) -> list:
     return out
 
 
+def _turso_transaction(statements: list[tuple]) -> list:
+    """
+    Execute (sql, params) statements atomically in one round trip.
+
+    Sent as a single Hrana batch: BEGIN, then each statement conditional on the
+    previous step succeeding, COMMIT, and ROLLBACK if anything failed.  Returns
+    one parsed row-dict list per statement; raises RuntimeError on failure.
+    """
+    steps = [{"stmt": {"sql": "BEGIN", "args": []}}]
+    for sql, params in statements:
+        steps.append({
+            "stmt": {"sql": sql, "args": [_to_arg(v) for v in (params or [])]},
+            "condition": {"type": "ok", "step": len(steps) - 1},
+        })
+    commit = len(steps)
+    steps.append({"stmt": {"sql": "COMMIT", "args": []},
+                  "condition": {"type": "ok", "step": commit - 1}})
+    steps.append({"stmt": {"sql": "ROLLBACK", "args": []},
+                  "condition": {"type": "not", "cond": {"type": "ok", "step": commit}}})
+
+    results = _pipeline([{"type": "batch", "batch": {"steps": steps}}])
+    if not results or results[0].get("type") == "error":
+        raise RuntimeError(f"Turso transaction error: {results[0].get('error') if results else 'no response'}")
+    result = results[0].get("response", {}).get("result", {})
+    errors = result.get("step_errors", [])
+    for i, err in enumerate(errors[: commit + 1]):
+        if err:
+            where = "BEGIN" if i == 0 else "COMMIT" if i == commit else f"statement {i - 1}"
+            raise RuntimeError(f"Turso transaction error at {where}: {err}")
+    return [_parse_result(r or {}) for r in result.get("step_results", [])[1:commit]]
+
+
 # ── Local SQLite connection ───────────────────────────────────────────────────
 
-def _local_conn() -> sqlite3.Connection:
-    """Return a local SQLite connection (dev/fallback only)."""
+def _local_conn(timeout: float = 5.0) -> sqlite3.Connection:
+    """Return a local SQLite connection (dev/fallback only); ``timeout`` is the busy wait in seconds."""
     os.makedirs(os.path.dirname(LOCAL_DB_PATH), exist_ok=True)
-    conn = sqlite3.connect(LOCAL_DB_PATH)
+    conn = sqlite3.connect(LOCAL_DB_PATH, timeout=timeout)
     conn.row_factory = sqlite3.Row
     conn.execute("PRAGMA journal_mode=WAL")
     return conn
@@ -159,6 +208,12 @@ def _local_conn() -> sqlite3.Connection:
 get_conn = _local_conn  # alias for migration scripts
 
 
+def _local_transaction(statements: list[tuple]) -> list:
+    """Local counterpart of _turso_transaction: one transaction, rows per statement."""
+    with _local_conn() as conn:
+        return [[dict(r) for r in conn.execute(sql, params or []).fetchall()] for sql, params in statements]
+
+
 # ── In-memory result cache ────────────────────────────────────────────────────
 
 _cache: dict[str, tuple[float, object]] = {}
@@ -189,6 +244,9 @@ def cache_clear():
 # ── In-memory catalog DataFrame ───────────────────────────────────────────────
 
 _catalog_df: pd.DataFrame | None = None
+_catalog_generation: str = ""
+# "all" / supplier code → (date-sorted frame with parsed Date, datetime64 keys)
+_catalog_time_index: dict[str, tuple[pd.DataFrame, np.ndarray]] = {}
 
 _CATALOG_SQL = """
     SELECT
@@ -216,12 +274,67 @@ def load_catalog_to_memory():
     else:
         with _local_conn() as conn:
             _catalog_df = pd.read_sql_query(_CATALOG_SQL, conn)
+    _set_catalog_generation(_catalog_df)
+    _build_catalog_time_index(_catalog_df)
+
+
+def _set_catalog_generation(df: pd.DataFrame) -> None:
+    """
+    Fingerprint the loaded catalog so derived artefacts (chart PNGs) can be
+    keyed on its contents.  Content-based rather than a counter, so every
+    worker process that loaded the same rows agrees on the value.
+    """
+    global _catalog_generation
+    digest = int(pd.util.hash_pandas_object(df, index=False).sum()) & 0xFFFFFFFFFFFFFFFF
+    _catalog_generation = f"{len(df)}-{digest:016x}"
+
+
+def _build_catalog_time_index(df: pd.DataFrame) -> None:
+    """
+    Pre-sort the catalog by Date (whole and split per supplier) and keep each
+    partition's dates as a datetime64 array, so date windows are two
+    searchsorted calls instead of boolean masks over the full frame.
+    Rows without a parseable date are left out.
+    """
+    global _catalog_time_index
+    tdf = df.assign(Date=pd.to_datetime(df["Date"], errors="coerce")).dropna(subset=["Date"])
+    tdf = tdf.sort_values("Date", kind="stable").reset_index(drop=True)
+    parts = {"all": tdf}
+    for supplier, grp in tdf.groupby("Supply", sort=False):
+        parts[supplier] = grp.reset_index(drop=True)
+    _catalog_time_index = {
+        key: (frame, frame["Date"].to_numpy(dtype="datetime64[ns]"))
+        for key, frame in parts.items()
+    }
+
+
+def get_catalog_window(supplier: str = "all", start=None, end=None) -> pd.DataFrame:
+    """
+    Catalog rows for ``supplier`` ("all" for every supplier) dated within
+    [start, end], both inclusive and optional, sorted by Date.
+
+    Date is already parsed to datetime64.  The result is a slice of a shared
+    frame — copy it before modifying in place.
+    """
+    part = _catalog_time_index.get(supplier or "all")
+    if part is None:
+        return pd.DataFrame(columns=["Description", "Item Number", "Unit", "Price per Unit",
+                                     "Date", "Invoice No.", "Supply"])
+    frame, dates = part
+    lo = dates.searchsorted(np.datetime64(pd.Timestamp(start), "ns"), "left") if start else 0
+    hi = dates.searchsorted(np.datetime64(pd.Timestamp(end), "ns"), "right") if end else len(dates)
+    return frame.iloc[lo:hi]
 
 
 def get_catalog_df() -> pd.DataFrame | None:
     return _catalog_df
 
 
+def get_catalog_generation() -> str:
+    """Fingerprint of the in-memory catalog; changes whenever it is reloaded with new rows."""
+    return _catalog_generation
+
+
 def refresh_catalog():
     """Reload the catalog from the DB (call after a new upload)."""
     load_catalog_to_memory()
@@ -263,6 +376,73 @@ def init_db():
         CREATE INDEX IF NOT EXISTS idx_items_supplier
             ON invoice_items (supplier);
 
+        CREATE TABLE IF NOT EXISTS price_rollup_monthly (
+            supplier            TEXT NOT NULL,
+            description         TEXT NOT NULL,
+            month               TEXT NOT NULL,
+            display_description TEXT DEFAULT '',
+            item_number         TEXT DEFAULT '',
+            min_price           REAL DEFAULT 0,
+            max_price           REAL DEFAULT 0,
+            price_sum           REAL DEFAULT 0,
+            line_count          INTEGER DEFAULT 0,
+            avg_price           REAL DEFAULT 0,
+            first_price         REAL DEFAULT 0,
+            first_date          TEXT DEFAULT '',
+            first_invoice_no    TEXT DEFAULT '',
+            last_price          REAL DEFAULT 0,
+            last_date           TEXT DEFAULT '',
+            last_invoice_no     TEXT DEFAULT '',
+            quantity            REAL DEFAULT 0,
+            invoice_count       INTEGER DEFAULT 0,
+            PRIMARY KEY (supplier, description, month)
+        );
+
+        CREATE INDEX IF NOT EXISTS idx_rollup_month
+            ON price_rollup_monthly (month);
+
+        CREATE TABLE IF NOT EXISTS price_stats (
+            supplier    TEXT NOT NULL,
+            description TEXT NOT NULL,
+            n           INTEGER DEFAULT 0,
+            mean        REAL DEFAULT 0,
+            m2          REAL DEFAULT 0,
+            last_price  REAL DEFAULT 0,
+            last_date   TEXT DEFAULT '',
+            PRIMARY KEY (supplier, description)
+        );
+
+        CREATE TABLE IF NOT EXISTS spend_cube (
+            supplier            TEXT NOT NULL,
+            month               TEXT NOT NULL,
+            job_name            TEXT NOT NULL,
+            description         TEXT NOT NULL,
+            display_description TEXT DEFAULT '',
+            quantity            REAL DEFAULT 0,
+            spend               REAL DEFAULT 0,
+            line_count          INTEGER DEFAULT 0,
+            PRIMARY KEY (supplier, month, job_name, description)
+        );
+
+        CREATE INDEX IF NOT EXISTS idx_spend_month
+            ON spend_cube (month);
+
+        CREATE INDEX IF NOT EXISTS idx_spend_job
+            ON spend_cube (job_name);
+
+        CREATE TABLE IF NOT EXISTS product_groups (
+            group_id    INTEGER NOT NULL,
+            supplier    TEXT NOT NULL,
+            description TEXT NOT NULL,
+            method      TEXT,
+            confidence  REAL,
+            created_at  TEXT DEFAULT (datetime('now')),
+            PRIMARY KEY (supplier, description)
+        );
+
+        CREATE INDEX IF NOT EXISTS idx_product_groups_group
+            ON product_groups (group_id);
+
         CREATE TABLE IF NOT EXISTS users (
             id               INTEGER PRIMARY KEY AUTOINCREMENT,
             email            TEXT UNIQUE NOT NULL,
@@ -285,6 +465,13 @@ def init_db():
         CREATE INDEX IF NOT EXISTS idx_login_history_email
             ON login_history (email);
 
+        CREATE TABLE IF NOT EXISTS maintenance_leases (
+            name       TEXT PRIMARY KEY,
+            holder     TEXT,
+            expires_at TEXT,
+            last_run   TEXT
+        );
+
         CREATE TABLE IF NOT EXISTS templates (
             id          INTEGER PRIMARY KEY AUTOINCREMENT,
             name        TEXT NOT NULL,
@@ -465,6 +652,8 @@ def init_db():
     # Always initialize local SQLite (needed as the fast-write cache)
     with _local_conn() as conn:
         conn.executescript(ddl)
+        conn.executescript(_PARSE_JOBS_DDL)
+        _add_missing_columns(lambda sql: [dict(r) for r in conn.execute(sql).fetchall()])
 
     if USE_TURSO:
         statements = [
@@ -473,6 +662,40 @@ def init_db():
             if stmt.strip()
         ]
         _turso_batch(statements)
+        _add_missing_columns(_turso_execute)
+
+
+# Columns added to tables after they first shipped.  CREATE TABLE IF NOT EXISTS
+# won't touch an existing table, so init_db adds whichever of these are missing.
+_ADDED_COLUMNS: dict[str, list[tuple[str, str]]] = {
+    "invoices":      [("sha256", "TEXT")],
+    "invoice_items": [("price_flag", "TEXT DEFAULT ''")],
+    "templates":     [("item_count", "INTEGER DEFAULT 0"), ("subtotal", "REAL DEFAULT 0")],
+    "estimates":     [("row_count", "INTEGER DEFAULT 0"), ("plumbing_total", "REAL DEFAULT 0"),
+                      ("gas_total", "REAL DEFAULT 0"), ("grand_total", "REAL DEFAULT 0"),
+                      ("revision", "INTEGER DEFAULT 0")],
+    "template_versions": [("base_id", "INTEGER")],
+    "estimate_versions": [("base_id", "INTEGER")],
+    "fixture_usage":     [("row_hash", "TEXT")],
+}
+
+# Indexes over _ADDED_COLUMNS — can't live in the DDL, which runs first.
+_ADDED_INDEXES = [
+    "CREATE INDEX IF NOT EXISTS idx_invoices_sha256 ON invoices (sha256)",
+    "CREATE INDEX IF NOT EXISTS idx_invoices_order ON invoices (order_number, doc_type)",
+    "CREATE INDEX IF NOT EXISTS idx_invoices_supplier_order ON invoices (supplier, order_number)",
+]
+
+
+def _add_missing_columns(execute) -> None:
+    """ALTER TABLE ... ADD COLUMN for every _ADDED_COLUMNS entry the table lacks."""
+    for table, columns in _ADDED_COLUMNS.items():
+        have = {r["name"] for r in execute(f"PRAGMA table_info({table})")}
+        for name, decl in columns:
+            if name not in have:
+                execute(f"ALTER TABLE {table} ADD COLUMN {name} {decl}")
+    for sql in _ADDED_INDEXES:
+        execute(sql)
 
 
 def deduplicate_catalog_usage() -> None:
@@ -502,6 +725,51 @@ def deduplicate_catalog_usage() -> None:
             conn.execute(record_sql, (migration_id,))
 
 
+def dedupe_estimate_catalog() -> None:
+    """
+    One-time migration: merge estimate_catalog rows sharing a key (summing
+    use_count, keeping their usage) and add the unique index that
+    sync_estimate_catalog's ON CONFLICT upsert relies on.
+    """
+    migration_id = "dedupe_estimate_catalog_v1"
+    ensure_sql   = "CREATE TABLE IF NOT EXISTS _migrations (id TEXT PRIMARY KEY, run_at TEXT)"
+    check_sql    = "SELECT id FROM _migrations WHERE id = ?"
+    record_sql   = "INSERT OR IGNORE INTO _migrations (id, run_at) VALUES (?, datetime('now'))"
+    keep_ids     = "SELECT MIN(id) FROM estimate_catalog GROUP BY description, unit_cost, comments, add_comments"
+    same_key     = ("d.description = e.description AND d.unit_cost = e.unit_cost"
+                    " AND d.comments = e.comments AND d.add_comments = e.add_comments")
+    statements = [
+        # NULLs never collide in a unique index; they were always meant as ''
+        ("UPDATE estimate_catalog SET unit_cost = COALESCE(unit_cost, 0), comments = COALESCE(comments, ''),"
+         " add_comments = COALESCE(add_comments, '')"
+         " WHERE unit_cost IS NULL OR comments IS NULL OR add_comments IS NULL", []),
+        ("INSERT OR IGNORE INTO estimate_catalog_usage (catalog_id, estimate_name, used_at)"
+         f" SELECT (SELECT MIN(d.id) FROM estimate_catalog d WHERE {same_key}), u.estimate_name, u.used_at"
+         f" FROM estimate_catalog_usage u JOIN estimate_catalog e ON e.id = u.catalog_id"
+         f" WHERE e.id NOT IN ({keep_ids})", []),
+        (f"UPDATE estimate_catalog AS e SET"
+         f" use_count = (SELECT SUM(d.use_count) FROM estimate_catalog d WHERE {same_key}),"
+         f" last_used = (SELECT MAX(d.last_used) FROM estimate_catalog d WHERE {same_key})"
+         f" WHERE id IN ({keep_ids} HAVING COUNT(*) > 1)", []),
+        (f"DELETE FROM estimate_catalog WHERE id NOT IN ({keep_ids})", []),
+        ("DELETE FROM estimate_catalog_usage WHERE catalog_id NOT IN (SELECT id FROM estimate_catalog)", []),
+        (f"CREATE UNIQUE INDEX IF NOT EXISTS idx_ecat_key ON estimate_catalog ({_CATALOG_KEY})", []),
+        (record_sql, [migration_id]),
+    ]
+
+    if USE_TURSO:
+        _turso_execute(ensure_sql, [])
+        if _turso_execute(check_sql, [migration_id]):
+            return
+        _turso_transaction(statements)
+    else:
+        with _local_conn() as conn:
+            conn.execute(ensure_sql)
+            if conn.execute(check_sql, (migration_id,)).fetchone():
+                return
+        _local_transaction(statements)
+
+
 def clean_lps_description_suffixes() -> None:
     """One-time migration: strip trailing pack-qty suffixes like ' (25)' from LPS descriptions."""
     import re as _re
@@ -613,102 +881,130 @@ def fix_foamcore_descriptions() -> None:
         print(f"[fix_foamcore_descriptions] migration skipped due to error: {e}")
 
 
-def save_parsed_document(parsed: dict, filename: str = "") -> int:
+# A document is a duplicate if its order number + doc type, or its file hash,
+# is already on record; the guarded insert then returns no id.
+_DUPLICATE_WHERE = "(order_number = ? AND doc_type = ?) OR sha256 = ?"
+_DUPLICATE_SQL   = f"SELECT id FROM invoices WHERE {_DUPLICATE_WHERE} LIMIT 1"
+_INVOICE_INSERT_SQL = f"""
+    INSERT INTO invoices (doc_type, order_number, date, job_name, supplier, filename, sha256)
+    SELECT ?, ?, ?, ?, ?, ?, ?
+    WHERE NOT EXISTS (SELECT 1 FROM invoices WHERE {_DUPLICATE_WHERE})
+    RETURNING id
+"""
+# Turso: runs straight after the guarded insert in the same transaction.  If
+# that inserted nothing (a concurrent import of the same document got there
+# first) the NULL invoice_id fails NOT NULL and everything rolls back;
+# otherwise it inserts nothing.
+_INVOICE_INSERTED_GUARD_SQL = "INSERT INTO invoice_items (invoice_id, description) SELECT NULL, '' WHERE changes() = 0"
+
+_ITEM_INSERT_SQL = """
+    INSERT INTO invoice_items
+    (invoice_id, item_number, description, uom, quantity, unit_price, supplier, price_flag)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+"""
+# Turso: the id isn't known until the transaction runs, so items find their
+# invoice by key (unique once the conditional insert above has succeeded)
+_ITEM_BY_KEY_SQL = """
+    INSERT INTO invoice_items
+    (invoice_id, item_number, description, uom, quantity, unit_price, supplier, price_flag)
+    VALUES ((SELECT MAX(id) FROM invoices WHERE order_number = ? AND doc_type = ?),
+            ?, ?, ?, ?, ?, ?, ?)
+"""
+
+
+def _duplicate_params(parsed: dict) -> list:
+    return [parsed["order_number"], parsed["doc_type"], parsed.get("sha256") or None]
+
+
+def _invoice_insert_params(parsed: dict, filename: str) -> list:
+    return [
+        parsed["doc_type"], parsed["order_number"], parsed.get("date", ""),
+        parsed.get("job_name", ""), parsed.get("supplier", "LPS"), filename,
+        parsed.get("sha256") or None, *_duplicate_params(parsed),
+    ]
+
+
+def _item_insert_params(invoice_id, parsed: dict, flags: list[str]) -> list[list]:
+    supplier = parsed.get("supplier", "LPS")
+    return [
+        [invoice_id, item.get("item_number", ""), item.get("description", ""), item.get("uom", ""),
+         item.get("quantity", 0), item.get("unit_price", 0), supplier, flag]
+        for item, flag in zip(parsed["items"], flags)
+    ]
+
+
+def _item_by_key_params(parsed: dict, flags: list[str]) -> list[list]:
+    key = [parsed["order_number"], parsed["doc_type"]]
+    return [key + p[1:] for p in _item_insert_params(None, parsed, flags)]
+
+
+def save_parsed_document(parsed: dict, filename: str = "", anomalies: list | None = None) -> int:
     """
     Insert a parsed PDF result into the DB.
     Returns the new invoice id, or -1 if already imported (duplicate).
+    A document counts as a duplicate if its order number + doc type, or the
+    source file's ``parsed["sha256"]`` (when given), is already on record.
+    Each line's price is checked against price_stats and the result stored in
+    invoice_items.price_flag; pass a list as ``anomalies`` to receive the
+    details of flagged lines.
+    On Turso the header, items, rollup, stats and spend are written in one
+    transaction (one round trip after the price_stats read), which also
+    reports a duplicate.
     Clears the cache so subsequent reads reflect the new data.
     """
-    order_number = parsed["order_number"]
-    doc_type     = parsed["doc_type"]
+    stats_keys = _stats_keys(parsed)
+    # Placeholder id — the rollup only counts distinct invoices
+    rollup_rows = _rollup_rows_for_document(parsed, "new")
 
     if USE_TURSO:
-        existing = _turso_execute(
-            "SELECT id FROM invoices WHERE order_number = ? AND doc_type = ?",
-            [order_number, doc_type],
-        )
-        if existing:
+        reads = [(_DUPLICATE_SQL, _duplicate_params(parsed))]
+        if stats_keys:
+            reads.append((_stats_select_sql(len(stats_keys)), [v for k in stats_keys for v in k]))
+        results = _turso_batch(reads)
+        if results[0]:
             return -1
-
-        _turso_execute(
-            """INSERT INTO invoices (doc_type, order_number, date, job_name, supplier, filename)
-               VALUES (?, ?, ?, ?, ?, ?)""",
-            [
-                doc_type,
-                order_number,
-                parsed.get("date", ""),
-                parsed.get("job_name", ""),
-                parsed.get("supplier", "LPS"),
-                filename,
-            ],
-        )
-
-        rows = _turso_execute(
-            "SELECT id FROM invoices WHERE order_number = ? AND doc_type = ? ORDER BY id DESC LIMIT 1",
-            [order_number, doc_type],
-        )
-        invoice_id = rows[0]["id"]
-
-        item_statements = [
-            (
-                """INSERT INTO invoice_items
-                   (invoice_id, item_number, description, uom, quantity, unit_price, supplier)
-                   VALUES (?, ?, ?, ?, ?, ?, ?)""",
-                [
-                    invoice_id,
-                    item.get("item_number", ""),
-                    item.get("description", ""),
-                    item.get("uom", ""),
-                    item.get("quantity", 0),
-                    item.get("unit_price", 0),
-                    parsed.get("supplier", "LPS"),
-                ],
-            )
-            for item in parsed["items"]
-        ]
-        if item_statements:
-            _turso_batch(item_statements)
+        stats = {(r["supplier"], r["description"]): r for r in (results[1] if stats_keys else [])}
+        flags, found = _stats_flag_document(parsed, stats)
+
+        statements  = [(_INVOICE_INSERT_SQL, _invoice_insert_params(parsed, filename)),
+                       (_INVOICE_INSERTED_GUARD_SQL, [])]
+        statements += [(_ITEM_BY_KEY_SQL, p) for p in _item_by_key_params(parsed, flags)]
+        statements += [(_ROLLUP_UPSERT_SQL, u) for u in _rollup_fold(rollup_rows)]
+        statements += [(_STATS_MERGE_SQL, u) for u in _stats_merges([parsed])]
+        statements += [(_SPEND_UPSERT_SQL, u) for u in _spend_fold(rollup_rows)]
+        try:
+            results = _turso_transaction(statements)
+        except RuntimeError:
+            # Lost a race with an import of the same document?
+            if _turso_execute(_DUPLICATE_SQL, _duplicate_params(parsed)):
+                return -1
+            raise
+        invoice_id = int(results[0][0]["id"])
 
     else:
         with _local_conn() as conn:
-            existing = conn.execute(
-                "SELECT id FROM invoices WHERE order_number = ? AND doc_type = ?",
-                (order_number, doc_type),
-            ).fetchone()
-            if existing:
+            # Hold the write lock from the stats read on, as save_parsed_documents does
+            conn.execute("BEGIN IMMEDIATE")
+            stats = {}
+            if stats_keys:
+                stats = {
+                    (r["supplier"], r["description"]): dict(r)
+                    for r in conn.execute(_stats_select_sql(len(stats_keys)),
+                                          [v for k in stats_keys for v in k]).fetchall()
+                }
+            flags, found = _stats_flag_document(parsed, stats)
+
+            inserted = conn.execute(_INVOICE_INSERT_SQL, _invoice_insert_params(parsed, filename)).fetchall()
+            if not inserted:
                 return -1
-
-            cur = conn.execute(
-                """INSERT INTO invoices (doc_type, order_number, date, job_name, supplier, filename)
-                   VALUES (?, ?, ?, ?, ?, ?)""",
-                (
-                    doc_type,
-                    order_number,
-                    parsed.get("date", ""),
-                    parsed.get("job_name", ""),
-                    parsed.get("supplier", "LPS"),
-                    filename,
-                ),
-            )
-            invoice_id = cur.lastrowid
-            conn.executemany(
-                """INSERT INTO invoice_items
-                   (invoice_id, item_number, description, uom, quantity, unit_price, supplier)
-                   VALUES (?, ?, ?, ?, ?, ?, ?)""",
-                [
-                    (
-                        invoice_id,
-                        item.get("item_number", ""),
-                        item.get("description", ""),
-                        item.get("uom", ""),
-                        item.get("quantity", 0),
-                        item.get("unit_price", 0),
-                        parsed.get("supplier", "LPS"),
-                    )
-                    for item in parsed["items"]
-                ],
-            )
-
+            invoice_id = inserted[0]["id"]
+            conn.executemany(_ITEM_INSERT_SQL, _item_insert_params(invoice_id, parsed, flags))
+            conn.executemany(_ROLLUP_UPSERT_SQL, _rollup_fold(rollup_rows))
+            conn.executemany(_STATS_MERGE_SQL, _stats_merges([parsed]))
+            conn.executemany(_SPEND_UPSERT_SQL, _spend_fold(rollup_rows))
+
+    if anomalies is not None:
+        anomalies.extend(found)
     cache_clear()
     return invoice_id
 
@@ -796,6 +1092,146 @@ def get_latest_prices(supplier: Optional[str] = None) -> list[dict]:
     return result
 
 
+def imported_invoice_keys() -> tuple[set, set]:
+    """
+    Everything needed to spot an already-imported document without parsing
+    or saving it: ({(order_number, doc_type)}, {sha256}).  One query.
+    """
+    sql = "SELECT order_number, doc_type, sha256 FROM invoices"
+    if USE_TURSO:
+        rows = _turso_execute(sql)
+    else:
+        with _local_conn() as conn:
+            rows = [dict(r) for r in conn.execute(sql).fetchall()]
+    return (
+        {(r["order_number"], r["doc_type"]) for r in rows},
+        {r["sha256"] for r in rows if r["sha256"]},
+    )
+
+
+def save_parsed_documents(docs: list[tuple[dict, str]], anomalies: list | None = None) -> list[int]:
+    """
+    Bulk form of save_parsed_document for imports.
+
+    ``docs`` is a list of (parsed, filename).  Documents already on record — or
+    repeated within ``docs`` — get -1; the rest are written in one transaction
+    (a single Turso round trip), with price flags, rollup, stats and spend
+    folded across the chunk in list order, exactly as saving them one by one
+    would.  Returns the invoice id (or -1) per document.  A document saved by
+    someone else between the duplicate check and the write rolls the whole
+    chunk back (RuntimeError / IntegrityError), so the caller can retry it.
+    """
+    if not docs:
+        return []
+
+    orders = sorted({(p["order_number"], p["doc_type"]) for p, _ in docs})
+    hashes = sorted({p["sha256"] for p, _ in docs if p.get("sha256")})
+    dup_sql = (
+        "SELECT order_number, doc_type, sha256 FROM invoices WHERE (order_number, doc_type) IN (VALUES "
+        + ", ".join("(?, ?)" for _ in orders) + ")"
+        + (" OR sha256 IN (" + ", ".join("?" for _ in hashes) + ")" if hashes else "")
+    )
+    dup_args = [v for k in orders for v in k] + hashes
+
+    def _pick(existing_rows):
+        seen_orders = {(r["order_number"], r["doc_type"]) for r in existing_rows}
+        seen_hashes = {r["sha256"] for r in existing_rows if r["sha256"]}
+        keep = []
+        for idx, (parsed, _filename) in enumerate(docs):
+            key, h = (parsed["order_number"], parsed["doc_type"]), parsed.get("sha256") or None
+            if key in seen_orders or (h and h in seen_hashes):
+                continue
+            seen_orders.add(key)
+            if h:
+                seen_hashes.add(h)
+            keep.append(idx)
+        return keep
+
+    def _fold(keep, stats):
+        """Price flags per kept doc (folding into stats) plus rollup / spend rows."""
+        flags, rows = {}, []
+        for idx in keep:
+            parsed = docs[idx][0]
+            flags[idx], found = _stats_flag_document(parsed, stats)
+            if anomalies is not None:
+                anomalies.extend({"order_number": parsed["order_number"], **a} for a in found)
+            # Placeholder ids — the rollup only counts distinct invoices
+            rows.extend(_rollup_rows_for_document(parsed, ("new", idx)))
+        rows.sort(key=lambda r: r.get("date") or "")
+        return flags, rows
+
+    ids = [-1] * len(docs)
+
+    if USE_TURSO:
+        all_keys = sorted({k for p, _ in docs for k in _stats_keys(p)})
+        reads = [(dup_sql, dup_args)]
+        if all_keys:
+            reads.append((_stats_select_sql(len(all_keys)), [v for k in all_keys for v in k]))
+        results = _turso_batch(reads)
+        keep = _pick(results[0])
+        if not keep:
+            return ids
+        stats = {(r["supplier"], r["description"]): r for r in (results[1] if all_keys else [])}
+        flags, rows = _fold(keep, stats)
+
+        statements, header_at = [], []
+        for idx in keep:
+            parsed, filename = docs[idx]
+            header_at.append(len(statements))
+            statements.append((_INVOICE_INSERT_SQL, _invoice_insert_params(parsed, filename)))
+            statements.append((_INVOICE_INSERTED_GUARD_SQL, []))
+            statements += [(_ITEM_BY_KEY_SQL, p) for p in _item_by_key_params(parsed, flags[idx])]
+        statements += [(_ROLLUP_UPSERT_SQL, u) for u in _rollup_fold(rows)]
+        statements += [(_STATS_MERGE_SQL, u) for u in _stats_merges([docs[i][0] for i in keep])]
+        statements += [(_SPEND_UPSERT_SQL, u) for u in _spend_fold(rows)]
+        results = _turso_transaction(statements)
+        for idx, at in zip(keep, header_at):
+            ids[idx] = int(results[at][0]["id"])
+
+    else:
+        with _local_conn() as conn:
+            # Check and insert in one write transaction, so every guarded insert below succeeds
+            conn.execute("BEGIN IMMEDIATE")
+            keep = _pick([dict(r) for r in conn.execute(dup_sql, dup_args).fetchall()])
+            if not keep:
+                return ids
+            touched = sorted({k for i in keep for k in _stats_keys(docs[i][0])})
+            stats = {}
+            if touched:
+                stats = {
+                    (r["supplier"], r["description"]): dict(r)
+                    for r in conn.execute(_stats_select_sql(len(touched)),
+                                          [v for k in touched for v in k]).fetchall()
+                }
+            flags, rows = _fold(keep, stats)
+            for idx in keep:
+                parsed, filename = docs[idx]
+                ids[idx] = conn.execute(_INVOICE_INSERT_SQL, _invoice_insert_params(parsed, filename)).fetchone()["id"]
+                conn.executemany(_ITEM_INSERT_SQL, _item_insert_params(ids[idx], parsed, flags[idx]))
+            conn.executemany(_ROLLUP_UPSERT_SQL, _rollup_fold(rows))
+            conn.executemany(_STATS_MERGE_SQL, _stats_merges([docs[i][0] for i in keep]))
+            conn.executemany(_SPEND_UPSERT_SQL, _spend_fold(rows))
+
+    cache_clear()
+    return ids
+
+
+def find_invoice_by_hash(sha256: str) -> dict | None:
+    """Return the invoice imported from the file with this SHA-256, if any. Not cached."""
+    if not sha256:
+        return None
+    sql = """
+        SELECT id, doc_type, order_number, date, supplier, filename, imported_at
+        FROM invoices WHERE sha256 = ? LIMIT 1
+    """
+    if USE_TURSO:
+        rows = _turso_execute(sql, [sha256])
+        return rows[0] if rows else None
+    with _local_conn() as conn:
+        row = conn.execute(sql, (sha256,)).fetchone()
+        return dict(row) if row else None
+
+
 def list_invoices() -> list[dict]:
     """
     Return all imported documents with item counts, newest first.
@@ -830,119 +1266,951 @@ def delete_invoice(invoice_id: int):
     sql    = "DELETE FROM invoices WHERE id = ?"
     params = [invoice_id]
 
+    lines_sql = """
+        SELECT ii.supplier, ii.description, ii.quantity, ii.unit_price, inv.date, inv.job_name
+        FROM invoice_items ii
+        JOIN invoices inv ON inv.id = ii.invoice_id
+        WHERE ii.invoice_id = ?
+    """
+
     if USE_TURSO:
-        _turso_execute(sql, params)
+        lines = _turso_execute(lines_sql, [invoice_id])
+        statements = [(sql, params)]
+        # Spend is additive: subtract this invoice's contribution in place
+        statements += [(_SPEND_UPSERT_SQL, u) for u in _spend_fold(lines, sign=-1)]
+        statements.append((_SPEND_PRUNE_SQL, []))
+        _turso_batch(statements)
     else:
         with _local_conn() as conn:
+            lines = [dict(r) for r in conn.execute(lines_sql, (invoice_id,)).fetchall()]
             conn.execute(sql, (invoice_id,))
+            conn.executemany(_SPEND_UPSERT_SQL, _spend_fold(lines, sign=-1))
+            conn.execute(_SPEND_PRUNE_SQL)
+
+    # Min/max and last price can't be decremented, so re-fold the affected products from raw rows
+    if lines:
+        pairs = sorted({(l["supplier"], _norm_desc(l["description"])) for l in lines})
+        rebuild_price_rollup(pairs=pairs)
+        rebuild_price_stats(pairs=pairs)
 
     cache_clear()
 
 
-# ── User whitelist helpers ─────────────────────────────────────────────────────
+# ── Monthly price rollup ───────────────────────────────────────────────────────
+#
+# price_rollup_monthly holds one row per (supplier, normalised description,
+# YYYY-MM).  save_parsed_document folds each new invoice into it with an
+# upsert, so analytics that only need monthly resolution read O(products)
+# rows instead of scanning every invoice line.
+
+_ROLLUP_TTL = 300   # 5 minutes
+
+_ROLLUP_COLS = (
+    "supplier, description, month, display_description, item_number,"
+    " min_price, max_price, price_sum, line_count, avg_price,"
+    " first_price, first_date, first_invoice_no,"
+    " last_price, last_date, last_invoice_no, quantity, invoice_count"
+)
+
+_ROLLUP_UPSERT_SQL = f"""
+    INSERT INTO price_rollup_monthly ({_ROLLUP_COLS})
+    VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?)
+    ON CONFLICT (supplier, description, month) DO UPDATE SET
+        min_price           = MIN(min_price, excluded.min_price),
+        max_price           = MAX(max_price, excluded.max_price),
+        price_sum           = price_sum + excluded.price_sum,
+        line_count          = line_count + excluded.line_count,
+        avg_price           = (price_sum + excluded.price_sum) / (line_count + excluded.line_count),
+        first_price         = CASE WHEN excluded.first_date < first_date
+                                   THEN excluded.first_price ELSE first_price END,
+        first_invoice_no    = CASE WHEN excluded.first_date < first_date
+                                   THEN excluded.first_invoice_no ELSE first_invoice_no END,
+        first_date          = MIN(first_date, excluded.first_date),
+        last_price          = CASE WHEN excluded.last_date >= last_date
+                                   THEN excluded.last_price ELSE last_price END,
+        last_invoice_no     = CASE WHEN excluded.last_date >= last_date
+                                   THEN excluded.last_invoice_no ELSE last_invoice_no END,
+        display_description = CASE WHEN excluded.last_date >= last_date
+                                   THEN excluded.display_description ELSE display_description END,
+        item_number         = CASE WHEN excluded.last_date >= last_date
+                                   THEN excluded.item_number ELSE item_number END,
+        last_date           = MAX(last_date, excluded.last_date),
+        quantity            = quantity + excluded.quantity,
+        invoice_count       = invoice_count + excluded.invoice_count
+"""
 
-_USER_COLS = "id, email, role, active, failed_attempts, last_failed"
 
+def _norm_desc(desc: str) -> str:
+    """Rollup key for a description — mirrors LOWER(TRIM(description)) in SQL."""
+    return (desc or "").strip().lower()
 
-def get_user(email: str) -> dict | None:
-    sql = f"SELECT {_USER_COLS} FROM users WHERE email = ?"
-    if USE_TURSO:
-        rows = _turso_execute(sql, [email])
-    else:
-        with _local_conn() as conn:
-            rows = [dict(r) for r in conn.execute(sql, (email,)).fetchall()]
-    return rows[0] if rows else None
 
+def _rollup_month(date_str: str) -> str | None:
+    """Return 'YYYY-MM' for an ISO date string, or None if it isn't one."""
+    d = (date_str or "").strip()
+    if len(d) >= 7 and d[:4].isdigit() and d[4] == "-" and d[5:7].isdigit():
+        return d[:7]
+    return None
 
-def list_users() -> list[dict]:
-    sql = f"SELECT {_USER_COLS} FROM users ORDER BY email"
-    if USE_TURSO:
-        return _turso_execute(sql)
-    else:
-        with _local_conn() as conn:
-            return [dict(r) for r in conn.execute(sql).fetchall()]
 
+def _rollup_fold(rows) -> list[list]:
+    """
+    Fold line rows into rollup upsert parameter lists.
 
-def add_user(email: str, role: str = "user") -> bool:
-    """Insert a new whitelisted user. Returns False if email already exists."""
-    check = "SELECT id FROM users WHERE email = ?"
-    insert = "INSERT INTO users (email, role, active) VALUES (?, ?, 1)"
-    if USE_TURSO:
-        if _turso_execute(check, [email]):
-            return False
-        _turso_execute(insert, [email, role])
-    else:
-        with _local_conn() as conn:
-            if conn.execute(check, (email,)).fetchone():
-                return False
-            conn.execute(insert, (email, role))
-    return True
+    Each row is a dict with supplier, description, item_number, date,
+    order_number, invoice_id, unit_price and quantity.  Rows must arrive in
+    date order so first/last fields come out right.  Lines without an ISO date
+    or a positive price are skipped, matching the price-intelligence filters.
+    """
+    groups: dict[tuple, dict] = {}
+    for r in rows:
+        month = _rollup_month(r.get("date"))
+        try:
+            price = float(r.get("unit_price") or 0)
+            qty   = float(r.get("quantity") or 0)
+        except (TypeError, ValueError):
+            continue
+        if month is None or price <= 0:
+            continue
+        date = r["date"][:10]
+        key  = (r.get("supplier") or "", _norm_desc(r.get("description")), month)
+        g    = groups.get(key)
+        if g is None:
+            g = groups[key] = {
+                "min": price, "max": price, "sum": 0.0, "n": 0, "qty": 0.0,
+                "first_price": price, "first_date": date,
+                "first_invoice_no": str(r.get("order_number") or ""),
+                "invoices": set(),
+            }
+        g["min"]  = min(g["min"], price)
+        g["max"]  = max(g["max"], price)
+        g["sum"] += price
+        g["n"]   += 1
+        g["qty"] += qty
+        g["invoices"].add(r.get("invoice_id"))
+        g["last_price"]      = price
+        g["last_date"]       = date
+        g["last_invoice_no"] = str(r.get("order_number") or "")
+        g["display"]         = (r.get("description") or "").strip()
+        g["item_number"]     = r.get("item_number") or ""
 
+    return [
+        [
+            supplier, desc, month, g["display"], g["item_number"],
+            g["min"], g["max"], g["sum"], g["n"], g["sum"] / g["n"],
+            g["first_price"], g["first_date"], g["first_invoice_no"],
+            g["last_price"], g["last_date"], g["last_invoice_no"],
+            g["qty"], len(g["invoices"]),
+        ]
+        for (supplier, desc, month), g in groups.items()
+    ]
 
-def set_user_active(email: str, active: int):
-    sql = "UPDATE users SET active = ? WHERE email = ?"
-    if USE_TURSO:
-        _turso_execute(sql, [active, email])
-    else:
-        with _local_conn() as conn:
-            conn.execute(sql, (active, email))
 
+def _rollup_rows_for_document(parsed: dict, invoice_id: int) -> list[dict]:
+    supplier = parsed.get("supplier", "LPS")
+    return [
+        {
+            "supplier":     supplier,
+            "description":  item.get("description", ""),
+            "item_number":  item.get("item_number", ""),
+            "date":         parsed.get("date", ""),
+            "order_number": parsed.get("order_number", ""),
+            "job_name":     parsed.get("job_name", ""),
+            "invoice_id":   invoice_id,
+            "unit_price":   item.get("unit_price", 0),
+            "quantity":     item.get("quantity", 0),
+        }
+        for item in parsed.get("items", [])
+    ]
 
-def set_user_role(email: str, role: str):
-    sql = "UPDATE users SET role = ? WHERE email = ?"
-    if USE_TURSO:
-        _turso_execute(sql, [role, email])
-    else:
-        with _local_conn() as conn:
-            conn.execute(sql, (role, email))
 
+def rebuild_price_rollup(pairs: list[tuple] | None = None) -> int:
+    """
+    Recompute price_rollup_monthly from invoice_items (backfill / repair job).
+
+    With ``pairs`` — a list of (supplier, normalised description) — only those
+    products are refolded; otherwise the whole table is rebuilt.
+    Returns the number of rollup rows written.
+    """
+    fetch_sql = """
+        SELECT ii.supplier, ii.description, ii.item_number, ii.unit_price,
+               ii.quantity, ii.invoice_id, inv.date, inv.order_number
+        FROM invoice_items ii
+        JOIN invoices inv ON inv.id = ii.invoice_id
+    """
+    del_sql = "DELETE FROM price_rollup_monthly"
+    params: list = []
+    if pairs:
+        placeholders = ", ".join("(?, ?)" for _ in pairs)
+        fetch_sql += f" WHERE (ii.supplier, LOWER(TRIM(ii.description))) IN (VALUES {placeholders})"
+        del_sql   += f" WHERE (supplier, description) IN (VALUES {placeholders})"
+        params = [v for s, d in pairs for v in (s, _norm_desc(d))]
+    fetch_sql += " ORDER BY inv.date, ii.id"
 
-def increment_failed_attempts(email: str) -> int:
-    """Increments counter, records timestamp, returns new count."""
-    now = datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S")
-    update = "UPDATE users SET failed_attempts = failed_attempts + 1, last_failed = ? WHERE email = ?"
-    select = "SELECT failed_attempts FROM users WHERE email = ?"
     if USE_TURSO:
-        _turso_execute(update, [now, email])
-        rows = _turso_execute(select, [email])
+        rows = _turso_execute(fetch_sql, params)
+        upserts = _rollup_fold(rows)
+        _turso_execute(del_sql, params)
+        for i in range(0, len(upserts), 200):
+            _turso_batch([(_ROLLUP_UPSERT_SQL, u) for u in upserts[i : i + 200]])
     else:
         with _local_conn() as conn:
-            conn.execute(update, (now, email))
-            rows = [dict(r) for r in conn.execute(select, (email,)).fetchall()]
-    return rows[0]["failed_attempts"] if rows else 0
+            rows = [dict(r) for r in conn.execute(fetch_sql, params).fetchall()]
+            upserts = _rollup_fold(rows)
+            conn.execute(del_sql, params)
+            conn.executemany(_ROLLUP_UPSERT_SQL, upserts)
 
+    cache_clear()
+    return len(upserts)
+
+
+def backfill_price_rollup() -> None:
+    """One-time migration: populate price_rollup_monthly from existing invoices."""
+    migration_id = "price_rollup_monthly_v1"
+    ensure_sql   = "CREATE TABLE IF NOT EXISTS _migrations (id TEXT PRIMARY KEY, run_at TEXT)"
+    check_sql    = "SELECT id FROM _migrations WHERE id = ?"
+    record_sql   = "INSERT OR IGNORE INTO _migrations (id, run_at) VALUES (?, datetime('now'))"
+
+    try:
+        if USE_TURSO:
+            _turso_execute(ensure_sql, [])
+            if _turso_execute(check_sql, [migration_id]):
+                return
+        else:
+            with _local_conn() as conn:
+                conn.execute(ensure_sql)
+                if conn.execute(check_sql, (migration_id,)).fetchone():
+                    return
+        written = rebuild_price_rollup()
+        if USE_TURSO:
+            _turso_execute(record_sql, [migration_id])
+        else:
+            with _local_conn() as conn:
+                conn.execute(record_sql, (migration_id,))
+        print(f"[backfill_price_rollup] {written} rollup rows written")
+    except Exception as e:
+        print(f"[backfill_price_rollup] migration skipped due to error: {e}")
+
+
+def get_price_rollup(
+    supplier: Optional[str] = None,
+    start_month: Optional[str] = None,
+    end_month: Optional[str] = None,
+) -> list[dict]:
+    """
+    Return rollup rows ordered by (description, month), optionally bounded by
+    supplier and an inclusive 'YYYY-MM' month range.  Cached for 5 minutes.
+    """
+    cache_key = f"price_rollup:{supplier or 'all'}:{start_month or ''}:{end_month or ''}"
+    cached = _cache_get(cache_key)
+    if cached is not None:
+        return cached
+
+    sql = f"SELECT {_ROLLUP_COLS} FROM price_rollup_monthly WHERE 1=1"
+    params: list = []
+    if supplier:
+        sql += " AND supplier = ?"
+        params.append(supplier)
+    if start_month:
+        sql += " AND month >= ?"
+        params.append(start_month)
+    if end_month:
+        sql += " AND month <= ?"
+        params.append(end_month)
+    sql += " ORDER BY supplier, description, month"
 
-def reset_failed_attempts(email: str):
-    sql = "UPDATE users SET failed_attempts = 0, last_failed = NULL WHERE email = ?"
     if USE_TURSO:
-        _turso_execute(sql, [email])
+        result = _turso_execute(sql, params)
     else:
         with _local_conn() as conn:
-            conn.execute(sql, (email,))
+            result = [dict(r) for r in conn.execute(sql, params).fetchall()]
 
+    _cache_set(cache_key, result, _ROLLUP_TTL)
+    return result
 
-# ── Login history ──────────────────────────────────────────────────────────────
 
-def log_login(email: str, ip: str = None):
-    """Record a successful login event."""
-    now = datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S")
-    sql = "INSERT INTO login_history (email, logged_at, ip) VALUES (?, ?, ?)"
+def count_products_by_supplier() -> dict[str, int]:
+    """Distinct normalised descriptions per supplier, read from the rollup."""
+    cache_key = "rollup_product_counts"
+    cached = _cache_get(cache_key)
+    if cached is not None:
+        return cached
+
+    sql = ("SELECT supplier, COUNT(DISTINCT description) AS cnt"
+           " FROM price_rollup_monthly GROUP BY supplier")
     if USE_TURSO:
-        _turso_execute(sql, [email, now, ip or ""])
+        rows = _turso_execute(sql)
     else:
         with _local_conn() as conn:
-            conn.execute(sql, (email, now, ip or ""))
+            rows = [dict(r) for r in conn.execute(sql).fetchall()]
 
+    result = {r["supplier"]: int(r["cnt"] or 0) for r in rows}
+    _cache_set(cache_key, result, _ROLLUP_TTL)
+    return result
 
-def get_login_history(email: str = None, limit: int = 200) -> list[dict]:
-    """Return login events newest-first, optionally filtered by email."""
-    if email:
-        sql = """
-            SELECT id, email, logged_at, ip
-            FROM login_history
-            WHERE email = ?
-            ORDER BY logged_at DESC
-            LIMIT ?
+
+# ── Running price statistics ───────────────────────────────────────────────────
+#
+# price_stats keeps count / mean / M2 (Welford) and the latest price for every
+# (supplier, normalised description).  save_parsed_document reads the rows for
+# the products on the new invoice and checks each line against them, so
+# flagging a price costs O(lines on the invoice) however long the history
+# grows.  The invoice's own lines are then merged in SQL (_STATS_MERGE_SQL:
+# count / mean / M2 of the new lines combined with the stored ones), never
+# written back as read, so concurrent saves of the same product all count.
+
+_STATS_MIN_HISTORY = 3      # lines of history before the z-score is trusted
+_STATS_Z_LIMIT     = 3.0    # |z| at or above this is an outlier ...
+_STATS_MIN_PCT     = 15.0   # ... if it is also at least this far from the mean
+_STATS_JUMP_PCT    = 25.0   # short or flat history: % move vs. last price that flags
+
+_STATS_COLS = "supplier, description, n, mean, m2, last_price, last_date"
+
+_STATS_UPSERT_SQL = f"INSERT OR REPLACE INTO price_stats ({_STATS_COLS}) VALUES (?,?,?,?,?,?,?)"
+
+# Chan et al.'s pairwise combination; SET expressions all see the stored row
+_STATS_MERGE_SQL = f"""
+    INSERT INTO price_stats ({_STATS_COLS}) VALUES (?,?,?,?,?,?,?)
+    ON CONFLICT (supplier, description) DO UPDATE SET
+        n          = n + excluded.n,
+        mean       = mean + (excluded.mean - mean) * excluded.n / (n + excluded.n),
+        m2         = m2 + excluded.m2
+                     + (excluded.mean - mean) * (excluded.mean - mean) * n * excluded.n / (n + excluded.n),
+        last_price = CASE WHEN excluded.last_date >= last_date THEN excluded.last_price ELSE last_price END,
+        last_date  = MAX(last_date, excluded.last_date)
+"""
+
+
+def _stats_select_sql(n_keys: int) -> str:
+    placeholders = ", ".join("(?, ?)" for _ in range(n_keys))
+    return (f"SELECT {_STATS_COLS} FROM price_stats"
+            f" WHERE (supplier, description) IN (VALUES {placeholders})")
+
+
+def _stats_keys(parsed: dict) -> list[tuple]:
+    supplier = parsed.get("supplier", "LPS")
+    return sorted({(supplier, _norm_desc(i.get("description"))) for i in parsed["items"]})
+
+
+def _stats_check_and_fold(stats: dict, key: tuple, price: float, date: str) -> dict | None:
+    """
+    Check ``price`` against the history in ``stats[key]``, then fold it in.
+
+    Returns the anomaly details when the price is an outlier, else None.
+    ``stats`` is updated in place (Welford's online mean / variance).
+    """
+    s = stats.get(key)
+    anomaly = None
+    if s and s["n"] > 0:
+        n, mean, last = s["n"], s["mean"], s["last_price"]
+        std = (s["m2"] / (n - 1)) ** 0.5 if n > 1 else 0.0
+        z   = (price - mean) / std if std > 0 else None
+        pct_vs_mean = (price - mean) / mean * 100 if mean else 0.0
+        pct_vs_last = (price - last) / last * 100 if last else 0.0
+        if n >= _STATS_MIN_HISTORY and z is not None:
+            outlier, ref = abs(z) >= _STATS_Z_LIMIT and abs(pct_vs_mean) >= _STATS_MIN_PCT, mean
+        else:
+            outlier, ref = abs(pct_vs_last) >= _STATS_JUMP_PCT, last
+        if outlier:
+            anomaly = {
+                "flag":          "high" if price > ref else "low",
+                "history_count": n,
+                "mean":          round(mean, 4),
+                "std":           round(std, 4),
+                "zscore":        round(z, 2) if z is not None else None,
+                "last_price":    round(last, 4),
+                "pct_vs_mean":   round(pct_vs_mean, 2),
+                "pct_vs_last":   round(pct_vs_last, 2),
+            }
+    else:
+        s = stats[key] = _stats_empty()
+    _stats_fold(s, price, date)
+    return anomaly
+
+
+def _stats_empty() -> dict:
+    return {"n": 0, "mean": 0.0, "m2": 0.0, "last_price": 0.0, "last_date": ""}
+
+
+def _stats_fold(s: dict, price: float, date: str) -> None:
+    """Fold one price into ``s`` (Welford's online mean / variance)."""
+    s["n"]    += 1
+    delta      = price - s["mean"]
+    s["mean"] += delta / s["n"]
+    s["m2"]   += delta * (price - s["mean"])
+    if (date or "") >= (s["last_date"] or ""):
+        s["last_price"], s["last_date"] = price, date or ""
+
+
+def _item_price(item: dict) -> float:
+    try:
+        return float(item.get("unit_price") or 0)
+    except (TypeError, ValueError):
+        return 0.0
+
+
+def _stats_flag_document(parsed: dict, stats: dict) -> tuple[list[str], list[dict]]:
+    """
+    Flag every line of ``parsed`` against ``stats`` (updated in place).
+    Returns (price_flag per item, anomaly dicts for the flagged lines).
+    """
+    supplier = parsed.get("supplier", "LPS")
+    date     = (parsed.get("date") or "")[:10]
+    flags: list[str] = []
+    anomalies: list[dict] = []
+    for item in parsed["items"]:
+        price = _item_price(item)
+        if price <= 0:
+            flags.append("")
+            continue
+        found = _stats_check_and_fold(stats, (supplier, _norm_desc(item.get("description"))), price, date)
+        flags.append(found["flag"] if found else "")
+        if found:
+            anomalies.append({
+                "description": item.get("description", ""),
+                "item_number": item.get("item_number", ""),
+                "unit_price":  round(price, 4),
+                **found,
+            })
+    return flags, anomalies
+
+
+def _stats_upserts(stats: dict, keys) -> list[list]:
+    return [
+        [sup, desc, s["n"], s["mean"], s["m2"], s["last_price"], s["last_date"]]
+        for (sup, desc) in keys
+        if (s := stats.get((sup, desc))) and s["n"] > 0
+    ]
+
+
+def _stats_merges(docs: list[dict]) -> list[list]:
+    """The priced lines of ``docs`` summarised per product, as _STATS_MERGE_SQL rows."""
+    batch: dict = {}
+    for parsed in docs:
+        supplier = parsed.get("supplier", "LPS")
+        date     = (parsed.get("date") or "")[:10]
+        for item in parsed["items"]:
+            price = _item_price(item)
+            if price > 0:
+                key = (supplier, _norm_desc(item.get("description")))
+                _stats_fold(batch.setdefault(key, _stats_empty()), price, date)
+    return _stats_upserts(batch, sorted(batch))
+
+
+def rebuild_price_stats(pairs: list[tuple] | None = None) -> dict:
+    """
+    Recompute price_stats and invoice_items.price_flag by replaying history in
+    date order (backfill / repair job).  With ``pairs`` — (supplier, normalised
+    description) — only those products are replayed.
+    Returns {"products": ..., "flagged": ...}.
+    """
+    fetch_sql = """
+        SELECT ii.id, ii.supplier, ii.description, ii.unit_price, ii.price_flag, inv.date
+        FROM invoice_items ii
+        JOIN invoices inv ON inv.id = ii.invoice_id
+    """
+    del_sql = "DELETE FROM price_stats"
+    params: list = []
+    if pairs:
+        placeholders = ", ".join("(?, ?)" for _ in pairs)
+        fetch_sql += f" WHERE (ii.supplier, LOWER(TRIM(ii.description))) IN (VALUES {placeholders})"
+        del_sql   += f" WHERE (supplier, description) IN (VALUES {placeholders})"
+        params = [v for s, d in pairs for v in (s, _norm_desc(d))]
+    fetch_sql += " ORDER BY inv.date, ii.id"
+
+    if USE_TURSO:
+        rows = _turso_execute(fetch_sql, params)
+    else:
+        with _local_conn() as conn:
+            rows = [dict(r) for r in conn.execute(fetch_sql, params).fetchall()]
+
+    stats: dict = {}
+    flag_updates: list[list] = []
+    flagged = 0
+    for r in rows:
+        price = _item_price(r)
+        flag = ""
+        if price > 0:
+            key   = (r.get("supplier") or "", _norm_desc(r.get("description")))
+            found = _stats_check_and_fold(stats, key, price, (r.get("date") or "")[:10])
+            flag  = found["flag"] if found else ""
+        flagged += bool(flag)
+        if flag != (r.get("price_flag") or ""):
+            flag_updates.append([flag, r["id"]])
+
+    upserts  = _stats_upserts(stats, stats.keys())
+    flag_sql = "UPDATE invoice_items SET price_flag = ? WHERE id = ?"
+    if USE_TURSO:
+        _turso_execute(del_sql, params)
+        statements = [(_STATS_UPSERT_SQL, u) for u in upserts] + [(flag_sql, f) for f in flag_updates]
+        for i in range(0, len(statements), 200):
+            _turso_batch(statements[i : i + 200])
+    else:
+        with _local_conn() as conn:
+            conn.execute(del_sql, params)
+            conn.executemany(_STATS_UPSERT_SQL, upserts)
+            conn.executemany(flag_sql, flag_updates)
+
+    cache_clear()
+    return {"products": len(upserts), "flagged": flagged}
+
+
+def backfill_price_stats() -> None:
+    """One-time migration: populate price_stats and item flags from existing invoices."""
+    migration_id = "price_stats_v1"
+    ensure_sql   = "CREATE TABLE IF NOT EXISTS _migrations (id TEXT PRIMARY KEY, run_at TEXT)"
+    check_sql    = "SELECT id FROM _migrations WHERE id = ?"
+    record_sql   = "INSERT OR IGNORE INTO _migrations (id, run_at) VALUES (?, datetime('now'))"
+
+    try:
+        if USE_TURSO:
+            _turso_execute(ensure_sql, [])
+            if _turso_execute(check_sql, [migration_id]):
+                return
+        else:
+            with _local_conn() as conn:
+                conn.execute(ensure_sql)
+                if conn.execute(check_sql, (migration_id,)).fetchone():
+                    return
+        result = rebuild_price_stats()
+        if USE_TURSO:
+            _turso_execute(record_sql, [migration_id])
+        else:
+            with _local_conn() as conn:
+                conn.execute(record_sql, (migration_id,))
+        print(f"[backfill_price_stats] {result['products']} products, {result['flagged']} lines flagged")
+    except Exception as e:
+        print(f"[backfill_price_stats] migration skipped due to error: {e}")
+
+
+# ── Spend cube ─────────────────────────────────────────────────────────────────
+#
+# spend_cube holds quantity, extended spend (quantity × unit price) and line
+# count per (supplier, YYYY-MM, job_name, normalised description).  Every
+# measure is a sum, so ingest adds an invoice's cells with an upsert and
+# delete_invoice subtracts them the same way.  Undated lines land in month ''.
+
+_SPEND_UPSERT_SQL = """
+    INSERT INTO spend_cube
+        (supplier, month, job_name, description, display_description, quantity, spend, line_count)
+    VALUES (?,?,?,?,?,?,?,?)
+    ON CONFLICT (supplier, month, job_name, description) DO UPDATE SET
+        display_description = CASE WHEN excluded.line_count > 0
+                                   THEN excluded.display_description ELSE display_description END,
+        quantity            = quantity + excluded.quantity,
+        spend               = spend + excluded.spend,
+        line_count          = line_count + excluded.line_count
+"""
+
+_SPEND_PRUNE_SQL = "DELETE FROM spend_cube WHERE line_count <= 0"
+
+# /api/spend dimension name → spend_cube column
+SPEND_DIMENSIONS = {
+    "supplier":    "supplier",
+    "month":       "month",
+    "job":         "job_name",
+    "description": "description",
+}
+
+_SPEND_SORTS = {"spend": "spend", "quantity": "quantity", "lines": "line_count"}
+
+
+def _spend_fold(rows, sign: int = 1) -> list[list]:
+    """
+    Fold line rows (supplier, description, date, job_name, unit_price,
+    quantity) into spend_cube upsert parameter lists.  ``sign=-1`` produces
+    the deltas that remove those lines again.
+    """
+    cells: dict[tuple, list] = {}
+    for r in rows:
+        try:
+            price = float(r.get("unit_price") or 0)
+            qty   = float(r.get("quantity") or 0)
+        except (TypeError, ValueError):
+            continue
+        key = (
+            r.get("supplier") or "",
+            _rollup_month(r.get("date")) or "",
+            (r.get("job_name") or "").strip(),
+            _norm_desc(r.get("description")),
+        )
+        c = cells.get(key)
+        if c is None:
+            c = cells[key] = ["", 0.0, 0.0, 0]
+        c[0]  = (r.get("description") or "").strip()
+        c[1] += qty
+        c[2] += qty * price
+        c[3] += 1
+    return [
+        [*key, display, sign * qty, sign * spend, sign * n]
+        for key, (display, qty, spend, n) in cells.items()
+    ]
+
+
+def rebuild_spend_cube() -> int:
+    """Recompute spend_cube from every invoice line.  Returns the number of cells written."""
+    fetch_sql = """
+        SELECT ii.supplier, ii.description, ii.quantity, ii.unit_price, inv.date, inv.job_name
+        FROM invoice_items ii
+        JOIN invoices inv ON inv.id = ii.invoice_id
+    """
+    if USE_TURSO:
+        cells = _spend_fold(_turso_execute(fetch_sql))
+        _turso_execute("DELETE FROM spend_cube")
+        for i in range(0, len(cells), 200):
+            _turso_batch([(_SPEND_UPSERT_SQL, c) for c in cells[i : i + 200]])
+    else:
+        with _local_conn() as conn:
+            cells = _spend_fold(dict(r) for r in conn.execute(fetch_sql).fetchall())
+            conn.execute("DELETE FROM spend_cube")
+            conn.executemany(_SPEND_UPSERT_SQL, cells)
+
+    cache_clear()
+    return len(cells)
+
+
+def backfill_spend_cube() -> None:
+    """One-time migration: populate spend_cube from existing invoices."""
+    migration_id = "spend_cube_v1"
+    ensure_sql   = "CREATE TABLE IF NOT EXISTS _migrations (id TEXT PRIMARY KEY, run_at TEXT)"
+    check_sql    = "SELECT id FROM _migrations WHERE id = ?"
+    record_sql   = "INSERT OR IGNORE INTO _migrations (id, run_at) VALUES (?, datetime('now'))"
+
+    try:
+        if USE_TURSO:
+            _turso_execute(ensure_sql, [])
+            if _turso_execute(check_sql, [migration_id]):
+                return
+        else:
+            with _local_conn() as conn:
+                conn.execute(ensure_sql)
+                if conn.execute(check_sql, (migration_id,)).fetchone():
+                    return
+        written = rebuild_spend_cube()
+        if USE_TURSO:
+            _turso_execute(record_sql, [migration_id])
+        else:
+            with _local_conn() as conn:
+                conn.execute(record_sql, (migration_id,))
+        print(f"[backfill_spend_cube] {written} cube cells written")
+    except Exception as e:
+        print(f"[backfill_spend_cube] migration skipped due to error: {e}")
+
+
+def query_spend(
+    group_by: list[str],
+    supplier: Optional[str] = None,
+    job: Optional[str] = None,
+    description: Optional[str] = None,
+    start_month: Optional[str] = None,
+    end_month: Optional[str] = None,
+    sort: str = "spend",
+    limit: int = 500,
+) -> list[dict]:
+    """
+    Slice and roll up spend_cube.
+
+    ``group_by`` is a list of SPEND_DIMENSIONS keys (empty = grand total).
+    ``supplier`` / ``job`` filter exactly, ``description`` is a substring of
+    the normalised description, months are inclusive 'YYYY-MM'.
+    Rows carry the grouped dimensions plus quantity, spend and line_count,
+    sorted descending by ``sort`` (spend | quantity | lines).  Cached for 5 minutes.
+    """
+    cols = [SPEND_DIMENSIONS[d] for d in group_by]
+    order = _SPEND_SORTS.get(sort, "spend")
+    # repr keeps None ("no filter") apart from "" and values containing ':'
+    cache_key = "spend:" + repr((cols, supplier, job, description, start_month, end_month, order, limit))
+    cached = _cache_get(cache_key)
+    if cached is not None:
+        return cached
+
+    select = [f"{c} AS {d}" for d, c in zip(group_by, cols)]
+    if "description" in cols:
+        select.append("MAX(display_description) AS display_description")
+    select += ["SUM(quantity) AS quantity", "SUM(spend) AS spend", "SUM(line_count) AS line_count"]
+    sql = f"SELECT {', '.join(select)} FROM spend_cube WHERE 1=1"
+    params: list = []
+    if supplier:
+        sql += " AND supplier = ?"
+        params.append(supplier)
+    if job is not None:
+        sql += " AND job_name = ?"
+        params.append(job)
+    if description:
+        sql += " AND description LIKE '%' || ? || '%'"
+        params.append(_norm_desc(description))
+    if start_month:
+        sql += " AND month >= ?"
+        params.append(start_month)
+    if end_month:
+        sql += " AND month <= ?"
+        params.append(end_month)
+    if cols:
+        sql += f" GROUP BY {', '.join(cols)}"
+    sql += f" ORDER BY SUM({order}) DESC LIMIT ?"
+    params.append(int(limit))
+
+    if USE_TURSO:
+        result = _turso_execute(sql, params)
+    else:
+        with _local_conn() as conn:
+            result = [dict(r) for r in conn.execute(sql, params).fetchall()]
+
+    for r in result:
+        r["quantity"]   = round(float(r["quantity"] or 0), 4)
+        r["spend"]      = round(float(r["spend"] or 0), 2)
+        r["line_count"] = int(r["line_count"] or 0)
+    _cache_set(cache_key, result, _ROLLUP_TTL)
+    return result
+
+
+# ── Cross-supplier product groups ──────────────────────────────────────────────
+
+_GROUP_INSERT_SQL = (
+    "INSERT INTO product_groups (group_id, supplier, description, method, confidence)"
+    " VALUES (?, ?, ?, ?, ?)"
+)
+
+
+def replace_product_groups(groups: list[dict]) -> int:
+    """
+    Replace the stored equivalence groups with ``groups`` — the output of
+    ``sku_matcher.cluster_equivalents``.  Returns the number of member rows written.
+    """
+    rows = [
+        [gid, supplier, description, g.get("method"), g.get("confidence")]
+        for gid, g in enumerate(groups, start=1)
+        for supplier, description in g["members"]
+    ]
+    if USE_TURSO:
+        _turso_execute("DELETE FROM product_groups")
+        for i in range(0, len(rows), 200):
+            _turso_batch([(_GROUP_INSERT_SQL, r) for r in rows[i : i + 200]])
+    else:
+        with _local_conn() as conn:
+            conn.execute("DELETE FROM product_groups")
+            conn.executemany(_GROUP_INSERT_SQL, rows)
+    cache_clear()
+    return len(rows)
+
+
+def get_product_groups() -> list[dict]:
+    """All group member rows ordered by group then supplier.  Cached for 5 minutes."""
+    cache_key = "product_groups"
+    cached = _cache_get(cache_key)
+    if cached is not None:
+        return cached
+
+    sql = ("SELECT group_id, supplier, description, method, confidence, created_at"
+           " FROM product_groups ORDER BY group_id, supplier, description")
+    if USE_TURSO:
+        result = _turso_execute(sql)
+    else:
+        with _local_conn() as conn:
+            result = [dict(r) for r in conn.execute(sql).fetchall()]
+
+    _cache_set(cache_key, result, _ROLLUP_TTL)
+    return result
+
+
+# ── PDF parse jobs ─────────────────────────────────────────────────────────────
+#
+# Queue state for background PDF parsing.  It belongs to this server instance
+# (the temp files and worker pool are local), so it always lives in the local
+# SQLite file, never in Turso.  Finished results stay until the upload is
+# confirmed or the job expires.
+
+_PARSE_JOBS_DDL = """
+    CREATE TABLE IF NOT EXISTS parse_jobs (
+        id          TEXT PRIMARY KEY,
+        status      TEXT NOT NULL DEFAULT 'queued',   -- queued | running | done | failed
+        filename    TEXT,
+        supplier    TEXT,
+        sha256      TEXT,
+        result      TEXT,                             -- JSON parse payload when done
+        error       TEXT DEFAULT '',
+        created_by  TEXT,
+        created_at  TEXT DEFAULT (datetime('now')),
+        updated_at  TEXT DEFAULT (datetime('now')),
+        expires_at  TEXT
+    );
+
+    CREATE INDEX IF NOT EXISTS idx_parse_jobs_expires ON parse_jobs (expires_at);
+"""
+
+_PARSE_JOB_COLS = ("id, status, filename, supplier, sha256, result, error, created_by,"
+                   " created_at, updated_at, expires_at")
+
+
+def create_parse_job(job_id: str, filename: str, supplier: str, sha256: str,
+                     created_by: str, ttl_seconds: int) -> None:
+    """Queue a parse job; expired jobs are purged on the way in."""
+    with _local_conn() as conn:
+        conn.execute("DELETE FROM parse_jobs WHERE expires_at < datetime('now')")
+        conn.execute(
+            """INSERT INTO parse_jobs (id, filename, supplier, sha256, created_by, expires_at)
+               VALUES (?, ?, ?, ?, ?, datetime('now', ?))""",
+            (job_id, filename, supplier, sha256, created_by, f"+{int(ttl_seconds)} seconds"),
+        )
+
+
+def update_parse_job(job_id: str, status: str, result: dict | None = None, error: str = "") -> None:
+    with _local_conn() as conn:
+        conn.execute(
+            """UPDATE parse_jobs SET status = ?, result = ?, error = ?, updated_at = datetime('now')
+               WHERE id = ?""",
+            (status, json.dumps(result) if result is not None else None, error, job_id),
+        )
+
+
+def _fail_stale_parse_jobs(conn, stale_seconds: int) -> None:
+    """Queued/running jobs that haven't moved in stale_seconds lost their worker (server restart)."""
+    if stale_seconds:
+        conn.execute(
+            """UPDATE parse_jobs SET status = 'failed', updated_at = datetime('now'),
+                      error = 'Parsing was interrupted. Please upload the file again.'
+               WHERE status IN ('queued', 'running') AND updated_at < datetime('now', ?)""",
+            (f"-{int(stale_seconds)} seconds",),
+        )
+
+
+def get_parse_job(job_id: str, stale_seconds: int = 0) -> dict | None:
+    """
+    Return the job (result decoded), or None if unknown / expired.
+    With ``stale_seconds``, stuck queued/running jobs are reported as failed.
+    """
+    with _local_conn() as conn:
+        _fail_stale_parse_jobs(conn, stale_seconds)
+        row = conn.execute(
+            f"SELECT {_PARSE_JOB_COLS} FROM parse_jobs WHERE id = ? AND expires_at >= datetime('now')",
+            (job_id,),
+        ).fetchone()
+    if row is None:
+        return None
+    job = dict(row)
+    job["result"] = json.loads(job["result"]) if job["result"] else None
+    return job
+
+
+def count_active_parse_jobs(stale_seconds: int = 0) -> int:
+    """Jobs still queued or running."""
+    with _local_conn() as conn:
+        _fail_stale_parse_jobs(conn, stale_seconds)
+        return conn.execute(
+            "SELECT COUNT(*) FROM parse_jobs WHERE status IN ('queued', 'running')"
+        ).fetchone()[0]
+
+
+def delete_parse_job(job_id: str, created_by: str) -> None:
+    """Drop a job once its result has been confirmed (or discarded) — only the creator's own job."""
+    with _local_conn() as conn:
+        conn.execute("DELETE FROM parse_jobs WHERE id = ? AND created_by = ?", (job_id, created_by))
+
+
+# ── User whitelist helpers ─────────────────────────────────────────────────────
+
+_USER_COLS = "id, email, role, active, failed_attempts, last_failed"
+
+
+def get_user(email: str) -> dict | None:
+    sql = f"SELECT {_USER_COLS} FROM users WHERE email = ?"
+    if USE_TURSO:
+        rows = _turso_execute(sql, [email])
+    else:
+        with _local_conn() as conn:
+            rows = [dict(r) for r in conn.execute(sql, (email,)).fetchall()]
+    return rows[0] if rows else None
+
+
+def list_users() -> list[dict]:
+    sql = f"SELECT {_USER_COLS} FROM users ORDER BY email"
+    if USE_TURSO:
+        return _turso_execute(sql)
+    else:
+        with _local_conn() as conn:
+            return [dict(r) for r in conn.execute(sql).fetchall()]
+
+
+def add_user(email: str, role: str = "user") -> bool:
+    """Insert a new whitelisted user. Returns False if email already exists."""
+    check = "SELECT id FROM users WHERE email = ?"
+    insert = "INSERT INTO users (email, role, active) VALUES (?, ?, 1)"
+    if USE_TURSO:
+        if _turso_execute(check, [email]):
+            return False
+        _turso_execute(insert, [email, role])
+    else:
+        with _local_conn() as conn:
+            if conn.execute(check, (email,)).fetchone():
+                return False
+            conn.execute(insert, (email, role))
+    return True
+
+
+def set_user_active(email: str, active: int):
+    sql = "UPDATE users SET active = ? WHERE email = ?"
+    if USE_TURSO:
+        _turso_execute(sql, [active, email])
+    else:
+        with _local_conn() as conn:
+            conn.execute(sql, (active, email))
+
+
+def set_user_role(email: str, role: str):
+    sql = "UPDATE users SET role = ? WHERE email = ?"
+    if USE_TURSO:
+        _turso_execute(sql, [role, email])
+    else:
+        with _local_conn() as conn:
+            conn.execute(sql, (role, email))
+
+
+def increment_failed_attempts(email: str) -> int:
+    """Increments counter, records timestamp, returns new count."""
+    now = datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S")
+    update = "UPDATE users SET failed_attempts = failed_attempts + 1, last_failed = ? WHERE email = ?"
+    select = "SELECT failed_attempts FROM users WHERE email = ?"
+    if USE_TURSO:
+        _turso_execute(update, [now, email])
+        rows = _turso_execute(select, [email])
+    else:
+        with _local_conn() as conn:
+            conn.execute(update, (now, email))
+            rows = [dict(r) for r in conn.execute(select, (email,)).fetchall()]
+    return rows[0]["failed_attempts"] if rows else 0
+
+
+def reset_failed_attempts(email: str):
+    sql = "UPDATE users SET failed_attempts = 0, last_failed = NULL WHERE email = ?"
+    if USE_TURSO:
+        _turso_execute(sql, [email])
+    else:
+        with _local_conn() as conn:
+            conn.execute(sql, (email,))
+
+
+# ── Login history ──────────────────────────────────────────────────────────────
+
+def log_login(email: str, ip: str = None):
+    """Record a successful login event."""
+    now = datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S")
+    sql = "INSERT INTO login_history (email, logged_at, ip) VALUES (?, ?, ?)"
+    if USE_TURSO:
+        _turso_execute(sql, [email, now, ip or ""])
+    else:
+        with _local_conn() as conn:
+            conn.execute(sql, (email, now, ip or ""))
+
+
+def get_login_history(email: str = None, limit: int = 200) -> list[dict]:
+    """Return login events newest-first, optionally filtered by email."""
+    if email:
+        sql = """
+            SELECT id, email, logged_at, ip
+            FROM login_history
+            WHERE email = ?
+            ORDER BY logged_at DESC
+            LIMIT ?
         """
         params = [email, limit]
     else:
@@ -961,6 +2229,435 @@ def get_login_history(email: str = None, limit: int = 200) -> list[dict]:
             return [dict(r) for r in conn.execute(sql, params).fetchall()]
 
 
+# ── Version history storage ───────────────────────────────────────────────────
+#
+# Saves append full snapshots (in SQL, see _snapshot_sql).  compact_versions
+# later rewrites older snapshots as zlib-compressed JSON patches against the
+# version before them (base_id), keeping a full keyframe once a chain holds
+# VERSION_KEYFRAME_EVERY - 1 patches, so rebuilding any version replays at
+# most that many.  Rows with base_id NULL hold the document itself.
+
+VERSION_KEYFRAME_EVERY = 10
+
+_VERSION_TABLES = {
+    "templates": ("template_versions", "template_id"),
+    "estimates": ("estimate_versions", "estimate_id"),
+}
+
+
+def _encode_delta(patch: list) -> str:
+    return base64.b64encode(zlib.compress(json.dumps(patch, separators=(",", ":")).encode(), 9)).decode("ascii")
+
+
+def _decode_delta(data: str) -> list:
+    return json.loads(zlib.decompress(base64.b64decode(data)))
+
+
+def _rebuild_versions(rows: list[dict]) -> dict[int, str]:
+    """
+    Full data for each of ``rows`` — one document's versions in id order,
+    starting at a keyframe.  Returns {version id: JSON text}.
+    """
+    texts, docs = {}, {}
+    for r in rows:
+        if r["base_id"] is None:
+            texts[r["id"]] = r["data"]
+            continue
+        base = docs.get(r["base_id"])
+        if base is None:
+            base = docs[r["base_id"]] = json.loads(texts[r["base_id"]])
+        docs[r["id"]] = apply_patch(base, _decode_delta(r["data"]))
+        texts[r["id"]] = json.dumps(docs[r["id"]], separators=(",", ":"))
+    return texts
+
+
+def _version_data(table: str, version_id: int) -> str | None:
+    """The full data of one version, replaying patches from its keyframe. Not cached."""
+    ver, fk = _VERSION_TABLES[table]
+    doc = f"(SELECT {fk} FROM {ver} WHERE id = ?)"
+    sql = (f"SELECT id, base_id, data FROM {ver} WHERE {fk} = {doc} AND id <= ?"
+           f" AND id >= (SELECT MAX(id) FROM {ver} WHERE {fk} = {doc} AND id <= ? AND base_id IS NULL)"
+           f" ORDER BY id")
+    params = [version_id] * 4
+    if USE_TURSO:
+        rows = _turso_execute(sql, params)
+    else:
+        with _local_conn() as conn:
+            rows = [dict(r) for r in conn.execute(sql, params).fetchall()]
+    if not rows or rows[-1]["id"] != version_id:
+        return None
+    return _rebuild_versions(rows)[version_id]
+
+
+def compact_versions(
+    table: str, keyframe_every: int = VERSION_KEYFRAME_EVERY, dry_run: bool = False, lease: str | None = None,
+) -> dict:
+    """
+    Delta-encode ``table``'s version history ("templates" or "estimates").
+
+    Every full snapshot becomes a compressed patch against the version before
+    it, when that is smaller, unless the chain it would extend already holds
+    ``keyframe_every - 1`` patches — then it stays a keyframe.  Each document is
+    rewritten in one transaction; new saves may land meanwhile.  With
+    ``dry_run`` nothing is written.  Returns {"documents", "versions",
+    "converted", "bytes_before", "bytes_after"}.
+
+    Writing holds the retention lease (``lease`` is the caller's holder id if
+    it already owns it), so no base is picked while another process prunes.
+    Raises RuntimeError if a retention run elsewhere holds it.
+    """
+    if not dry_run and lease is None:
+        with _retention_lease() as holder:
+            return compact_versions(table, keyframe_every, dry_run, holder)
+
+    ver, fk = _VERSION_TABLES[table]
+    # Only documents with more full snapshots than their keyframes need
+    docs_sql = (f"SELECT {fk} AS doc_id FROM {ver} GROUP BY {fk}"
+                f" HAVING SUM(base_id IS NULL) > (COUNT(*) + ? - 1) / ?")
+    rows_sql = f"SELECT id, base_id, data FROM {ver} WHERE {fk} = ? ORDER BY id"
+    upd_sql  = f"UPDATE {ver} SET data = ?, base_id = ? WHERE id = ? AND base_id IS NULL"
+    total_sql = f"SELECT COUNT(*) AS versions, COALESCE(SUM(LENGTH(CAST(data AS BLOB))), 0) AS size FROM {ver}"
+
+    def _read(sql, params):
+        if USE_TURSO:
+            return _turso_execute(sql, params)
+        with _local_conn() as conn:
+            return [dict(r) for r in conn.execute(sql, params).fetchall()]
+
+    total = _read(total_sql, [])[0]
+    stats = {"documents": 0, "versions": int(total["versions"]), "converted": 0,
+             "bytes_before": int(total["size"]), "bytes_after": int(total["size"])}
+
+    for doc in _read(docs_sql, [keyframe_every, keyframe_every]):
+        rows  = _read(rows_sql, [doc["doc_id"]])
+        texts = _rebuild_versions(rows)
+        updates = []
+        # Keyframes follow chain depth (patches since the last full row), not
+        # position, so pruning rows out of the middle never merges two chains.
+        # A full row only becomes a patch if the chain it extends, plus the
+        # patches already built on it (tail), stays within keyframe_every - 1.
+        tail: dict[int, int] = {}
+        for r in reversed(rows):
+            if r["base_id"] is not None:
+                tail[r["base_id"]] = max(tail.get(r["base_id"], 0), tail.get(r["id"], 0) + 1)
+        depth = {rows[0]["id"]: 0}
+        for i in range(1, len(rows)):
+            row, prev = rows[i], rows[i - 1]
+            if row["base_id"] is not None:
+                depth[row["id"]] = depth.get(row["base_id"], 0) + 1
+                continue
+            depth[row["id"]] = 0
+            if depth[prev["id"]] + 1 + tail.get(row["id"], 0) >= keyframe_every:
+                continue
+            try:
+                before, after = json.loads(texts[prev["id"]]), json.loads(texts[row["id"]])
+            except ValueError:
+                continue
+            patch = make_patch(before, after)
+            if apply_patch(before, patch) != after:
+                continue
+            encoded = _encode_delta(patch)
+            size    = len(row["data"].encode())
+            if len(encoded) < size:
+                updates.append([encoded, prev["id"], row["id"]])
+                depth[row["id"]] = depth[prev["id"]] + 1
+                stats["bytes_after"] -= size - len(encoded)
+        if not updates:
+            continue
+        stats["documents"] += 1
+        stats["converted"] += len(updates)
+        if dry_run:
+            continue
+        _keep_lease(lease)
+        if USE_TURSO:
+            _turso_transaction([(upd_sql, u) for u in updates])
+        else:
+            with _local_conn() as conn:
+                conn.executemany(upd_sql, updates)
+    return stats
+
+
+# ── Retention ─────────────────────────────────────────────────────────────────
+#
+# Thins out version history (everything from the last keep_all_hours, then the
+# newest version per hour for hourly_days, then the newest per day) and drops
+# old login_history rows.  Deletes go in small transactions with a pause in
+# between so a run never holds the database for long.  A kept delta whose base
+# is deleted is first rewritten as a full snapshot; compact_versions then
+# delta-encodes what is left.
+#
+# Every server process schedules runs, so pruning and compacting hold a lease:
+# the RETENTION_LEASE row of maintenance_leases, claimed with a conditional
+# UPDATE, renewed as the run goes and stamped with the run's stats on release.
+# A holder that dies simply lets it expire.
+
+RETENTION_LEASE         = "version_retention"
+RETENTION_LEASE_SECONDS = 900
+
+_lease_renewed: dict[str, float] = {}   # holder → monotonic time of its last claim
+
+
+def _claim_lease(holder: str) -> bool:
+    """Claim (or renew, for its current holder) the retention lease. True if ``holder`` now owns it."""
+    ensure_sql = "INSERT OR IGNORE INTO maintenance_leases (name) VALUES (?)"
+    claim_sql  = ("UPDATE maintenance_leases SET holder = ?, expires_at = datetime('now', ?)"
+                  " WHERE name = ? AND (holder = ? OR expires_at IS NULL OR expires_at < datetime('now'))"
+                  " RETURNING name")
+    params = [holder, f"+{RETENTION_LEASE_SECONDS} seconds", RETENTION_LEASE, holder]
+    if USE_TURSO:
+        rows = _turso_batch([(ensure_sql, [RETENTION_LEASE]), (claim_sql, params)])[1]
+    else:
+        with _local_conn() as conn:
+            conn.execute(ensure_sql, (RETENTION_LEASE,))
+            rows = conn.execute(claim_sql, params).fetchall()
+    if rows:
+        _lease_renewed[holder] = time.monotonic()
+    return bool(rows)
+
+
+def _keep_lease(holder: str) -> None:
+    """Renew the lease once a third of it has run down; RuntimeError if it was lost."""
+    if time.monotonic() - _lease_renewed.get(holder, 0) < RETENTION_LEASE_SECONDS / 3:
+        return
+    if not _claim_lease(holder):
+        raise RuntimeError("Retention lease lost — another process took over")
+
+
+def _release_lease(holder: str, last_run: dict | None = None) -> None:
+    """Give up the lease; ``last_run`` replaces the stored stats of the last run."""
+    sql = ("UPDATE maintenance_leases SET holder = NULL, expires_at = NULL, last_run = COALESCE(?, last_run)"
+           " WHERE name = ? AND holder = ?")
+    params = [json.dumps(last_run) if last_run is not None else None, RETENTION_LEASE, holder]
+    _lease_renewed.pop(holder, None)
+    if USE_TURSO:
+        _turso_execute(sql, params)
+    else:
+        with _local_conn() as conn:
+            conn.execute(sql, params)
+
+
+@contextmanager
+def _retention_lease():
+    """Hold the retention lease for the block; RuntimeError if another process has it."""
+    holder = uuid.uuid4().hex
+    if not _claim_lease(holder):
+        raise RuntimeError("Version retention is running in another process — try again later")
+    try:
+        yield holder
+    finally:
+        _release_lease(holder)
+
+
+def get_retention_last() -> dict:
+    """Stats of the last finished retention run (from any process), or {}."""
+    sql = "SELECT last_run FROM maintenance_leases WHERE name = ?"
+    if USE_TURSO:
+        rows = _turso_execute(sql, [RETENTION_LEASE])
+    else:
+        with _local_conn() as conn:
+            rows = [dict(r) for r in conn.execute(sql, (RETENTION_LEASE,)).fetchall()]
+    if not rows or not rows[0]["last_run"]:
+        return {}
+    return json.loads(rows[0]["last_run"])
+
+
+def _retained_versions(rows: list[dict], all_after: str, hourly_after: str) -> set[int]:
+    """Ids of one document's versions (in id order) the retention policy keeps."""
+    keep, buckets = set(), {}
+    for r in rows:
+        saved_at = r["saved_at"] or ""
+        if saved_at >= all_after:
+            keep.add(r["id"])
+        else:
+            # Later rows overwrite earlier ones: the newest in each bucket stays
+            buckets[saved_at[:13] if saved_at >= hourly_after else saved_at[:10]] = r["id"]
+    return keep | set(buckets.values())
+
+
+def prune_versions(
+    table: str, keep_all_hours: int, hourly_days: int, batch_size: int = 200, pause: float = 0.05,
+    lease: str | None = None,
+) -> dict:
+    """
+    Apply the retention policy to ``table``'s versions ("templates" or
+    "estimates").  Returns {"documents", "deleted", "rematerialised",
+    "bytes_reclaimed"}.  Holds the retention lease like compact_versions.
+    """
+    if lease is None:
+        with _retention_lease() as holder:
+            return prune_versions(table, keep_all_hours, hourly_days, batch_size, pause, holder)
+    ver, fk = _VERSION_TABLES[table]
+    now          = datetime.utcnow()
+    all_after    = (now - timedelta(hours=keep_all_hours)).strftime("%Y-%m-%d %H:%M:%S")
+    hourly_after = (now - timedelta(days=hourly_days)).strftime("%Y-%m-%d %H:%M:%S")
+    docs_sql = f"SELECT {fk} AS doc_id FROM {ver} WHERE saved_at < ? GROUP BY {fk} HAVING COUNT(*) > 1"
+    rows_sql = f"SELECT id, base_id, data, saved_at FROM {ver} WHERE {fk} = ? ORDER BY id"
+    full_sql = f"UPDATE {ver} SET data = ?, base_id = NULL WHERE id = ?"
+
+    def _read(sql, params):
+        if USE_TURSO:
+            return _turso_execute(sql, params)
+        with _local_conn() as conn:
+            return [dict(r) for r in conn.execute(sql, params).fetchall()]
+
+    stats = {"documents": 0, "deleted": 0, "rematerialised": 0, "bytes_reclaimed": 0}
+    for doc in _read(docs_sql, [all_after]):
+        rows = _read(rows_sql, [doc["doc_id"]])
+        keep = _retained_versions(rows, all_after, hourly_after)
+        # Newest first: a delta is never left behind by its base being deleted
+        drop = [r for r in reversed(rows) if r["id"] not in keep]
+        if not drop:
+            continue
+        stats["documents"] += 1
+        base  = {r["id"]: r["base_id"] for r in rows}
+        size  = {r["id"]: len(r["data"].encode()) for r in rows}
+        texts = None
+        gone: set[int] = set()
+        for start in range(0, len(drop), batch_size):
+            batch = {r["id"] for r in drop[start:start + batch_size]}
+            gone |= batch
+            # Surviving deltas built on a row about to go become full snapshots
+            orphans = [i for i, b in base.items() if i not in gone and b in batch]
+            if orphans and texts is None:
+                texts = _rebuild_versions(rows)
+            statements = [(full_sql, [texts[i], i]) for i in orphans]
+            statements.append((f"DELETE FROM {ver} WHERE id IN ({','.join('?' * len(batch))})", sorted(batch)))
+            _keep_lease(lease)
+            if USE_TURSO:
+                _turso_transaction(statements)
+            else:
+                _local_transaction(statements)
+            for i in orphans:
+                base[i] = None
+                stats["bytes_reclaimed"] -= len(texts[i].encode()) - size[i]
+            stats["deleted"] += len(batch)
+            stats["rematerialised"] += len(orphans)
+            stats["bytes_reclaimed"] += sum(size[i] for i in batch)
+            time.sleep(pause)
+    return stats
+
+
+def prune_login_history(keep_days: int, batch_size: int = 200, pause: float = 0.05) -> int:
+    """Delete login events older than ``keep_days``, a batch at a time. Returns rows deleted."""
+    cutoff = (datetime.utcnow() - timedelta(days=keep_days)).strftime("%Y-%m-%d %H:%M:%S")
+    sql = ("DELETE FROM login_history WHERE id IN"
+           " (SELECT id FROM login_history WHERE logged_at < ? ORDER BY id LIMIT ?) RETURNING id")
+    deleted = 0
+    while True:
+        if USE_TURSO:
+            n = len(_turso_execute(sql, [cutoff, batch_size]))
+        else:
+            with _local_conn() as conn:
+                n = len(conn.execute(sql, (cutoff, batch_size)).fetchall())
+        deleted += n
+        if n < batch_size:
+            return deleted
+        time.sleep(pause)
+
+
+def run_retention(
+    keep_all_hours: int, hourly_days: int, login_days: int, batch_size: int = 200,
+) -> dict | None:
+    """
+    Prune then re-compact template/estimate versions and prune login_history
+    under the retention lease.  Returns per-table stats (also stored for
+    get_retention_last), or None if a run is already in progress anywhere.
+    """
+    holder = uuid.uuid4().hex
+    if not _claim_lease(holder):
+        return None
+    stats: dict | None = None
+    try:
+        started = time.perf_counter()
+        run: dict = {"started_at": datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S")}
+        for table in _VERSION_TABLES:
+            pruned    = prune_versions(table, keep_all_hours, hourly_days, batch_size, lease=holder)
+            compacted = compact_versions(table, lease=holder)
+            pruned["bytes_reclaimed"] += compacted["bytes_before"] - compacted["bytes_after"]
+            pruned["delta_encoded"] = compacted["converted"]
+            pruned["remaining"] = compacted["versions"]
+            run[table] = pruned
+        run["login_history"] = {"deleted": prune_login_history(login_days, batch_size)}
+        run["seconds"] = round(time.perf_counter() - started, 2)
+        stats = run
+        return stats
+    finally:
+        _release_lease(holder, stats)
+
+
+# ── Listing summaries ─────────────────────────────────────────────────────────
+#
+# templates.item_count / subtotal and estimates.row_count / plumbing_total /
+# gas_total / grand_total are derived from the data blob in SQL (JSON1) every
+# time a blob is written, so listings read a few numbers per row instead of
+# fetching and parsing every document.  Estimates summarise their first
+# scenario (older flat estimates: the top level).
+
+_TEMPLATE_PRODUCTS = "json_each(data, CASE json_type(data) WHEN 'array' THEN '$' ELSE '$.products' END)"
+_ESTIMATE_ROOT     = "(CASE json_type(data, '$.scenarios[0]') WHEN 'object' THEN '$.scenarios[0]' ELSE '$' END)"
+
+
+def _json_num(path: str) -> str:
+    return f"CAST(json_extract(data, {_ESTIMATE_ROOT} || '{path}') AS REAL)"
+
+
+_SUMMARY_SQL: dict[str, dict[str, str]] = {
+    "templates": {
+        "item_count": f"(SELECT COUNT(*) FROM {_TEMPLATE_PRODUCTS})",
+        # A line's total, else last price x quantity
+        "subtotal": f"""(SELECT COALESCE(SUM(CASE
+                WHEN json_extract(value, '$.total') IS NOT NULL
+                THEN CAST(json_extract(value, '$.total') AS REAL)
+                ELSE CAST(COALESCE(NULLIF(NULLIF(json_extract(value, '$.last_price'), ''), 0),
+                                   NULLIF(NULLIF(json_extract(value, '$."Last Price"'), ''), 0), 0) AS REAL)
+                     * CAST(json_extract(value, '$.quantity') AS REAL)
+            END), 0) FROM {_TEMPLATE_PRODUCTS} WHERE type = 'object')""",
+    },
+    "estimates": {
+        "row_count": f"""(SELECT COALESCE(SUM(json_array_length(value, '$.rows')), 0)
+            FROM json_each(data, {_ESTIMATE_ROOT} || '.sections') WHERE type = 'object')""",
+        "plumbing_total": f"COALESCE({_json_num('.plumbing_total')}, 0)",
+        "gas_total":      f"COALESCE({_json_num('.gas_total')}, 0)",
+        "grand_total":    f"COALESCE({_json_num('.grand_total')}, {_json_num('.plumbing_total')}, 0)",
+    },
+}
+
+
+def _summary_update_sql(table: str, where: str) -> str:
+    """UPDATE that recomputes ``table``'s summary columns for the rows matching ``where``."""
+    sets = ", ".join(
+        f"{col} = CASE WHEN json_valid(data) THEN {expr} ELSE 0 END"
+        for col, expr in _SUMMARY_SQL[table].items()
+    )
+    return f"UPDATE {table} SET {sets} WHERE {where}"
+
+
+def backfill_listing_summaries() -> None:
+    """One-time migration: compute the listing summary columns for existing templates and estimates."""
+    migration_id = "listing_summaries_v1"
+    ensure_sql   = "CREATE TABLE IF NOT EXISTS _migrations (id TEXT PRIMARY KEY, run_at TEXT)"
+    check_sql    = "SELECT id FROM _migrations WHERE id = ?"
+    record_sql   = "INSERT OR IGNORE INTO _migrations (id, run_at) VALUES (?, datetime('now'))"
+    statements   = [(_summary_update_sql(t, "1=1"), []) for t in _SUMMARY_SQL]
+    statements.append((record_sql, [migration_id]))
+
+    try:
+        if USE_TURSO:
+            _turso_execute(ensure_sql, [])
+            if _turso_execute(check_sql, [migration_id]):
+                return
+            _turso_transaction(statements)
+        else:
+            with _local_conn() as conn:
+                conn.execute(ensure_sql)
+                if conn.execute(check_sql, (migration_id,)).fetchone():
+                    return
+            _local_transaction(statements)
+        print("[backfill_listing_summaries] done")
+    except Exception as e:
+        print(f"[backfill_listing_summaries] migration skipped due to error: {e}")
+
+
 # ── Template storage ───────────────────────────────────────────────────────────
 
 def _can_write_template(template: dict, actor_email: str, actor_role: str) -> bool:
@@ -971,6 +2668,76 @@ def _can_read_template(template: dict, viewer_email: str, viewer_role: str) -> b
     return viewer_role == "admin" or template["owner_email"] == viewer_email
 
 
+# Templates and estimates are versioned the same way.  The snapshot of the
+# current blob is taken inside the database (INSERT ... SELECT), with the
+# permission check in the WHERE clause, so a save, rename, restore or copy is
+# one transaction that never sends the old data to the client and back.
+
+_OWNER_OR_ADMIN = "(? = 'admin' OR owner_email = ?)"
+
+
+def _snapshot_sql(table: str, ver_table: str, fk: str) -> str:
+    """Copy the current data of (name, folder) into the versions table, if the actor may write it."""
+    return (f"INSERT INTO {ver_table} ({fk}, data, saved_by, saved_at)"
+            f" SELECT id, data, ?, ? FROM {table} WHERE name=? AND folder=? AND {_OWNER_OR_ADMIN}")
+
+
+def _first_version_sql(table: str, ver_table: str, fk: str) -> str:
+    """Run straight after an INSERT into ``table``: version the row it created, if any."""
+    return (f"INSERT INTO {ver_table} ({fk}, data, saved_by, saved_at)"
+            f" SELECT id, data, ?, ? FROM {table} WHERE id = last_insert_rowid() AND changes() = 1")
+
+
+def _save_doc_statements(
+    table: str, ver_table: str, fk: str,
+    name: str, folder: str, actor_email: str, actor_role: str, data_json: str, now: str,
+    revision: int | None = None,
+) -> list[tuple]:
+    """
+    Snapshot-and-update an existing template/estimate, or create it with a first version.
+    Statement 1 returns the id of an updated row, statement 2 the id of a new one;
+    neither returns anything when the row exists but the actor may not write it.
+    Estimates also bump and return their revision; given ``revision``, only an
+    existing estimate still at that revision is written.
+    """
+    who     = [actor_role, actor_email]
+    counted = table == "estimates"
+    match   = " AND revision=?" if revision is not None else ""
+    at      = [revision] if revision is not None else []
+    bump    = ", revision=revision+1" if counted else ""
+    ret     = "id, revision" if counted else "id"
+    return [
+        (_snapshot_sql(table, ver_table, fk) + match, [actor_email, now, name, folder, *who, *at]),
+        (f"UPDATE {table} SET data=?, updated_at=?, updated_by=?{bump}"
+         f" WHERE name=? AND folder=? AND {_OWNER_OR_ADMIN}{match} RETURNING {ret}",
+         [data_json, now, actor_email, name, folder, *who, *at]),
+        (f"INSERT INTO {table} (name, folder, owner_email, data, created_at, updated_at, updated_by)"
+         f" SELECT ?,?,?,?,?,?,? WHERE NOT EXISTS (SELECT 1 FROM {table} WHERE name=? AND folder=?)"
+         f" AND ? IS NULL RETURNING {ret}",
+         [name, folder, actor_email, data_json, now, now, actor_email, name, folder, revision]),
+        (_first_version_sql(table, ver_table, fk), [actor_email, now]),
+        (_summary_update_sql(table, "name=? AND folder=?"), [name, folder]),
+    ]
+
+
+def _duplicate_doc_statements(
+    table: str, ver_table: str, fk: str,
+    src_name: str, src_folder: str, dst_name: str, dst_folder: str,
+    actor_email: str, actor_role: str, now: str,
+) -> list[tuple]:
+    """Copy a readable template/estimate to a free name; statement 0 returns the new id."""
+    return [
+        (f"INSERT INTO {table} (name, folder, owner_email, data, created_at, updated_at, updated_by)"
+         f" SELECT ?, ?, ?, data, ?, ?, ? FROM {table}"
+         f" WHERE name=? AND folder=? AND {_OWNER_OR_ADMIN}"
+         f" AND NOT EXISTS (SELECT 1 FROM {table} WHERE name=? AND folder=?) RETURNING id",
+         [dst_name, dst_folder, actor_email, now, now, actor_email,
+          src_name, src_folder, actor_role, actor_email, dst_name, dst_folder]),
+        (_first_version_sql(table, ver_table, fk), [actor_email, now]),
+        (_summary_update_sql(table, "name=? AND folder=?"), [dst_name, dst_folder]),
+    ]
+
+
 def save_template_db(
     name: str, folder: str, actor_email: str, actor_role: str, data_json: str
 ) -> int | None:
@@ -978,46 +2745,15 @@ def save_template_db(
     Insert or update a template, always snapshotting old data as a version first.
     Returns the template id, or None if access is denied.
     """
-    now      = datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S")
-    find_sql = "SELECT id, owner_email, data FROM templates WHERE name=? AND folder=?"
-    ver_sql  = "INSERT INTO template_versions (template_id, data, saved_by, saved_at) VALUES (?,?,?,?)"
-    upd_sql  = "UPDATE templates SET data=?, updated_at=?, updated_by=? WHERE id=?"
-    ins_sql  = ("INSERT INTO templates (name, folder, owner_email, data, created_at, updated_at, updated_by)"
-                " VALUES (?,?,?,?,?,?,?)")
-
+    now        = datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S")
+    statements = _save_doc_statements("templates", "template_versions", "template_id",
+                                      name, folder, actor_email, actor_role, data_json, now)
     if USE_TURSO:
-        rows = _turso_execute(find_sql, [name, folder])
-        if rows:
-            t = rows[0]
-            if not _can_write_template(t, actor_email, actor_role):
-                return None
-            tid = t["id"]
-            _turso_execute(ver_sql, [tid, t["data"], actor_email, now])
-            _turso_execute(upd_sql, [data_json, now, actor_email, tid])
-            return tid
-        _turso_execute(ins_sql, [name, folder, actor_email, data_json, now, now, actor_email])
-        new = _turso_execute(
-            "SELECT id FROM templates WHERE name=? AND folder=? ORDER BY id DESC LIMIT 1",
-            [name, folder],
-        )
-        tid = new[0]["id"]
-        _turso_execute(ver_sql, [tid, data_json, actor_email, now])
-        return tid
+        results = _turso_transaction(statements)
     else:
-        with _local_conn() as conn:
-            row = conn.execute(find_sql, (name, folder)).fetchone()
-            if row:
-                t = dict(row)
-                if not _can_write_template(t, actor_email, actor_role):
-                    return None
-                tid = t["id"]
-                conn.execute(ver_sql, (tid, t["data"], actor_email, now))
-                conn.execute(upd_sql, (data_json, now, actor_email, tid))
-                return tid
-            cur = conn.execute(ins_sql, (name, folder, actor_email, data_json, now, now, actor_email))
-            tid = cur.lastrowid
-            conn.execute(ver_sql, (tid, data_json, actor_email, now))
-            return tid
+        results = _local_transaction(statements)
+    rows = results[1] or results[2]
+    return rows[0]["id"] if rows else None
 
 
 def get_template_db(name: str, folder: str, viewer_email: str, viewer_role: str) -> dict | None:
@@ -1034,15 +2770,20 @@ def get_template_db(name: str, folder: str, viewer_email: str, viewer_role: str)
     return t if _can_read_template(t, viewer_email, viewer_role) else None
 
 
+# Listings carry the summary columns, never the data blob
+_TEMPLATES_LIST_COLS = ("id, name, folder, owner_email, created_at, updated_at, updated_by,"
+                        " item_count, subtotal")
+_ESTIMATES_LIST_COLS = ("id, name, folder, owner_email, created_at, updated_at, updated_by,"
+                        " row_count, plumbing_total, gas_total, grand_total")
+
+
 def list_templates_db(viewer_email: str, viewer_role: str) -> list[dict]:
-    """Return all templates the viewer is allowed to see."""
+    """Return metadata and summary totals (no data) for all templates the viewer may see."""
     if viewer_role == "admin":
-        sql    = ("SELECT id, name, folder, owner_email, data, created_at, updated_at, updated_by"
-                  " FROM templates ORDER BY updated_at DESC")
+        sql    = f"SELECT {_TEMPLATES_LIST_COLS} FROM templates ORDER BY updated_at DESC"
         params: list = []
     else:
-        sql    = ("SELECT id, name, folder, owner_email, data, created_at, updated_at, updated_by"
-                  " FROM templates WHERE owner_email=? ORDER BY updated_at DESC")
+        sql    = f"SELECT {_TEMPLATES_LIST_COLS} FROM templates WHERE owner_email=? ORDER BY updated_at DESC"
         params = [viewer_email]
 
     if USE_TURSO:
@@ -1073,116 +2814,108 @@ def rename_template_db(
     old_name: str, old_folder: str, new_name: str, new_folder: str,
     actor_email: str, actor_role: str,
 ) -> bool:
-    find_sql  = "SELECT id, owner_email, data FROM templates WHERE name=? AND folder=?"
-    check_sql = "SELECT id FROM templates WHERE name=? AND folder=?"
-    ver_sql   = "INSERT INTO template_versions (template_id, data, saved_by, saved_at) VALUES (?,?,?,?)"
-    upd_sql   = "UPDATE templates SET name=?, folder=?, updated_at=?, updated_by=? WHERE id=?"
-    now = datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S")
-
+    now   = datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S")
+    free  = "NOT EXISTS (SELECT 1 FROM templates WHERE name=? AND folder=?)"
+    statements = [
+        (_snapshot_sql("templates", "template_versions", "template_id") + f" AND {free}",
+         [actor_email, now, old_name, old_folder, actor_role, actor_email, new_name, new_folder]),
+        ("UPDATE templates SET name=?, folder=?, updated_at=?, updated_by=?"
+         f" WHERE name=? AND folder=? AND {_OWNER_OR_ADMIN} AND {free} RETURNING id",
+         [new_name, new_folder, now, actor_email, old_name, old_folder,
+          actor_role, actor_email, new_name, new_folder]),
+    ]
     if USE_TURSO:
-        rows = _turso_execute(find_sql, [old_name, old_folder])
-        if not rows or not _can_write_template(rows[0], actor_email, actor_role):
-            return False
-        if _turso_execute(check_sql, [new_name, new_folder]):
-            return False
-        t = rows[0]
-        _turso_execute(ver_sql, [t["id"], t["data"], actor_email, now])
-        _turso_execute(upd_sql, [new_name, new_folder, now, actor_email, t["id"]])
+        results = _turso_transaction(statements)
     else:
-        with _local_conn() as conn:
-            row = conn.execute(find_sql, (old_name, old_folder)).fetchone()
-            if not row or not _can_write_template(dict(row), actor_email, actor_role):
-                return False
-            if conn.execute(check_sql, (new_name, new_folder)).fetchone():
-                return False
-            t = dict(row)
-            conn.execute(ver_sql, (t["id"], t["data"], actor_email, now))
-            conn.execute(upd_sql, (new_name, new_folder, now, actor_email, t["id"]))
-    return True
+        results = _local_transaction(statements)
+    return bool(results[1])
 
 
 def duplicate_template_db(
     src_name: str, src_folder: str, dst_name: str, dst_folder: str,
     actor_email: str, actor_role: str,
 ) -> bool:
-    find_sql  = "SELECT id, owner_email, data FROM templates WHERE name=? AND folder=?"
-    check_sql = "SELECT id FROM templates WHERE name=? AND folder=?"
-    ins_sql   = ("INSERT INTO templates (name, folder, owner_email, data, created_at, updated_at, updated_by)"
-                 " VALUES (?,?,?,?,?,?,?)")
-    ver_sql   = "INSERT INTO template_versions (template_id, data, saved_by, saved_at) VALUES (?,?,?,?)"
-    now = datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S")
-
+    now        = datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S")
+    statements = _duplicate_doc_statements("templates", "template_versions", "template_id",
+                                           src_name, src_folder, dst_name, dst_folder,
+                                           actor_email, actor_role, now)
     if USE_TURSO:
-        src_rows = _turso_execute(find_sql, [src_name, src_folder])
-        if not src_rows or not _can_read_template(src_rows[0], actor_email, actor_role):
-            return False
-        if _turso_execute(check_sql, [dst_name, dst_folder]):
-            return False
-        src = src_rows[0]
-        _turso_execute(ins_sql, [dst_name, dst_folder, actor_email, src["data"], now, now, actor_email])
-        new = _turso_execute(
-            "SELECT id FROM templates WHERE name=? AND folder=? ORDER BY id DESC LIMIT 1",
-            [dst_name, dst_folder],
-        )
-        _turso_execute(ver_sql, [new[0]["id"], src["data"], actor_email, now])
+        results = _turso_transaction(statements)
     else:
-        with _local_conn() as conn:
-            row = conn.execute(find_sql, (src_name, src_folder)).fetchone()
-            if not row or not _can_read_template(dict(row), actor_email, actor_role):
-                return False
-            if conn.execute(check_sql, (dst_name, dst_folder)).fetchone():
-                return False
-            cur = conn.execute(ins_sql, (
-                dst_name, dst_folder, actor_email, row["data"], now, now, actor_email,
-            ))
-            conn.execute(ver_sql, (cur.lastrowid, row["data"], actor_email, now))
-    return True
+        results = _local_transaction(statements)
+    return bool(results[0])
 
 
-def get_template_versions_db(name: str, folder: str, viewer_email: str, viewer_role: str) -> list[dict]:
+def get_template_versions_db(
+    name: str, folder: str, viewer_email: str, viewer_role: str, include_data: bool = False,
+) -> list[dict]:
+    """
+    Versions of a template, newest first.  With ``include_data`` each entry
+    also carries the full ``data`` (delta-encoded versions are rebuilt).
+    """
     find_sql = "SELECT id, owner_email FROM templates WHERE name=? AND folder=?"
-    ver_sql  = ("SELECT id, template_id, saved_by, saved_at"
-                " FROM template_versions WHERE template_id=? ORDER BY saved_at DESC")
+    cols     = "id, template_id, saved_by, saved_at" + (", base_id, data" if include_data else "")
+    ver_sql  = f"SELECT {cols} FROM template_versions WHERE template_id=? ORDER BY id"
     if USE_TURSO:
         rows = _turso_execute(find_sql, [name, folder])
         if not rows or not _can_read_template(rows[0], viewer_email, viewer_role):
             return []
-        return _turso_execute(ver_sql, [rows[0]["id"]])
+        versions = _turso_execute(ver_sql, [rows[0]["id"]])
     else:
         with _local_conn() as conn:
             row = conn.execute(find_sql, (name, folder)).fetchone()
             if not row or not _can_read_template(dict(row), viewer_email, viewer_role):
                 return []
-            return [dict(r) for r in conn.execute(ver_sql, (row["id"],)).fetchall()]
+            versions = [dict(r) for r in conn.execute(ver_sql, (row["id"],)).fetchall()]
+    if include_data:
+        texts = _rebuild_versions(versions)
+        for v in versions:
+            v["data"] = texts[v["id"]]
+            del v["base_id"]
+    versions.sort(key=lambda v: v["saved_at"] or "", reverse=True)
+    return versions
 
 
 def restore_template_version_db(version_id: int, actor_email: str, actor_role: str) -> bool:
-    find_ver  = "SELECT id, template_id, data FROM template_versions WHERE id=?"
-    find_tmpl = "SELECT id, owner_email, data FROM templates WHERE id=?"
-    ver_sql   = "INSERT INTO template_versions (template_id, data, saved_by, saved_at) VALUES (?,?,?,?)"
-    upd_sql   = "UPDATE templates SET data=?, updated_at=?, updated_by=? WHERE id=?"
-    now = datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S")
-
+    now  = datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S")
+    tid  = "(SELECT template_id FROM template_versions WHERE id=?)"
+    full = "(SELECT base_id FROM template_versions WHERE id=?) IS NULL"
+    snapshot = ("INSERT INTO template_versions (template_id, data, saved_by, saved_at)"
+                f" SELECT id, data, ?, ? FROM templates WHERE id={tid} AND {_OWNER_OR_ADMIN}")
+    # A full snapshot is copied back inside the database
+    statements = [
+        (snapshot + f" AND {full}", [actor_email, now, version_id, actor_role, actor_email, version_id]),
+        ("UPDATE templates SET data=(SELECT data FROM template_versions WHERE id=?), updated_at=?, updated_by=?"
+         f" WHERE id={tid} AND {_OWNER_OR_ADMIN} AND {full} RETURNING id",
+         [version_id, now, actor_email, version_id, actor_role, actor_email, version_id]),
+        (_summary_update_sql("templates", f"id={tid}"), [version_id]),
+        ("SELECT base_id FROM template_versions WHERE id=?", [version_id]),
+    ]
     if USE_TURSO:
-        vr = _turso_execute(find_ver, [version_id])
-        if not vr:
-            return False
-        tr = _turso_execute(find_tmpl, [vr[0]["template_id"]])
-        if not tr or not _can_write_template(tr[0], actor_email, actor_role):
-            return False
-        _turso_execute(ver_sql, [tr[0]["id"], tr[0]["data"], actor_email, now])
-        _turso_execute(upd_sql, [vr[0]["data"], now, actor_email, tr[0]["id"]])
+        results = _turso_transaction(statements)
     else:
-        with _local_conn() as conn:
-            vr = conn.execute(find_ver, (version_id,)).fetchone()
-            if not vr:
-                return False
-            tr = conn.execute(find_tmpl, (vr["template_id"],)).fetchone()
-            if not tr or not _can_write_template(dict(tr), actor_email, actor_role):
-                return False
-            conn.execute(ver_sql, (tr["id"], tr["data"], actor_email, now))
-            conn.execute(upd_sql, (vr["data"], now, actor_email, tr["id"]))
-    return True
+        results = _local_transaction(statements)
+    if results[1]:
+        return True
+    if not results[3] or results[3][0]["base_id"] is None:
+        return False
+
+    # A delta-encoded version is rebuilt here and written back as the data
+    data = _version_data("templates", version_id)
+    if data is None:
+        return False
+    statements = [
+        (snapshot, [actor_email, now, version_id, actor_role, actor_email]),
+        ("UPDATE templates SET data=?, updated_at=?, updated_by=?"
+         f" WHERE id={tid} AND {_OWNER_OR_ADMIN} RETURNING id",
+         [data, now, actor_email, version_id, actor_role, actor_email]),
+        (_summary_update_sql("templates", f"id={tid}"), [version_id]),
+    ]
+    if USE_TURSO:
+        results = _turso_transaction(statements)
+    else:
+        results = _local_transaction(statements)
+    return bool(results[1])
 
 
 def count_templates_db(viewer_email: str, viewer_role: str) -> int:
@@ -1209,61 +2942,52 @@ def _can_read_estimate(estimate: dict, viewer_email: str, viewer_role: str) -> b
 
 
 def save_estimate_db(
-    name: str, folder: str, actor_email: str, actor_role: str, data_json: str
-) -> int | None:
-    now      = datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S")
-    find_sql = "SELECT id, owner_email, data FROM estimates WHERE name=? AND folder=?"
-    ver_sql  = "INSERT INTO estimate_versions (estimate_id, data, saved_by, saved_at) VALUES (?,?,?,?)"
-    upd_sql  = "UPDATE estimates SET data=?, updated_at=?, updated_by=? WHERE id=?"
-    ins_sql  = ("INSERT INTO estimates (name, folder, owner_email, data, created_at, updated_at, updated_by)"
-                " VALUES (?,?,?,?,?,?,?)")
-
-    # Always write to local SQLite first — returns immediately (~1 ms)
-    with _local_conn() as conn:
-        row = conn.execute(find_sql, (name, folder)).fetchone()
-        if row:
-            t = dict(row)
-            if not _can_write_estimate(t, actor_email, actor_role):
-                return None
-            tid = t["id"]
-            conn.execute(ver_sql, (tid, t["data"], actor_email, now))
-            conn.execute(upd_sql, (data_json, now, actor_email, tid))
-        else:
-            cur = conn.execute(ins_sql, (name, folder, actor_email, data_json, now, now, actor_email))
-            tid = cur.lastrowid
-            conn.execute(ver_sql, (tid, data_json, actor_email, now))
+    name: str, folder: str, actor_email: str, actor_role: str, data_json: str,
+    revision: int | None = None,
+) -> dict | None:
+    """
+    Save an estimate; returns {"id", "revision"}, or None if access is denied
+    (or, given ``revision``, the stored estimate is no longer at that revision).
+    """
+    now = datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S")
+
+    # Always write to local SQLite first — returns immediately (~1 ms).  The
+    # revision is checked here only: Turso just follows the local copy.
+    results = _local_transaction(_save_doc_statements(
+        "estimates", "estimate_versions", "estimate_id",
+        name, folder, actor_email, actor_role, data_json, now, revision))
+    rows = results[1] or results[2]
+    if not rows:
+        return None
+    saved = {"id": rows[0]["id"], "revision": int(rows[0]["revision"] or 0)}
 
     # Sync to Turso in the background — does not block the HTTP response
     if USE_TURSO:
-        _est_key = f"{folder}/{name}" if folder else name
+        _est_key   = f"{folder}/{name}" if folder else name
+        statements = _save_doc_statements("estimates", "estimate_versions", "estimate_id",
+                                          name, folder, actor_email, actor_role, data_json, now)
         def _turso_sync():
             try:
-                rows = _turso_execute(find_sql, [name, folder])
-                if rows:
-                    t = rows[0]
-                    _turso_execute(ver_sql, [t["id"], t["data"], actor_email, now])
-                    _turso_execute(upd_sql, [data_json, now, actor_email, t["id"]])
-                else:
-                    _turso_execute(ins_sql, [name, folder, actor_email, data_json, now, now, actor_email])
-                    new = _turso_execute(
-                        "SELECT id FROM estimates WHERE name=? AND folder=? ORDER BY id DESC LIMIT 1",
-                        [name, folder],
-                    )
-                    new_tid = new[0]["id"]
-                    _turso_execute(ver_sql, [new_tid, data_json, actor_email, now])
+                _turso_transaction(statements)
                 _turso_sync_errors.pop(_est_key, None)  # clear any previous error on success
             except Exception as e:
                 _turso_sync_errors[_est_key] = str(e)
                 print(f"[save_estimate_db] Turso background sync error: {e}")
         threading.Thread(target=_turso_sync, daemon=True).start()
 
-    return tid
+    return saved
 
 
-def get_estimate_db(name: str, folder: str, viewer_email: str, viewer_role: str) -> dict | None:
-    sql = ("SELECT id, name, folder, owner_email, data, created_at, updated_at, updated_by"
+def get_estimate_db(
+    name: str, folder: str, viewer_email: str, viewer_role: str, local: bool = False,
+) -> dict | None:
+    """
+    An estimate the viewer may read, or None.  ``local`` reads the local
+    SQLite copy, which save_estimate_db updates before Turso catches up.
+    """
+    sql = ("SELECT id, name, folder, owner_email, data, created_at, updated_at, updated_by, revision"
            " FROM estimates WHERE name=? AND folder=?")
-    if USE_TURSO:
+    if USE_TURSO and not local:
         rows = _turso_execute(sql, [name, folder])
     else:
         with _local_conn() as conn:
@@ -1275,13 +2999,12 @@ def get_estimate_db(name: str, folder: str, viewer_email: str, viewer_role: str)
 
 
 def list_estimates_db(viewer_email: str, viewer_role: str) -> list[dict]:
+    """Return metadata and summary totals (no data) for all estimates the viewer may see."""
     if viewer_role == "admin":
-        sql    = ("SELECT id, name, folder, owner_email, data, created_at, updated_at, updated_by"
-                  " FROM estimates ORDER BY updated_at DESC")
+        sql    = f"SELECT {_ESTIMATES_LIST_COLS} FROM estimates ORDER BY updated_at DESC"
         params: list = []
     else:
-        sql    = ("SELECT id, name, folder, owner_email, data, created_at, updated_at, updated_by"
-                  " FROM estimates WHERE owner_email=? ORDER BY updated_at DESC")
+        sql    = f"SELECT {_ESTIMATES_LIST_COLS} FROM estimates WHERE owner_email=? ORDER BY updated_at DESC"
         params = [viewer_email]
 
     if USE_TURSO:
@@ -1312,38 +3035,15 @@ def duplicate_estimate_db(
     src_name: str, src_folder: str, dst_name: str, dst_folder: str,
     actor_email: str, actor_role: str,
 ) -> bool:
-    find_sql  = "SELECT id, owner_email, data FROM estimates WHERE name=? AND folder=?"
-    check_sql = "SELECT id FROM estimates WHERE name=? AND folder=?"
-    ins_sql   = ("INSERT INTO estimates (name, folder, owner_email, data, created_at, updated_at, updated_by)"
-                 " VALUES (?,?,?,?,?,?,?)")
-    ver_sql   = "INSERT INTO estimate_versions (estimate_id, data, saved_by, saved_at) VALUES (?,?,?,?)"
-    now = datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S")
-
+    now        = datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S")
+    statements = _duplicate_doc_statements("estimates", "estimate_versions", "estimate_id",
+                                           src_name, src_folder, dst_name, dst_folder,
+                                           actor_email, actor_role, now)
     if USE_TURSO:
-        src_rows = _turso_execute(find_sql, [src_name, src_folder])
-        if not src_rows or not _can_read_estimate(src_rows[0], actor_email, actor_role):
-            return False
-        if _turso_execute(check_sql, [dst_name, dst_folder]):
-            return False
-        src = src_rows[0]
-        _turso_execute(ins_sql, [dst_name, dst_folder, actor_email, src["data"], now, now, actor_email])
-        new = _turso_execute(
-            "SELECT id FROM estimates WHERE name=? AND folder=? ORDER BY id DESC LIMIT 1",
-            [dst_name, dst_folder],
-        )
-        _turso_execute(ver_sql, [new[0]["id"], src["data"], actor_email, now])
+        results = _turso_transaction(statements)
     else:
-        with _local_conn() as conn:
-            row = conn.execute(find_sql, (src_name, src_folder)).fetchone()
-            if not row or not _can_read_estimate(dict(row), actor_email, actor_role):
-                return False
-            if conn.execute(check_sql, (dst_name, dst_folder)).fetchone():
-                return False
-            cur = conn.execute(ins_sql, (
-                dst_name, dst_folder, actor_email, row["data"], now, now, actor_email,
-            ))
-            conn.execute(ver_sql, (cur.lastrowid, row["data"], actor_email, now))
-    return True
+        results = _local_transaction(statements)
+    return bool(results[0])
 
 
 def move_estimate_db(
@@ -1405,51 +3105,53 @@ def search_estimate_catalog(query: str, limit: int = 20) -> list[dict]:
             return [dict(r) for r in conn.execute(sql, (query, limit)).fetchall()]
 
 
-def upsert_estimate_catalog(
-    description: str, unit_cost: float, comments: str, add_comments: str,
-    category: str, estimate_name: str = "",
-) -> int:
+_CATALOG_KEY   = "description, unit_cost, comments, add_comments"
+_CATALOG_CHUNK = 100   # catalog entries per multi-row statement (7 params each)
+
+
+def sync_estimate_catalog(estimate_name: str, entries: list[dict]) -> None:
     """
+    Replace an estimate's catalog usage with ``entries`` (description,
+    unit_cost, comments, add_comments, category) in one transaction — a
+    single Turso round trip however many rows the estimate has.
+
     Unique key is (description, unit_cost, comments, add_comments).
     Same description with any different value creates a new catalog entry,
     giving the user a variety of versions to choose from in autocomplete.
+    Every occurrence bumps its entry's use_count.
     """
-    now      = datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S")
-    find_sql = """SELECT id FROM estimate_catalog
-                  WHERE description=? AND unit_cost=? AND comments=? AND add_comments=?"""
-    bump_sql = "UPDATE estimate_catalog SET use_count=use_count+1, last_used=? WHERE id=?"
-    ins_sql  = ("INSERT INTO estimate_catalog (description, unit_cost, comments, add_comments, category,"
-                " use_count, last_used) VALUES (?,?,?,?,?,1,?)")
-    usage_sql = ("INSERT OR IGNORE INTO estimate_catalog_usage (catalog_id, estimate_name, used_at)"
-                 " VALUES (?,?,?)")
-
-    if USE_TURSO:
-        rows = _turso_execute(find_sql, [description, unit_cost, comments, add_comments])
-        if rows:
-            eid = rows[0]["id"]
-            _turso_execute(bump_sql, [now, eid])
+    now    = datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S")
+    counts: dict[tuple, list] = {}   # key -> [category of first occurrence, occurrences]
+    for e in entries:
+        key = (e["description"], float(e.get("unit_cost") or 0),
+               e.get("comments") or "", e.get("add_comments") or "")
+        if key in counts:
+            counts[key][1] += 1
         else:
-            _turso_execute(ins_sql, [description, unit_cost, comments, add_comments, category, now])
-            new = _turso_execute(
-                "SELECT id FROM estimate_catalog WHERE description=? AND unit_cost=? AND comments=? AND add_comments=? ORDER BY id DESC LIMIT 1",
-                [description, unit_cost, comments, add_comments],
-            )
-            eid = new[0]["id"]
+            counts[key] = [e.get("category") or "", 1]
+
+    statements = [("DELETE FROM estimate_catalog_usage WHERE estimate_name = ?", [estimate_name])]
+    keys = list(counts)
+    for i in range(0, len(keys), _CATALOG_CHUNK):
+        chunk = keys[i:i + _CATALOG_CHUNK]
+        statements.append((
+            f"INSERT INTO estimate_catalog ({_CATALOG_KEY}, category, use_count, last_used)"
+            f" VALUES {','.join(['(?,?,?,?,?,?,?)'] * len(chunk))}"
+            f" ON CONFLICT ({_CATALOG_KEY}) DO UPDATE"
+            f" SET use_count = use_count + excluded.use_count, last_used = excluded.last_used",
+            [v for k in chunk for v in (*k, *counts[k], now)],
+        ))
         if estimate_name:
-            _turso_execute(usage_sql, [eid, estimate_name, now])
-        return eid
+            statements.append((
+                "INSERT OR IGNORE INTO estimate_catalog_usage (catalog_id, estimate_name, used_at)"
+                f" SELECT id, ?, ? FROM estimate_catalog"
+                f" WHERE ({_CATALOG_KEY}) IN (VALUES {','.join(['(?,?,?,?)'] * len(chunk))})",
+                [estimate_name, now, *[v for k in chunk for v in k]],
+            ))
+    if USE_TURSO:
+        _turso_transaction(statements)
     else:
-        with _local_conn() as conn:
-            row = conn.execute(find_sql, (description, unit_cost, comments, add_comments)).fetchone()
-            if row:
-                eid = row["id"]
-                conn.execute(bump_sql, (now, eid))
-            else:
-                cur = conn.execute(ins_sql, (description, unit_cost, comments, add_comments, category, now))
-                eid = cur.lastrowid
-            if estimate_name:
-                conn.execute(usage_sql, (eid, estimate_name, now))
-            return eid
+        _local_transaction(statements)
 
 
 def clear_estimate_catalog_usage(estimate_name: str) -> None:
@@ -1613,31 +3315,38 @@ def clear_fixture_usage(estimate_name: str) -> None:
 
 def sync_fixture_catalog(estimate_name: str, fixture_packages: list) -> None:
     """
-    Upsert catalog entries for all fixture rows; refresh usage links.
+    Upsert catalog entries for changed fixture rows; refresh their usage links.
     Catalog entries are never deleted — only usage links are refreshed per estimate.
+
+    Each usage link keeps a hash of the rows it was synced from, so a save
+    only writes fixtures whose hash is new and drops links whose hash is gone;
+    an unchanged save costs one read round trip and no writes.  All writes go
+    in one transaction (one Turso round trip).
     """
-    find_by_item = (
-        "SELECT id FROM fixture_catalog "
-        "WHERE item_number = ? AND supplier = ? AND item_number != ''"
+    # A fixture is found by item number when it has one, else by description
+    match = ("(? != '' AND item_number = ? AND supplier = ?)"
+             " OR (? = '' AND description = ? AND supplier = ?)")
+    upd_sql = (
+        "UPDATE fixture_catalog "
+        "SET description=?, fixture_type=?, price_per_unit=?, unit=?, invoice_no=?, date=? "
+        f"WHERE id = (SELECT id FROM fixture_catalog WHERE {match} ORDER BY id LIMIT 1)"
     )
-    find_by_desc = "SELECT id FROM fixture_catalog WHERE description = ? AND supplier = ?"
     ins_sql = (
         "INSERT INTO fixture_catalog "
         "(item_number, description, fixture_type, supplier, price_per_unit, unit, invoice_no, date) "
-        "VALUES (?, ?, ?, ?, ?, ?, ?, ?)"
-    )
-    upd_sql = (
-        "UPDATE fixture_catalog "
-        "SET description=?, fixture_type=?, price_per_unit=?, unit=?, invoice_no=?, date=? "
-        "WHERE id=?"
+        f"SELECT ?, ?, ?, ?, ?, ?, ?, ? WHERE NOT EXISTS (SELECT 1 FROM fixture_catalog WHERE {match})"
     )
-    clear_sql = "DELETE FROM fixture_usage WHERE estimate_name = ?"
     ins_usage = (
-        "INSERT OR IGNORE INTO fixture_usage (fixture_id, estimate_name, package_title) "
-        "VALUES (?, ?, ?)"
+        "INSERT INTO fixture_usage (fixture_id, estimate_name, package_title, row_hash) "
+        f"SELECT id, ?, ?, ? FROM fixture_catalog WHERE {match} ORDER BY id LIMIT 1 "
+        "ON CONFLICT (fixture_id, estimate_name) DO UPDATE "
+        "SET package_title = excluded.package_title, row_hash = excluded.row_hash"
     )
+    prev_sql = "SELECT id, row_hash FROM fixture_usage WHERE estimate_name = ?"
+    cat_sql  = "SELECT id, item_number, description, supplier FROM fixture_catalog WHERE {} ORDER BY id"
 
-    entries = []
+    # One entry per fixture: catalog values from its last row, package from its first
+    entries: dict[tuple, dict] = {}
     for pkg in fixture_packages:
         pkg_title = pkg.get("title", "")
         supplier  = (pkg.get("supplier") or "").strip()
@@ -1645,8 +3354,10 @@ def sync_fixture_catalog(estimate_name: str, fixture_packages: list) -> None:
             desc = (row.get("description") or "").strip()
             if not desc:
                 continue
-            entries.append({
-                "item_number":  (row.get("item_number")  or "").strip(),
+            item_number = (row.get("item_number") or "").strip()
+            key = (item_number, "" if item_number else desc, supplier)
+            entries[key] = {
+                "item_number":  item_number,
                 "description":  desc,
                 "fixture_type": (row.get("fixture_type") or "").strip(),
                 "supplier":     supplier,
@@ -1654,55 +3365,77 @@ def sync_fixture_catalog(estimate_name: str, fixture_packages: list) -> None:
                 "unit":         (row.get("unit")         or "").strip(),
                 "invoice_no":   (row.get("invoice_no")   or "").strip(),
                 "date":         (row.get("date")         or "").strip(),
-                "pkg_title":    pkg_title,
-            })
-
+                "pkg_title":    entries[key]["pkg_title"] if key in entries else pkg_title,
+            }
+    for e in entries.values():
+        e["hash"] = hashlib.sha1(json.dumps(e, sort_keys=True).encode()).hexdigest()
+    by_number = [e for e in entries.values() if e["item_number"]]
+    by_desc   = [e for e in entries.values() if not e["item_number"]]
+
+    reads, conds, params = [(prev_sql, [estimate_name])], [], []
+    if by_number:
+        conds.append(f"(item_number, supplier) IN (VALUES {','.join(['(?,?)'] * len(by_number))})")
+        params += [v for e in by_number for v in (e["item_number"], e["supplier"])]
+    if by_desc:
+        conds.append(f"(description, supplier) IN (VALUES {','.join(['(?,?)'] * len(by_desc))})")
+        params += [v for e in by_desc for v in (e["description"], e["supplier"])]
+    if conds:
+        reads.append((cat_sql.format(" OR ".join(conds)), params))
     if USE_TURSO:
-        _turso_execute(clear_sql, [estimate_name])
-        for e in entries:
-            if e["item_number"]:
-                rows = _turso_execute(find_by_item, [e["item_number"], e["supplier"]])
-            else:
-                rows = _turso_execute(find_by_desc, [e["description"], e["supplier"]])
-            if rows:
-                fid = rows[0]["id"]
-                _turso_execute(upd_sql, [
-                    e["description"], e["fixture_type"], e["price"],
-                    e["unit"], e["invoice_no"], e["date"], fid,
-                ])
-            else:
-                _turso_execute(ins_sql, [
-                    e["item_number"], e["description"], e["fixture_type"],
-                    e["supplier"], e["price"], e["unit"], e["invoice_no"], e["date"],
-                ])
-                if e["item_number"]:
-                    new = _turso_execute(find_by_item, [e["item_number"], e["supplier"]])
-                else:
-                    new = _turso_execute(find_by_desc, [e["description"], e["supplier"]])
-                fid = new[0]["id"] if new else None
-            if fid:
-                _turso_execute(ins_usage, [fid, estimate_name, e["pkg_title"]])
-    else:
-        with _local_conn() as conn:
-            conn.execute(clear_sql, (estimate_name,))
-            for e in entries:
-                if e["item_number"]:
-                    row = conn.execute(find_by_item, (e["item_number"], e["supplier"])).fetchone()
-                else:
-                    row = conn.execute(find_by_desc, (e["description"], e["supplier"])).fetchone()
-                if row:
-                    fid = row["id"]
-                    conn.execute(upd_sql, (
-                        e["description"], e["fixture_type"], e["price"],
-                        e["unit"], e["invoice_no"], e["date"], fid,
-                    ))
-                else:
-                    cur = conn.execute(ins_sql, (
-                        e["item_number"], e["description"], e["fixture_type"],
-                        e["supplier"], e["price"], e["unit"], e["invoice_no"], e["date"],
-                    ))
-                    fid = cur.lastrowid
-                conn.execute(ins_usage, (fid, estimate_name, e["pkg_title"]))
+        results = _turso_batch(reads)
+    else:
+        with _local_conn() as conn:
+            results = [[dict(r) for r in conn.execute(sql, p).fetchall()] for sql, p in reads]
+    prev, catalog = results[0], results[1] if conds else []
+
+    # Resolve entries to the catalog row the match picks (lowest id).  An item
+    # number and a description can land on the same fixture, which has one
+    # usage link, so the link's hash covers every entry that resolves to it.
+    # A fixture this save inserts is keyed by its entry; item-numbered entries
+    # are written first, so a description-only row can join one.
+    number_ids, desc_ids = {}, {}
+    for r in catalog:
+        if r["item_number"]:
+            number_ids.setdefault((r["item_number"], r["supplier"]), r["id"])
+        desc_ids.setdefault((r["description"], r["supplier"]), r["id"])
+    fixtures: dict = {}
+    for e in by_number:
+        fid = number_ids.get((e["item_number"], e["supplier"]))
+        if fid is None:
+            fid = ("new", e["item_number"], e["supplier"])
+            desc_ids.setdefault((e["description"], e["supplier"]), fid)
+        fixtures.setdefault(fid, []).append(e)
+    for e in by_desc:
+        fid = desc_ids.get((e["description"], e["supplier"]), ("new", "", e["description"], e["supplier"]))
+        fixtures.setdefault(fid, []).append(e)
+    for group in fixtures.values():
+        link_hash = (group[0]["hash"] if len(group) == 1 else
+                     hashlib.sha1("".join(sorted(e["hash"] for e in group)).encode()).hexdigest())
+        for e in group:
+            e["link_hash"] = link_hash
+
+    new_hashes  = {e["link_hash"] for e in entries.values()}
+    prev_hashes = {r["row_hash"] for r in prev}
+    stale   = [r["id"] for r in prev if r["row_hash"] not in new_hashes]
+    changed = [e for e in by_number + by_desc if e["link_hash"] not in prev_hashes]
+    if not stale and not changed:
+        return
+
+    statements = []
+    if stale:
+        statements.append((f"DELETE FROM fixture_usage WHERE id IN ({','.join('?' * len(stale))})", stale))
+    for e in changed:
+        m = [e["item_number"], e["item_number"], e["supplier"], e["item_number"], e["description"], e["supplier"]]
+        statements += [
+            (upd_sql, [e["description"], e["fixture_type"], e["price"], e["unit"], e["invoice_no"], e["date"], *m]),
+            (ins_sql, [e["item_number"], e["description"], e["fixture_type"], e["supplier"],
+                       e["price"], e["unit"], e["invoice_no"], e["date"], *m]),
+            (ins_usage, [estimate_name, e["pkg_title"], e["link_hash"], *m]),
+        ]
+    if USE_TURSO:
+        _turso_transaction(statements)
+    else:
+        _local_transaction(statements)
 
 
 def get_all_kits() -> list[dict]:
@@ -0,0 +1,97 @@
+"""
+disk_lru.py — size-bounded least-recently-used cache of plain files
+
+Shared by graph_cache.py (rendered chart PNGs) and parse_cache.py (parsed PDF
+results).  Entries are files in one directory, so every worker process shares
+the cache.  Opening an entry bumps its mtime; writes go to a temp file and are
+renamed into place, so readers never see a partial entry; after each write the
+oldest entries are removed until the directory fits the byte and/or entry
+budget.  Lookups hand back an open file: another worker's eviction can unlink
+an entry at any moment, but an open handle keeps reading the data it was
+opened on.
+"""
+
+import os
+import tempfile
+import threading
+from typing import BinaryIO
+
+
+class DiskLRU:
+    """LRU file cache in ``directory``; entries are ``<name><suffix>``."""
+
+    def __init__(self, directory: str, suffix: str,
+                 max_bytes: int | None = None, max_entries: int | None = None):
+        self.directory   = directory
+        self.suffix      = suffix
+        self.max_bytes   = max_bytes
+        self.max_entries = max_entries
+        self._lock       = threading.Lock()
+
+    def path(self, name: str) -> str:
+        return os.path.join(self.directory, f"{name}{self.suffix}")
+
+    def open(self, name: str) -> BinaryIO | None:
+        """Return the entry opened for binary reading, or None on a miss; the caller closes it."""
+        path = self.path(name)
+        try:
+            fh = open(path, "rb")
+        except FileNotFoundError:
+            return None
+        try:
+            os.utime(path)          # mark as recently used
+        except OSError:
+            pass
+        return fh
+
+    def put(self, name: str, data: bytes) -> None:
+        """Store data under name and evict down to the budget."""
+        os.makedirs(self.directory, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as fh:
+                fh.write(data)
+            os.replace(tmp, self.path(name))
+        except Exception:
+            try:
+                os.unlink(tmp)
+            except OSError:
+                pass
+            raise
+        self.evict()
+
+    def evict(self) -> None:
+        """Delete least-recently-used entries until the directory fits the budget."""
+        with self._lock:
+            entries = []
+            total = 0
+            try:
+                with os.scandir(self.directory) as it:
+                    for e in it:
+                        if not e.name.endswith(self.suffix):
+                            continue
+                        try:
+                            st = e.stat()
+                        except FileNotFoundError:
+                            continue
+                        entries.append((st.st_mtime, st.st_size, e.path))
+                        total += st.st_size
+            except FileNotFoundError:
+                return
+            count = len(entries)
+            if self._fits(total, count):
+                return
+            entries.sort()
+            for _mtime, size, path in entries:
+                if self._fits(total, count):
+                    break
+                try:
+                    os.unlink(path)
+                    total -= size
+                    count -= 1
+                except FileNotFoundError:
+                    pass
+
+    def _fits(self, total: int, count: int) -> bool:
+        return ((self.max_bytes is None or total <= self.max_bytes)
+                and (self.max_entries is None or count <= self.max_entries))
@@ -0,0 +1,35 @@
+"""
+graph_cache.py — size-bounded on-disk LRU for rendered chart PNGs
+
+Entries are plain files named by a SHA-256 of the cache key, so every worker
+process shares the same cache directory.  Storage, recency and eviction (the
+oldest files go first once the directory grows past the byte budget) are
+disk_lru.DiskLRU's.
+"""
+
+import hashlib
+from typing import BinaryIO
+
+import config
+from disk_lru import DiskLRU
+
+CACHE_DIR = config.GRAPH_CACHE_DIR
+MAX_BYTES = config.GRAPH_CACHE_MAX_BYTES
+
+_lru = DiskLRU(CACHE_DIR, ".png", max_bytes=MAX_BYTES)
+
+
+def make_key(*parts) -> str:
+    """Stable hex digest for a tuple of key parts (also usable as an ETag)."""
+    raw = "\x1f".join(str(p) for p in parts)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def open_cached(key: str) -> BinaryIO | None:
+    """Return the cached PNG for key opened for reading, or None on a miss; the caller closes it."""
+    return _lru.open(key)
+
+
+def put(key: str, data: bytes) -> None:
+    """Store data under key and evict down to the byte budget."""
+    _lru.put(key, data)
@@ -0,0 +1,164 @@
+"""
+json_patch.py — JSON Patch (RFC 6902) for estimate / template documents.
+
+make_patch(src, dst) produces the operations that turn one document into
+another; apply_patch(doc, patch) applies a patch (all six operations) and
+returns a new document, leaving ``doc`` untouched.  Lists are diffed by
+matching unchanged elements, so adding a row to a section yields one "add"
+rather than a rewrite of every row after it.
+"""
+
+import copy
+import difflib
+import json
+
+
+class JsonPatchError(ValueError):
+    """A patch operation is malformed or does not apply to the document."""
+
+
+# ── Pointers (RFC 6901) ───────────────────────────────────────────────────────
+
+def _escape(token) -> str:
+    return str(token).replace("~", "~0").replace("/", "~1")
+
+
+def _tokens(pointer: str) -> list[str]:
+    if pointer == "":
+        return []
+    if not isinstance(pointer, str) or not pointer.startswith("/"):
+        raise JsonPatchError(f"Invalid JSON pointer: {pointer!r}")
+    return [t.replace("~1", "/").replace("~0", "~") for t in pointer[1:].split("/")]
+
+
+def _index(container: list, token: str, allow_end: bool = False) -> int:
+    if token == "-" and allow_end:
+        return len(container)
+    if not token.isdigit() or (len(token) > 1 and token[0] == "0"):
+        raise JsonPatchError(f"Invalid array index: {token!r}")
+    i = int(token)
+    if i > len(container) or (i == len(container) and not allow_end):
+        raise JsonPatchError(f"Array index out of range: {i}")
+    return i
+
+
+def _resolve(doc, tokens: list[str]):
+    for token in tokens:
+        if isinstance(doc, dict):
+            if token not in doc:
+                raise JsonPatchError(f"Path not found: /{'/'.join(map(_escape, tokens))}")
+            doc = doc[token]
+        elif isinstance(doc, list):
+            doc = doc[_index(doc, token)]
+        else:
+            raise JsonPatchError(f"Cannot descend into {type(doc).__name__}")
+    return doc
+
+
+# ── Apply ─────────────────────────────────────────────────────────────────────
+
+def _add(doc, tokens, value):
+    if not tokens:
+        return value
+    parent = _resolve(doc, tokens[:-1])
+    last = tokens[-1]
+    if isinstance(parent, dict):
+        parent[last] = value
+    elif isinstance(parent, list):
+        parent.insert(_index(parent, last, allow_end=True), value)
+    else:
+        raise JsonPatchError(f"Cannot add to {type(parent).__name__}")
+    return doc
+
+
+def _remove(doc, tokens):
+    if not tokens:
+        raise JsonPatchError("Cannot remove the document root")
+    parent = _resolve(doc, tokens[:-1])
+    last = tokens[-1]
+    if isinstance(parent, dict):
+        if last not in parent:
+            raise JsonPatchError(f"Path not found: /{'/'.join(map(_escape, tokens))}")
+        return parent.pop(last)
+    if isinstance(parent, list):
+        return parent.pop(_index(parent, last))
+    raise JsonPatchError(f"Cannot remove from {type(parent).__name__}")
+
+
+def apply_patch(doc, patch: list[dict]):
+    """Return a copy of ``doc`` with ``patch`` applied; raises JsonPatchError."""
+    if not isinstance(patch, list):
+        raise JsonPatchError("A patch must be a list of operations")
+    doc = copy.deepcopy(doc)
+    for op in patch:
+        if not isinstance(op, dict) or "op" not in op or "path" not in op:
+            raise JsonPatchError(f"Malformed operation: {op!r}")
+        kind, tokens = op["op"], _tokens(op["path"])
+        if kind in ("add", "replace", "test") and "value" not in op:
+            raise JsonPatchError(f"'{kind}' needs a value")
+        if kind == "add":
+            doc = _add(doc, tokens, copy.deepcopy(op["value"]))
+        elif kind == "remove":
+            _remove(doc, tokens)
+        elif kind == "replace":
+            if tokens:
+                _remove(doc, tokens)
+            doc = _add(doc, tokens, copy.deepcopy(op["value"]))
+        elif kind in ("move", "copy"):
+            if "from" not in op:
+                raise JsonPatchError(f"'{kind}' needs a from")
+            src = _tokens(op["from"])
+            if kind == "move":
+                if tokens[:len(src)] == src and tokens != src:
+                    raise JsonPatchError("Cannot move a value into itself")
+                value = _remove(doc, src)
+            else:
+                value = copy.deepcopy(_resolve(doc, src))
+            doc = _add(doc, tokens, value)
+        elif kind == "test":
+            if _resolve(doc, tokens) != op["value"]:
+                raise JsonPatchError(f"Test failed at {op['path']}")
+        else:
+            raise JsonPatchError(f"Unknown operation: {kind!r}")
+    return doc
+
+
+# ── Diff ──────────────────────────────────────────────────────────────────────
+
+def _diff(src, dst, path: str, ops: list):
+    if type(src) is not type(dst):
+        ops.append({"op": "replace", "path": path, "value": dst})
+    elif isinstance(src, dict):
+        for key in src:
+            if key not in dst:
+                ops.append({"op": "remove", "path": f"{path}/{_escape(key)}"})
+        for key, value in dst.items():
+            if key not in src:
+                ops.append({"op": "add", "path": f"{path}/{_escape(key)}", "value": value})
+            else:
+                _diff(src[key], value, f"{path}/{_escape(key)}", ops)
+    elif isinstance(src, list):
+        a = [json.dumps(x, sort_keys=True) for x in src]
+        b = [json.dumps(x, sort_keys=True) for x in dst]
+        matcher = difflib.SequenceMatcher(None, a, b, autojunk=False)
+        # Back to front, so indices in earlier opcodes are still valid
+        for tag, i1, i2, j1, j2 in reversed(matcher.get_opcodes()):
+            if tag == "equal":
+                continue
+            if tag == "replace" and i2 - i1 == j2 - j1:
+                for k in range(i2 - i1):
+                    _diff(src[i1 + k], dst[j1 + k], f"{path}/{i1 + k}", ops)
+                continue
+            for i in range(i2 - 1, i1 - 1, -1):
+                ops.append({"op": "remove", "path": f"{path}/{i}"})
+            for k, j in enumerate(range(j1, j2)):
+                ops.append({"op": "add", "path": f"{path}/{i1 + k}", "value": dst[j]})
+    elif src != dst:
+        ops.append({"op": "replace", "path": path, "value": dst})
+
+
+def make_patch(src, dst) -> list[dict]:
+    """Operations that turn ``src`` into ``dst`` (apply_patch(src, ...) == dst)."""
+    ops: list[dict] = []
+    _diff(src, dst, "", ops)
+    return ops
@@ -1,21 +1,53 @@
 """
 migrate_berger_pdfs.py — Batch import Berger (BPS) invoice PDFs into Turso.
 
+Parsing runs in a process pool; the already-imported order numbers and file
+hashes are fetched once up front so known tickets are skipped without a save
+attempt, and new documents are written CHUNK at a time, one transaction (one
+Turso round trip) per chunk.  With --save, a manifest records every file
+that was saved or found to be a duplicate, so an interrupted run picks up
+where it stopped.
+
 Usage:
-    python migrate_berger_pdfs.py           # dry run — parse only, no saves
-    python migrate_berger_pdfs.py --save    # parse and save to Turso
+    python migrate_berger_pdfs.py                    # dry run — parse only, no saves
+    python migrate_berger_pdfs.py --save             # parse and save to Turso
+    python migrate_berger_pdfs.py --save --jobs 8    # 8 parser processes
+    python migrate_berger_pdfs.py --save --restart   # ignore the manifest
 """
 
 import argparse
 import os
 import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from pdf_ingest import file_sig, load_state, parse_file, write_state
+
+FOLDER   = os.path.join(os.path.dirname(__file__), "Invoices berger")
+MANIFEST = os.path.join(os.path.dirname(__file__), "data", "migrate_berger_manifest.json")
+CHUNK    = 25
+
 
-FOLDER = os.path.join(os.path.dirname(__file__), "Invoices berger")
+def _warn_flags(result: dict) -> list:
+    flags = []
+    if not result.get("items"):
+        flags.append("0 items")
+    if not result.get("order_number"):
+        flags.append("no order number")
+    if not result.get("date"):
+        flags.append("no date")
+    return flags
 
 
 def main():
     parser = argparse.ArgumentParser(description="Migrate Berger PDF invoices to Turso.")
     parser.add_argument("--save", action="store_true", help="Save parsed documents to Turso.")
+    parser.add_argument("--jobs", type=int, default=os.cpu_count() or 1,
+                        help="Parser processes (default: CPU count; 1 = no pool).")
+    parser.add_argument("--chunk", type=int, default=CHUNK,
+                        help=f"Documents per write transaction (default {CHUNK}).")
+    parser.add_argument("--manifest", default=MANIFEST, help="Checkpoint file for resuming --save runs.")
+    parser.add_argument("--restart", action="store_true", help="Ignore an existing manifest.")
     args = parser.parse_args()
 
     if not os.path.isdir(FOLDER):
@@ -30,78 +62,142 @@ def main():
         print(f"No PDF files found in: {FOLDER}")
         sys.exit(0)
 
-    from pdf_parser import parse_pdf
+    started = time.perf_counter()
+    manifest: dict = {}
+    existing_orders: set = set()
+    existing_hashes: set = set()
+    resumed = 0
 
     if args.save:
-        from db import init_db, save_parsed_document, refresh_catalog
+        from db import init_db, imported_invoice_keys, save_parsed_documents, refresh_catalog
         init_db()
+        existing_orders, existing_hashes = imported_invoice_keys()
+
+        if not args.restart:
+            manifest = load_state(args.manifest)
+            done = {
+                name for name, entry in manifest.items()
+                if entry.get("status") in ("saved", "duplicate")
+                and os.path.exists(os.path.join(FOLDER, name))
+                and entry.get("sig") == file_sig(os.path.join(FOLDER, name))
+            }
+            resumed = len(done)
+            pdf_files = [f for f in pdf_files if f not in done]
+            if resumed:
+                print(f"\nResuming — {resumed} file(s) already done per {args.manifest}")
 
     total_items = 0
     warnings = 0
     saved = 0
     skipped = 0
     errors = 0
+    write_seconds = 0.0
+    transactions = 0
+    pending: list[tuple[str, dict, list]] = []     # (filename, result, warn flags)
+
+    def flush():
+        nonlocal saved, skipped, errors, write_seconds, transactions
+        if not pending:
+            return
+        t0 = time.perf_counter()
+        try:
+            ids = save_parsed_documents([(r, name) for name, r, _ in pending])
+        except Exception as e:
+            for name, _r, _f in pending:
+                print(f"  ERROR  {name}: {e}")
+                manifest[name] = {"status": "error", "error": str(e)}
+            errors += len(pending)
+            ids = None
+        write_seconds += time.perf_counter() - t0
+        transactions += 1
+        if ids is not None:
+            for (name, r, warn), invoice_id in zip(pending, ids):
+                flag = "  [!] " + ", ".join(warn) if warn else ""
+                sig  = file_sig(os.path.join(FOLDER, name))
+                if invoice_id == -1:
+                    print(f"  SKIP   {name}  (duplicate: {r['order_number']}){flag}")
+                    manifest[name] = {"status": "duplicate", "sig": sig}
+                    skipped += 1
+                else:
+                    print(f"  OK     {name}  -> invoice_id={invoice_id}  ({len(r['items'])} items){flag}")
+                    manifest[name] = {"status": "saved", "invoice_id": invoice_id, "sig": sig}
+                    saved += 1
+        pending.clear()
+        write_state(args.manifest, manifest)
 
     if not args.save:
         # Dry-run header
         print(f"\nDRY RUN — scanning: {FOLDER}\n")
         print(f"{'File':<35} {'Order No.':<15} {'Date':<12} {'Items':>5}  First Item")
         print("-" * 95)
+    else:
+        print(f"\nImporting {len(pdf_files)} file(s) with {args.jobs} parser process(es)\n")
+
+    paths = [os.path.join(FOLDER, f) for f in pdf_files]
+    pool = ProcessPoolExecutor(max_workers=args.jobs) if args.jobs > 1 and len(paths) > 1 else None
+    suppliers = ["BPS"] * len(paths)
+    results = (pool.map(parse_file, paths, suppliers, chunksize=4) if pool
+               else map(parse_file, paths, suppliers))
+    parse_started = time.perf_counter()
+
+    try:
+        for filename, (digest, result, error) in zip(pdf_files, results):
+            if result is None:
+                if args.save:
+                    print(f"  ✗ ERROR   {filename}: {error}")
+                    manifest[filename] = {"status": "error", "error": error}
+                    errors += 1
+                else:
+                    print(f"  {'ERROR':<34} — parse failed: {error}")
+                    warnings += 1
+                continue
+
+            order_no   = result.get("order_number", "") or ""
+            date_str   = result.get("date", "") or ""
+            items      = result.get("items", [])
+            item_count = len(items)
+            first_item = items[0]["description"][:40] if items else "(none)"
+
+            warn_flags = _warn_flags(result)
+            if warn_flags:
+                warnings += 1
+
+            total_items += item_count
 
-    for filename in pdf_files:
-        filepath = os.path.join(FOLDER, filename)
-        try:
-            result = parse_pdf(filepath, supplier="BPS")
-        except Exception as e:
             if args.save:
-                print(f"  ✗ ERROR   {filename}: {e}")
-                errors += 1
+                key = (order_no, result.get("doc_type"))
+                if key in existing_orders or digest in existing_hashes:
+                    flag = "  [!] " + ", ".join(warn_flags) if warn_flags else ""
+                    print(f"  SKIP   {filename}  (duplicate: {order_no}){flag}")
+                    manifest[filename] = {"status": "duplicate", "sig": file_sig(os.path.join(FOLDER, filename))}
+                    skipped += 1
+                    continue
+                existing_orders.add(key)
+                existing_hashes.add(digest)
+                pending.append((filename, result, warn_flags))
+                if len(pending) >= args.chunk:
+                    flush()
             else:
-                print(f"  {'ERROR':<34} — parse failed: {e}")
-                warnings += 1
-            continue
-
-        order_no   = result.get("order_number", "") or ""
-        date_str   = result.get("date", "") or ""
-        items      = result.get("items", [])
-        item_count = len(items)
-        first_item = items[0]["description"][:40] if items else "(none)"
-
-        warn_flags = []
-        if item_count == 0:
-            warn_flags.append("0 items")
-        if not order_no:
-            warn_flags.append("no order number")
-        if not date_str:
-            warn_flags.append("no date")
-        if warn_flags:
-            warnings += 1
-
-        total_items += item_count
+                warn_str = f"  [!] {', '.join(warn_flags)}" if warn_flags else ""
+                short_name = filename[:34]
+                print(f"  {short_name:<34} {order_no:<15} {date_str:<12} {item_count:>5}  {first_item}{warn_str}")
 
         if args.save:
-            flag = "  [!] " + ", ".join(warn_flags) if warn_flags else ""
-            try:
-                invoice_id = save_parsed_document(result, filename=filename)
-                if invoice_id == -1:
-                    print(f"  SKIP   {filename}  (duplicate: {order_no}){flag}")
-                    skipped += 1
-                else:
-                    print(f"  OK     {filename}  -> invoice_id={invoice_id}  ({item_count} items){flag}")
-                    saved += 1
-            except Exception as e:
-                print(f"  ERROR  {filename}: {e}")
-                errors += 1
-        else:
-            warn_str = f"  [!] {', '.join(warn_flags)}" if warn_flags else ""
-            short_name = filename[:34]
-            print(f"  {short_name:<34} {order_no:<15} {date_str:<12} {item_count:>5}  {first_item}{warn_str}")
+            flush()
+    finally:
+        if pool:
+            pool.shutdown(cancel_futures=True)
+        if args.save:
+            write_state(args.manifest, manifest)
+
+    elapsed = time.perf_counter() - started
+    parse_elapsed = time.perf_counter() - parse_started - write_seconds
 
     # Summary
     print()
     if args.save:
         print("-- Save summary ---------------------------------")
-        print(f"  PDFs processed : {len(pdf_files)}")
+        print(f"  PDFs processed : {len(pdf_files)}" + (f"  (+{resumed} resumed)" if resumed else ""))
         print(f"  Saved          : {saved}")
         print(f"  Skipped (dup)  : {skipped}")
         print(f"  Errors         : {errors}")
@@ -114,6 +210,17 @@ def main():
         print(f"  PDFs found     : {len(pdf_files)}")
         print(f"  Total items    : {total_items}")
         print(f"  Warnings       : {warnings}")
+
+    print("-- Throughput -----------------------------------")
+    print(f"  Elapsed        : {elapsed:.2f}s")
+    if pdf_files:
+        print(f"  Parse          : {parse_elapsed:.2f}s  ({len(pdf_files) / max(parse_elapsed, 1e-9):.1f} files/s,"
+              f" {total_items / max(parse_elapsed, 1e-9):.0f} items/s)")
+    if args.save and transactions:
+        print(f"  Write          : {write_seconds:.2f}s in {transactions} transaction(s)"
+              f"  ({saved / max(write_seconds, 1e-9):.1f} docs/s)")
+
+    if not args.save:
         print()
         print("Run with --save to import into Turso.")
     print()
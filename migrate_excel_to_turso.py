@@ -4,171 +4,234 @@ migrate_excel_to_turso.py
 Migrates all Excel supply data into Turso (or local SQLite fallback).
 Run once from your project root:
 
-    python migrate_excel_to_turso.py
+    python migrate_excel_to_turso.py                 # all suppliers, one after another
+    python migrate_excel_to_turso.py --jobs 4        # suppliers in parallel
+    python migrate_excel_to_turso.py --chunk 2000    # rows per write transaction
+
+Each workbook is streamed once (openpyxl read-only mode), the invoice numbers
+already in the DB are fetched in a single query, and new invoices are written
+in chunked transactions — one Turso round trip per chunk — so a chunk either
+lands whole or not at all.
 
 Safe to re-run — skips duplicate invoice numbers per supplier.
 """
 
+import argparse
 import os
-import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
-from data_utils import (
-    load_default_file, load_supply2_file, load_supply3_file, load_supply4_file,
-    get_current_dataframe,
-)
-from db import get_conn, USE_TURSO, _turso_execute, _turso_batch
 
-import libsql_client  # only used if USE_TURSO
+import openpyxl
+import pandas as pd
+
+from config import DEFAULT_FILE, DEFAULT_SUPPLY2_FILE, DEFAULT_SUPPLY3_FILE, DEFAULT_SUPPLY4_FILE
+from db import get_conn, USE_TURSO, _turso_execute, _turso_transaction
+
+CHUNK = 1000    # item rows per write transaction
+# Local SQLite: with --jobs, supplier processes queue for the single writer
+# lock, so a chunk may wait behind the others' transactions
+LOCAL_WRITE_TIMEOUT = 300
 
 # ── Supplier metadata ─────────────────────────────────────────────────────────
 SUPPLIES = [
     {
         "key":      "supply1",
         "code":     "BPS",
-        "loader":   load_default_file,
+        "path":     DEFAULT_FILE,
         "item_col": "Item Number",
     },
     {
         "key":      "supply2",
         "code":     "S2",
-        "loader":   load_supply2_file,
+        "path":     DEFAULT_SUPPLY2_FILE,
         "item_col": "Item No.",          # different column name in supply2
     },
     {
         "key":      "supply3",
         "code":     "LPS",
-        "loader":   load_supply3_file,
+        "path":     DEFAULT_SUPPLY3_FILE,
         "item_col": "Item Number",
     },
     {
         "key":      "supply4",
         "code":     "BOND",
-        "loader":   load_supply4_file,
+        "path":     DEFAULT_SUPPLY4_FILE,
         "item_col": "Item Number",
     },
 ]
 
+INVOICE_SQL = """INSERT INTO invoices (doc_type, order_number, date, job_name, supplier, filename)
+                 VALUES (?, ?, ?, ?, ?, ?)"""
+ITEM_SQL    = """INSERT INTO invoice_items
+                 (invoice_id, item_number, description, uom, quantity, unit_price, supplier)
+                 VALUES (?, ?, ?, ?, ?, ?, ?)"""
+# Turso: ids aren't known until the transaction runs, so items find their invoice by key
+ITEM_BY_KEY_SQL = """INSERT INTO invoice_items
+                 (invoice_id, item_number, description, uom, quantity, unit_price, supplier)
+                 VALUES ((SELECT MAX(id) FROM invoices WHERE order_number = ? AND supplier = ?),
+                         ?, ?, ?, ?, ?, ?)"""
+
+
+def _norm_invoice(value) -> str:
+    """Invoice number as text; 12345.0 (a numeric column with blanks) reads as 12345."""
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    text = str(value).strip()
+    return text[:-2] if text.endswith(".0") and text[:-2].isdigit() else text
+
+
+def _to_date(value) -> str:
+    if isinstance(value, datetime):
+        return value.strftime("%Y-%m-%d")
+    if value in (None, ""):
+        return ""
+    parsed = pd.to_datetime(value, errors="coerce")
+    return "" if pd.isna(parsed) else parsed.strftime("%Y-%m-%d")
+
+
+def _to_price(value) -> float:
+    if isinstance(value, (int, float)):
+        return float(value)
+    try:
+        return float(str(value or 0).replace(",", ""))
+    except ValueError:
+        return 0.0
+
+
+def _text(value) -> str:
+    return "" if value is None else str(value).strip()
+
+
+def read_invoices(supply: dict) -> tuple[dict, int]:
+    """
+    Stream a supplier workbook once and group it by invoice number.
+    Returns ({invoice_no: {"date": earliest date, "items": [...]}}, rows read).
+    """
+    code = supply["code"]
+    wb = openpyxl.load_workbook(supply["path"], read_only=True, data_only=True)
+    try:
+        rows = wb.active.iter_rows(values_only=True)
+        header = [_text(h) for h in next(rows, ())]
+        col = {name: i for i, name in enumerate(header) if name}
+        if "Date" not in col:
+            return {}, 0
+
+        def cell(row, name):
+            i = col.get(name)
+            return row[i] if i is not None and i < len(row) else None
+
+        invoices: dict[str, dict] = {}
+        count = 0
+        for row in rows:
+            if not any(v not in (None, "") for v in row):
+                continue
+            count += 1
+            raw_no = cell(row, "Invoice No.")
+            invoice_no = _norm_invoice(raw_no) if raw_no not in (None, "") else f"MIGRATED-{code}"
+            inv = invoices.setdefault(invoice_no, {"date": "", "items": []})
+            date = _to_date(cell(row, "Date"))
+            # Use the earliest date in this invoice group
+            if date and (not inv["date"] or date < inv["date"]):
+                inv["date"] = date
+            inv["items"].append((
+                _text(cell(row, supply["item_col"])),
+                _text(cell(row, "Description")),
+                _text(cell(row, "Unit")),
+                0,   # quantity not tracked in Excel history
+                _to_price(cell(row, "Price per Unit")),
+            ))
+        return invoices, count
+    finally:
+        wb.close()
 
-def already_imported(order_number: str, supplier: str) -> bool:
-    """Check if this invoice was already migrated."""
-    sql    = "SELECT id FROM invoices WHERE order_number = ? AND supplier = ?"
-    params = [order_number, supplier]
-    if USE_TURSO:
-        rows = _turso_execute(sql, params)
-        return len(rows) > 0
-    else:
-        with get_conn() as conn:
-            row = conn.execute(sql, (order_number, supplier)).fetchone()
-            return row is not None
-
-
-def insert_invoice(doc_type, order_number, date, supplier, filename) -> int:
-    """Insert invoice header, return new id."""
-    sql    = """INSERT INTO invoices (doc_type, order_number, date, job_name, supplier, filename)
-                VALUES (?, ?, ?, ?, ?, ?)"""
-    params = ["invoice", order_number, date, "", supplier, filename]
 
+def existing_invoice_numbers() -> dict[str, set]:
+    """{supplier: {order_number}} for everything already in the DB — one query."""
+    sql = "SELECT supplier, order_number FROM invoices"
     if USE_TURSO:
-        _turso_execute(sql, params)
-        rows = _turso_execute(
-            "SELECT id FROM invoices WHERE order_number = ? AND supplier = ? ORDER BY id DESC LIMIT 1",
-            [order_number, supplier],
-        )
-        return rows[0]["id"]
+        rows = _turso_execute(sql)
     else:
         with get_conn() as conn:
-            cur = conn.execute(sql, tuple(params))
-            return cur.lastrowid
+            rows = [dict(r) for r in conn.execute(sql).fetchall()]
+    out: dict[str, set] = {}
+    for r in rows:
+        out.setdefault(r["supplier"], set()).add(_norm_invoice(r["order_number"]))
+    return out
 
 
-def insert_items_batch(rows: list):
-    """Insert a batch of invoice_items rows."""
-    sql = """INSERT INTO invoice_items
-             (invoice_id, item_number, description, uom, quantity, unit_price, supplier)
-             VALUES (?, ?, ?, ?, ?, ?, ?)"""
+def write_chunk(code: str, chunk: list[tuple[str, dict]]):
+    """Insert a chunk of (invoice_no, invoice) in one transaction."""
+    filename = f"migrated_from_excel_{code}.xlsx"
     if USE_TURSO:
-        statements = [(sql, list(r)) for r in rows]
-        _turso_batch(statements)
-    else:
-        with get_conn() as conn:
-            conn.executemany(sql, rows)
-
-
-def migrate_supply(supply: dict):
-    """Migrate one supply's Excel data into the DB."""
-    code     = supply["code"]
-    item_col = supply["item_col"]
-
-    print(f"\n── {code} ({supply['key']}) ──────────────────────────")
-
-    # Load the dataframe
-    supply["loader"]()
-    df = get_current_dataframe(supply["key"])
-
-    if df is None or df.empty:
-        print(f"  ⚠ No data found, skipping.")
-        return
-
-    # Ensure Date column is usable
-    if "Date" not in df.columns:
-        print(f"  ⚠ No Date column, skipping.")
-        return
-
-    # Group rows by Invoice No. so each invoice becomes one row in `invoices`
-    invoice_col = "Invoice No." if "Invoice No." in df.columns else None
-    if invoice_col is None:
-        # No invoice number column — treat all rows as one synthetic invoice
-        df["_invoice"] = f"MIGRATED-{code}"
+        statements = []
+        for invoice_no, inv in chunk:
+            statements.append((INVOICE_SQL, ["invoice", invoice_no, inv["date"], "", code, filename]))
+            statements += [(ITEM_BY_KEY_SQL, [invoice_no, code, *item, code]) for item in inv["items"]]
+        _turso_transaction(statements)
     else:
-        df["_invoice"] = df[invoice_col].astype(str).str.strip()
-
-    # Group by invoice number
-    grouped    = df.groupby("_invoice")
-    total      = len(grouped)
-    skipped    = 0
-    inserted   = 0
-
-    for invoice_no, group in grouped:
-        if already_imported(invoice_no, code):
-            skipped += 1
-            continue
-
-        # Use the earliest date in this invoice group
-        date_val = group["Date"].dropna()
-        if date_val.empty:
-            date_str = ""
-        else:
-            date_str = date_val.min().strftime("%Y-%m-%d")
-
-        # Insert invoice header
-        invoice_id = insert_invoice(
-            doc_type     = "invoice",
-            order_number = invoice_no,
-            date         = date_str,
-            supplier     = code,
-            filename     = f"migrated_from_excel_{code}.xlsx",
-        )
-
-        # Build item rows
-        item_rows = []
-        for _, row in group.iterrows():
-            item_rows.append((
-                invoice_id,
-                str(row.get(item_col, "") or "").strip(),
-                str(row.get("Description", "") or "").strip(),
-                str(row.get("Unit", "") or "").strip(),
-                0,   # quantity not tracked in Excel history
-                float(row.get("Price per Unit", 0) or 0),
-                code,
-            ))
-
-        insert_items_batch(item_rows)
-        inserted += 1
-
-    print(f"  ✓ {inserted} invoices inserted, {skipped} already existed ({total} total)")
+        with get_conn(timeout=LOCAL_WRITE_TIMEOUT) as conn:
+            for invoice_no, inv in chunk:
+                invoice_id = conn.execute(
+                    INVOICE_SQL, ("invoice", invoice_no, inv["date"], "", code, filename)
+                ).lastrowid
+                conn.executemany(ITEM_SQL, [(invoice_id, *item, code) for item in inv["items"]])
+
+
+def migrate_supply(supply: dict, existing: set, chunk_rows: int = CHUNK) -> dict:
+    """Migrate one supply's Excel data into the DB; returns counts and timings."""
+    code  = supply["code"]
+    stats = {"code": code, "invoices": 0, "inserted": 0, "skipped": 0, "rows": 0,
+             "read_seconds": 0.0, "write_seconds": 0.0, "transactions": 0}
+
+    if not os.path.exists(supply["path"]):
+        print(f"  [{code}] ⚠ {supply['path']} not found, skipping.")
+        return stats
+
+    t0 = time.perf_counter()
+    invoices, rows_read = read_invoices(supply)
+    stats["read_seconds"] = time.perf_counter() - t0
+    if not invoices:
+        print(f"  [{code}] ⚠ No data (or no Date column), skipping.")
+        return stats
+
+    stats["invoices"] = len(invoices)
+    todo = [(no, inv) for no, inv in sorted(invoices.items()) if no not in existing]
+    stats["skipped"] = len(invoices) - len(todo)
+    print(f"  [{code}] read {rows_read:,} rows / {len(invoices):,} invoices in {stats['read_seconds']:.1f}s;"
+          f" {len(todo):,} to insert")
+
+    t0 = time.perf_counter()
+    chunk, chunk_size = [], 0
+    for invoice_no, inv in todo:
+        chunk.append((invoice_no, inv))
+        chunk_size += 1 + len(inv["items"])
+        if chunk_size >= chunk_rows:
+            write_chunk(code, chunk)
+            stats["transactions"] += 1
+            stats["inserted"] += len(chunk)
+            stats["rows"] += chunk_size - len(chunk)
+            chunk, chunk_size = [], 0
+    if chunk:
+        write_chunk(code, chunk)
+        stats["transactions"] += 1
+        stats["inserted"] += len(chunk)
+        stats["rows"] += chunk_size - len(chunk)
+    stats["write_seconds"] = time.perf_counter() - t0
+
+    print(f"  [{code}] ✓ {stats['inserted']} invoices inserted, {stats['skipped']} already existed"
+          f" ({stats['invoices']} total)")
+    return stats
 
 
 def main():
+    parser = argparse.ArgumentParser(description="Migrate the Excel supply workbooks into the database.")
+    parser.add_argument("--jobs", type=int, default=1,
+                        help="Suppliers to migrate in parallel (default 1).")
+    parser.add_argument("--chunk", type=int, default=CHUNK,
+                        help=f"Rows per write transaction (default {CHUNK}).")
+    args = parser.parse_args()
+
     print("=" * 55)
     print("  Excel → Turso Migration")
     print(f"  Mode: {'Turso cloud' if USE_TURSO else 'Local SQLite fallback'}")
@@ -178,8 +241,27 @@ def main():
         print("\n⚠  TURSO_URL not set — writing to local zamora.db instead.")
         print("   Set TURSO_URL and TURSO_TOKEN env vars to migrate to Turso.\n")
 
-    for supply in SUPPLIES:
-        migrate_supply(supply)
+    from db import init_db
+    init_db()
+
+    started  = time.perf_counter()
+    existing = existing_invoice_numbers()
+    jobs     = [(s, existing.get(s["code"], set()), args.chunk) for s in SUPPLIES]
+    if args.jobs > 1:
+        with ProcessPoolExecutor(max_workers=min(args.jobs, len(jobs))) as pool:
+            results = list(pool.map(migrate_supply, *zip(*jobs)))
+    else:
+        results = [migrate_supply(*job) for job in jobs]
+    elapsed = time.perf_counter() - started
+
+    inserted = sum(r["inserted"] for r in results)
+    if inserted:
+        # Analytics tables are folded on save; a bulk insert rebuilds them once instead
+        from db import rebuild_price_rollup, rebuild_price_stats, rebuild_spend_cube, refresh_catalog
+        rebuild_price_rollup()
+        rebuild_price_stats()
+        rebuild_spend_cube()
+        refresh_catalog()
 
     print("\n✅ Migration complete!")
 
@@ -204,6 +286,17 @@ def main():
 
     print(f"\nTotal line items in DB: {total:,}")
 
+    item_rows = sum(r["rows"] for r in results)
+    write_s   = sum(r["write_seconds"] for r in results)
+    print("\nThroughput:")
+    for r in results:
+        if r["invoices"]:
+            print(f"  {r['code']:<5} read {r['read_seconds']:.1f}s, write {r['write_seconds']:.1f}s"
+                  f" in {r['transactions']} transaction(s)"
+                  f" ({r['rows'] / max(r['write_seconds'], 1e-9):,.0f} rows/s)")
+    print(f"  Total {item_rows:,} rows in {elapsed:.1f}s ({item_rows / max(elapsed, 1e-9):,.0f} rows/s overall,"
+          f" {item_rows / max(write_s, 1e-9):,.0f} rows/s writing)")
+
 
 if __name__ == "__main__":
     main()
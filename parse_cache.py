@@ -0,0 +1,60 @@
+"""
+parse_cache.py — on-disk cache of parsed PDF results
+
+Entries are JSON files named by the uploaded file's SHA-256, the supplier the
+file was parsed as and pdf_parser.PARSER_VERSION, so a parser change never
+serves stale results.  Previewing a PDF and uploading it again after edits
+(or re-dropping it into a batch) then skips pdfplumber entirely.  Storage,
+recency and eviction (past MAX_ENTRIES the oldest entries go first) are
+disk_lru.DiskLRU's.
+"""
+
+import hashlib
+import json
+import tempfile
+
+import config
+from disk_lru import DiskLRU
+from pdf_parser import PARSER_VERSION
+
+CACHE_DIR   = config.PARSE_CACHE_DIR
+MAX_ENTRIES = config.PARSE_CACHE_MAX_ENTRIES
+
+_lru = DiskLRU(CACHE_DIR, ".json", max_entries=MAX_ENTRIES)
+
+
+def spool(stream, chunk_size: int = 64 * 1024) -> tuple[str, str]:
+    """
+    Copy an upload stream to a temp .pdf file, hashing it on the way through.
+    Returns (temp_path, sha256 hex digest); the caller deletes the file.
+    """
+    digest = hashlib.sha256()
+    with tempfile.NamedTemporaryFile(suffix=".pdf", delete=False) as tmp:
+        while True:
+            chunk = stream.read(chunk_size)
+            if not chunk:
+                break
+            digest.update(chunk)
+            tmp.write(chunk)
+    return tmp.name, digest.hexdigest()
+
+
+def _name(sha256: str, supplier: str) -> str:
+    return f"{sha256}-{supplier}-v{PARSER_VERSION}"
+
+
+def get(sha256: str, supplier: str) -> dict | None:
+    """Return the cached parse result, or None on a miss."""
+    fh = _lru.open(_name(sha256, supplier))
+    if fh is None:
+        return None
+    with fh:
+        try:
+            return json.load(fh)
+        except ValueError:
+            return None
+
+
+def put(sha256: str, supplier: str, parsed: dict) -> None:
+    """Store a parse result and evict down to MAX_ENTRIES."""
+    _lru.put(_name(sha256, supplier), json.dumps(parsed).encode("utf-8"))
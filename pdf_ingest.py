@@ -0,0 +1,50 @@
+"""
+pdf_ingest.py — Helpers shared by the bulk PDF importers.
+
+migrate_berger_pdfs.py (one-off batch import) and watch_pdf_folders.py (folder
+daemon) both parse PDFs in a process pool and keep a JSON checkpoint of the
+files they handled, keyed on each file's size + mtime.
+"""
+
+import hashlib
+import json
+import os
+
+
+def parse_file(filepath: str, supplier: str) -> tuple[str, dict | None, str]:
+    """Worker: (sha256, parsed result or None, error message)."""
+    from pdf_parser import parse_pdf
+
+    with open(filepath, "rb") as fh:
+        digest = hashlib.sha256(fh.read()).hexdigest()
+    try:
+        result = parse_pdf(filepath, supplier=supplier, parallel=False)
+    except Exception as e:
+        return digest, None, str(e)
+    result["sha256"] = digest
+    return digest, result, ""
+
+
+def file_sig(path: str) -> list | None:
+    """[size, mtime_ns] of a file, or None if it is gone."""
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return [st.st_size, st.st_mtime_ns]
+
+
+def load_state(path: str) -> dict:
+    try:
+        with open(path, encoding="utf-8") as fh:
+            return json.load(fh)
+    except (OSError, ValueError):
+        return {}
+
+
+def write_state(path: str, state: dict) -> None:
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as fh:
+        json.dump(state, fh, indent=1, sort_keys=True)
+    os.replace(tmp, path)
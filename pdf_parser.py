@@ -4,10 +4,14 @@ Handles:
   LPS (Lion Plumbing Supply): Sales Order Acknowledgement, Bid Proposal
   BPS (Berger Plumbing Supply): Invoice (Ticket)
 
+Each format registers itself with @register_parser(code, detector); the
+detector sees only the first page's text, so a new supplier is one decorated
+function — parse_pdf needs no new branch.
+
 Usage:
     from pdf_parser import parse_pdf
-    result = parse_pdf("path/to/file.pdf", supplier="LPS")
-    result = parse_pdf("path/to/file.pdf", supplier="BPS")
+    result = parse_pdf("path/to/file.pdf")                  # auto-detect
+    result = parse_pdf("path/to/file.pdf", supplier="BPS")  # fallback if undetected
     # result = {
     #   "doc_type": "invoice" | "bid",
     #   "order_number": "3986708",
@@ -26,10 +30,21 @@ Usage:
     # }
 """
 
+import atexit
+import os
 import re
+import threading
 import pdfplumber
+import pypdf
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import ExitStack
 from datetime import datetime
-from typing import Optional
+from typing import Callable, Optional
+
+# Bump whenever a change to this module alters parse output — cached parse
+# results (parse_cache.py) are keyed by it.
+PARSER_VERSION = "3"
 
 
 # ─── helpers ────────────────────────────────────────────────────────────────
@@ -66,6 +81,186 @@ def _detect_doc_type(text: str) -> str:
     return "unknown"
 
 
+# ─── text extraction backends ───────────────────────────────────────────────
+#
+# The line regexes only need each visual line's text in reading order, so
+# pdfplumber's character-level extract_text() does more work than most formats
+# need.  The "pypdf" backend takes the positioned text runs straight from the
+# content stream and groups them into lines by baseline — about 3x faster on
+# the Berger corpus with identical parse output (see bench_pdf_parser.py).
+# Each registered format picks its backend; pdfplumber is the reference and
+# the fallback.
+
+_LINE_Y_TOLERANCE = 3.0     # points; same as pdfplumber's default y_tolerance
+
+
+def _pypdf_page_text(page) -> str:
+    """A pypdf page's text runs as lines, top to bottom, each read left to right."""
+    runs = []
+
+    def visit(text, cm, tm, _font, _size):
+        if text and text.strip():
+            # Text-space origin mapped to user space (tm × cm)
+            x = tm[4] * cm[0] + tm[5] * cm[2] + cm[4]
+            y = tm[4] * cm[1] + tm[5] * cm[3] + cm[5]
+            runs.append((-y, x, text))
+
+    page.extract_text(visitor_text=visit)
+    runs.sort(key=lambda r: r[0])
+
+    lines, line, top = [], [], None
+    for neg_y, x, text in runs:
+        if top is not None and neg_y - top > _LINE_Y_TOLERANCE:
+            lines.append(line)
+            line, top = [], None
+        if top is None:
+            top = neg_y
+        line.append((x, text))
+    if line:
+        lines.append(line)
+    return "\n".join(" ".join(" ".join(t for _x, t in sorted(ln)).split()) for ln in lines)
+
+
+# name → (open(filepath) context manager with .pages, page → text)
+_BACKENDS = {
+    "pdfplumber": (pdfplumber.open,  lambda page: page.extract_text() or ""),
+    "pypdf":      (pypdf.PdfReader,  _pypdf_page_text),
+}
+
+# Page 0 is read with these, in order, until a detector recognises it.
+DETECT_BACKENDS = ("pypdf", "pdfplumber")
+
+
+# ─── page text extraction ───────────────────────────────────────────────────
+#
+# Text extraction dominates parse time.  Long documents have their pages split
+# into contiguous ranges, each extracted in a worker process that opens the
+# file itself (pdf objects don't pickle).  The parsers below only see the
+# ordered list of page texts, so their cross-page behaviour is identical
+# whichever way the text was produced.
+#
+# Each server process keeps one pool, created on first use.  The default size
+# splits the CPUs between the WEB_CONCURRENCY server workers so that N workers
+# don't start N × cpu_count extraction processes between them.
+
+PARALLEL_MIN_PAGES = int(os.environ.get("PDF_PARALLEL_MIN_PAGES", 8))
+PAGE_WORKERS       = int(os.environ.get(
+    "PDF_PAGE_WORKERS",
+    max(1, min((os.cpu_count() or 1) // max(int(os.environ.get("WEB_CONCURRENCY", 1)), 1), 8)),
+))
+
+_page_pool: Optional[ProcessPoolExecutor] = None
+_page_pool_lock = threading.Lock()
+
+
+def _get_page_pool() -> ProcessPoolExecutor:
+    """This process's page extraction pool, created on first call."""
+    global _page_pool
+    with _page_pool_lock:
+        if _page_pool is None:
+            _page_pool = ProcessPoolExecutor(max_workers=PAGE_WORKERS)
+        return _page_pool
+
+
+def _discard_page_pool(pool: ProcessPoolExecutor) -> None:
+    """Drop a broken pool so the next call starts a fresh one."""
+    global _page_pool
+    with _page_pool_lock:
+        if _page_pool is pool:
+            _page_pool = None
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+@atexit.register
+def _shutdown_page_pool() -> None:
+    with _page_pool_lock:
+        pool = _page_pool
+    if pool is not None:
+        pool.shutdown(wait=False, cancel_futures=True)
+
+
+def _extract_page_range(filepath: str, start: int, stop: int, backend: str = "pdfplumber") -> list:
+    """Worker: text of pages [start, stop) of filepath."""
+    opener, page_text = _BACKENDS[backend]
+    with opener(filepath) as doc:
+        return [page_text(page) for page in doc.pages[start:stop]]
+
+
+def _page_texts(filepath: str, doc, backend: str = "pdfplumber",
+                parallel: Optional[bool] = None, first_text: Optional[str] = None) -> list:
+    """
+    Text of every page of a document opened with ``backend``, in page order.
+
+    parallel: None = automatic (documents of PARALLEL_MIN_PAGES or more),
+    False = always serial (e.g. when the caller is already a worker process).
+    first_text: page 0's text if the caller already extracted it.
+    """
+    page_count = len(doc.pages)
+    texts = [first_text] if first_text is not None else []
+    start = len(texts)
+    remaining = page_count - start
+    if parallel is None:
+        parallel = page_count >= PARALLEL_MIN_PAGES
+    workers = min(PAGE_WORKERS, remaining)
+
+    if parallel and workers > 1:
+        size = -(-remaining // workers)  # ceil
+        ranges = [(lo, min(lo + size, page_count)) for lo in range(start, page_count, size)]
+        pool = _get_page_pool()
+        try:
+            chunks = pool.map(
+                _extract_page_range,
+                [filepath] * len(ranges), [lo for lo, _ in ranges], [hi for _, hi in ranges],
+                [backend] * len(ranges),
+            )
+            return texts + [t for chunk in chunks for t in chunk]
+        except BrokenProcessPool:
+            _discard_page_pool(pool)   # a worker died — fall through to serial extraction
+        except Exception:
+            pass                       # fall through to serial extraction
+
+    page_text = _BACKENDS[backend][1]
+    return texts + [page_text(page) for page in doc.pages[start:]]
+
+
+# ─── parser registry ────────────────────────────────────────────────────────
+#
+# supplier code → (detector, parser, backend).  Detectors take page 0's text
+# and must be cheap; parsers take the list of page texts extracted with the
+# format's backend.  Registration order is detection order.
+
+_PARSERS: dict[str, tuple[Callable[[str], bool], Callable[[list], dict], str]] = {}
+
+
+def register_parser(supplier: str, detect: Callable[[str], bool], backend: str = "pdfplumber"):
+    """Decorator: register a page-text parser for a supplier's PDF format."""
+    if backend not in _BACKENDS:
+        raise ValueError(f"Unknown text extraction backend: {backend}")
+
+    def wrap(parse: Callable[[list], dict]) -> Callable[[list], dict]:
+        _PARSERS[supplier] = (detect, parse, backend)
+        return parse
+    return wrap
+
+
+def supported_suppliers() -> list:
+    """Registered supplier codes, in detection order."""
+    return list(_PARSERS)
+
+
+def parser_backend(supplier: str) -> str:
+    """Text extraction backend registered for a supplier's format."""
+    return _PARSERS[supplier][2]
+
+
+def detect_supplier(first_page_text: str) -> Optional[str]:
+    """Supplier code whose detector recognises this first page, or None."""
+    for supplier, (detect, _parse, _backend) in _PARSERS.items():
+        if detect(first_page_text):
+            return supplier
+    return None
+
+
 # ─── LPS Invoice parser ──────────────────────────────────────────────────────
 
 # Matches lines like:
@@ -83,15 +278,13 @@ INVOICE_LINE_RE = re.compile(
 )
 
 
-def _parse_lps_invoice(pdf) -> dict:
+def _parse_lps_invoice(pages: list) -> dict:
     items = []
     order_number = ""
     date_str = ""
     job_name = ""
 
-    for page_num, page in enumerate(pdf.pages):
-        text = page.extract_text() or ""
-
+    for page_num, text in enumerate(pages):
         if page_num == 0:
             m = re.search(r'\b(\d{7})\b', text)
             if m:
@@ -159,14 +352,13 @@ BID_LINE_RE = re.compile(
 SKIP_RE = re.compile(r'^[*\-]{3,}|^(FREIGHT|ALLOW|PLEASE|NON-CANCEL|NO REFUND|---)', re.IGNORECASE)
 
 
-def _parse_lps_bid(pdf) -> dict:
+def _parse_lps_bid(pages: list) -> dict:
     items = []
     bid_number = ""
     date_str = ""
     job_name = ""
 
-    for page_num, page in enumerate(pdf.pages):
-        text = page.extract_text() or ""
+    for page_num, text in enumerate(pages):
         lines = text.split('\n')
 
         if page_num == 0:
@@ -218,20 +410,23 @@ def _parse_lps_bid(pdf) -> dict:
 
 # ─── LPS entry point ────────────────────────────────────────────────────────
 
-def parse_lps_pdf(filepath: str) -> dict:
+@register_parser("LPS", lambda text: _detect_doc_type(text) != "unknown")
+def _parse_lps_pages(pages: list) -> dict:
+    doc_type = _detect_doc_type(pages[0] if pages else "")
+    if doc_type == "invoice":
+        return _parse_lps_invoice(pages)
+    elif doc_type == "bid":
+        return _parse_lps_bid(pages)
+    else:
+        raise ValueError(
+            "Unrecognised LPS PDF format. "
+            "Expected 'SALES ORDER ACKNOWLEDGEMENT' or 'BID PROPOSAL'."
+        )
+
+
+def parse_lps_pdf(filepath: str, parallel: Optional[bool] = None) -> dict:
     """Parse a Lion Plumbing Supply PDF (invoice or bid)."""
-    with pdfplumber.open(filepath) as pdf:
-        first_text = pdf.pages[0].extract_text() or ""
-        doc_type = _detect_doc_type(first_text)
-        if doc_type == "invoice":
-            return _parse_lps_invoice(pdf)
-        elif doc_type == "bid":
-            return _parse_lps_bid(pdf)
-        else:
-            raise ValueError(
-                "Unrecognised LPS PDF format. "
-                "Expected 'SALES ORDER ACKNOWLEDGEMENT' or 'BID PROPOSAL'."
-            )
+    return _parse_file(filepath, "LPS", parallel, detect=False)
 
 
 # ─── Berger (BPS) Invoice parser ─────────────────────────────────────────────
@@ -259,65 +454,72 @@ _BERGER_TICKET_NO = re.compile(r'Ticket\s*No\s*:\s*([\w\-]+)', re.IGNORECASE)
 _BERGER_TICKET_DT = re.compile(r'Ticket\s*Date\s*:\s*(\d{1,2}/\d{1,2}/\d{2,4})', re.IGNORECASE)
 
 
-def parse_berger_pdf(filepath: str) -> dict:
+def parse_berger_pdf(filepath: str, parallel: Optional[bool] = None) -> dict:
     """Parse a Berger Plumbing Supply invoice (Ticket format)."""
+    return _parse_file(filepath, "BPS", parallel, detect=False)
+
+
+def _is_berger(text: str) -> bool:
+    return bool(_BERGER_TICKET_NO.search(text) and _BERGER_HEADER_RE.search(text))
+
+
+@register_parser("BPS", _is_berger, backend="pypdf")
+def _parse_berger_pages(pages: list) -> dict:
     order_number = ""
     date_str = ""
     job_name = ""
     items = []
 
-    with pdfplumber.open(filepath) as pdf:
-        for page_num, page in enumerate(pdf.pages):
-            text = page.extract_text() or ""
-            lines = text.split('\n')
-
-            if page_num == 0:
-                m = _BERGER_TICKET_NO.search(text)
-                if m:
-                    order_number = m.group(1)
-                m = _BERGER_TICKET_DT.search(text)
-                if m:
-                    date_str = _parse_date(m.group(1))
-
-            in_items = False
-            i = 0
-            while i < len(lines):
-                stripped = lines[i].strip()
-                i += 1
-
-                if not in_items:
-                    if _BERGER_HEADER_RE.search(stripped):
-                        in_items = True
-                    continue
+    for page_num, text in enumerate(pages):
+        lines = text.split('\n')
 
-                if _BERGER_STOP_RE.search(stripped):
-                    break
+        if page_num == 0:
+            m = _BERGER_TICKET_NO.search(text)
+            if m:
+                order_number = m.group(1)
+            m = _BERGER_TICKET_DT.search(text)
+            if m:
+                date_str = _parse_date(m.group(1))
 
-                if not stripped:
-                    continue
+        in_items = False
+        i = 0
+        while i < len(lines):
+            stripped = lines[i].strip()
+            i += 1
 
-                m = BERGER_LINE_RE.match(stripped)
-                if m:
-                    items.append({
-                        "item_number": m.group(2),
-                        "description": m.group(3).strip(),
-                        "uom": m.group(5),
-                        "quantity": int(m.group(1)),
-                        "unit_price": _clean_price(m.group(4)),
-                    })
-                    # Look ahead for a wrapped description continuation line
-                    # (a short non-data, non-stop line immediately following)
-                    while i < len(lines):
-                        cont = lines[i].strip()
-                        if not cont:
-                            i += 1
-                            continue
-                        if (not BERGER_LINE_RE.match(cont)
-                                and not _BERGER_STOP_RE.search(cont)
-                                and not _BERGER_HEADER_RE.search(cont)):
-                            items[-1]["description"] += " " + cont
-                            i += 1
-                        break
+            if not in_items:
+                if _BERGER_HEADER_RE.search(stripped):
+                    in_items = True
+                continue
+
+            if _BERGER_STOP_RE.search(stripped):
+                break
+
+            if not stripped:
+                continue
+
+            m = BERGER_LINE_RE.match(stripped)
+            if m:
+                items.append({
+                    "item_number": m.group(2),
+                    "description": m.group(3).strip(),
+                    "uom": m.group(5),
+                    "quantity": int(m.group(1)),
+                    "unit_price": _clean_price(m.group(4)),
+                })
+                # Look ahead for a wrapped description continuation line
+                # (a short non-data, non-stop line immediately following)
+                while i < len(lines):
+                    cont = lines[i].strip()
+                    if not cont:
+                        i += 1
+                        continue
+                    if (not BERGER_LINE_RE.match(cont)
+                            and not _BERGER_STOP_RE.search(cont)
+                            and not _BERGER_HEADER_RE.search(cont)):
+                        items[-1]["description"] += " " + cont
+                        i += 1
+                    break
 
     return {
         "doc_type": "invoice",
@@ -331,12 +533,68 @@ def parse_berger_pdf(filepath: str) -> dict:
 
 # ─── Public entry point ──────────────────────────────────────────────────────
 
-def parse_pdf(filepath: str, supplier: str = "LPS") -> dict:
+def _parse_file(filepath: str, supplier: Optional[str], parallel: Optional[bool],
+                detect: bool = True, backend: Optional[str] = None) -> dict:
+    """
+    Detect the format on page 0, extract every page with the format's backend
+    and parse.  Page 0 text is shared between detection and parsing whenever
+    they use the same backend.  If a non-reference backend fails or yields no
+    items, the document is re-read with pdfplumber.
+    """
+    with ExitStack() as stack:
+        docs, first = {}, {}
+
+        def open_doc(name):
+            if name not in docs:
+                docs[name] = stack.enter_context(_BACKENDS[name][0](filepath))
+                if not len(docs[name].pages):
+                    raise ValueError("PDF has no pages.")
+            return docs[name]
+
+        def first_text(name):
+            if name not in first:
+                first[name] = _BACKENDS[name][1](open_doc(name).pages[0])
+            return first[name]
+
+        if detect:
+            for name in DETECT_BACKENDS:
+                try:
+                    found = detect_supplier(first_text(name))
+                except Exception:
+                    if name == DETECT_BACKENDS[-1]:
+                        raise
+                    continue     # unreadable by this backend — try the next
+                if found:
+                    supplier = found
+                    break
+        if supplier not in _PARSERS:
+            raise ValueError(
+                "Unrecognised PDF format. Supported suppliers: "
+                + ", ".join(_PARSERS) + "."
+            )
+
+        _detect, parse, registered = _PARSERS[supplier]
+        backend = backend or registered
+        if backend != "pdfplumber":
+            try:
+                result = parse(_page_texts(filepath, open_doc(backend), backend, parallel, first_text(backend)))
+                if result["items"]:
+                    return result
+            except Exception:
+                pass             # fall back to pdfplumber below
+        return parse(_page_texts(filepath, open_doc("pdfplumber"), "pdfplumber",
+                                 parallel, first_text("pdfplumber")))
+
+
+def parse_pdf(filepath: str, supplier: Optional[str] = None, parallel: Optional[bool] = None,
+              backend: Optional[str] = None) -> dict:
     """
     Parse a supplier PDF and return structured data.
-    supplier: "LPS" (Lion Plumbing Supply) or "BPS" (Berger Plumbing Supply)
+    The format is detected from the first page; supplier ("LPS", "BPS", …) is
+    only used when no registered detector recognises it.
+    parallel: page-parallel text extraction — None picks it for long documents,
+              False forces serial (use inside worker processes).
+    backend:  override the format's text extraction backend ("pdfplumber", "pypdf").
     Returns dict with doc_type, order_number, date, job_name, supplier, items.
     """
-    if supplier == "BPS":
-        return parse_berger_pdf(filepath)
-    return parse_lps_pdf(filepath)
+    return _parse_file(filepath, supplier, parallel, backend=backend)
@@ -493,6 +493,11 @@ def judge_same_product(desc_a: str, desc_b: str, use_web: bool = True, max_snipp
             "best_supporting_urls": [],
         }
 
+    return _llm_judge(a, b, use_web=use_web, max_snippets=max_snippets)
+
+
+def _llm_judge(a: Dict, b: Dict, use_web: bool = True, max_snippets: int = 8) -> Dict:
+    """Steps 2–3 of :func:`judge_same_product` for already-parsed attributes."""
     # 2) Optional web RAG
     snippets: List[Dict] = []
     if use_web:
@@ -561,4 +566,120 @@ def judge_same_product(desc_a: str, desc_b: str, use_web: bool = True, max_snipp
         }
 
 
-__all__ = ["judge_same_product", "parse_attrs", "canon", "web_search_snippets"]
+# ----------------------------
+# Batch Equivalence Clustering
+# ----------------------------
+
+def _block_key(attrs: Dict) -> Optional[tuple]:
+    """
+    Candidate block for an item: (material, type, schedule, sizes).
+    Items with no type or no sizes are too vague to pair and get no block.
+    """
+    sizes = attrs.get("sizes") or []
+    if not attrs.get("type") or not sizes:
+        return None
+    return (attrs.get("material"), attrs["type"], attrs.get("schedule"), tuple(sorted(sizes)))
+
+
+def cluster_equivalents(
+    items,
+    use_llm: bool = True,
+    use_web: bool = False,
+    min_confidence: float = 0.8,
+    max_workers: int = 8,
+) -> tuple[List[Dict], Dict]:
+    """
+    Group catalog items that are the same product sold by different suppliers.
+
+    ``items`` is an iterable of (supplier, description).  Every description is
+    parsed once; only cross-supplier pairs inside the same block are compared.
+    Identical canonical text and :func:`_hard_attr_compare` settle most pairs;
+    with ``use_llm`` the undecidable rest go to the LLM judge concurrently and
+    are linked when it says same_product with at least ``min_confidence``.
+    Linked items are merged transitively.
+
+    Returns ``(groups, stats)``.  Each group is
+    ``{"members": [(supplier, description), ...], "method": "exact"|"rules"|"llm",
+    "confidence": float}`` and spans at least two suppliers.
+    """
+    keys = sorted({(s, d) for s, d in items if s and d})
+    attrs_by_desc: Dict[str, Dict] = {}
+    for _, desc in keys:
+        if desc not in attrs_by_desc:
+            attrs_by_desc[desc] = parse_attrs(desc)
+
+    blocks: Dict[tuple, List[int]] = {}
+    for idx, (_, desc) in enumerate(keys):
+        bk = _block_key(attrs_by_desc[desc])
+        if bk is not None:
+            blocks.setdefault(bk, []).append(idx)
+
+    parent = list(range(len(keys)))
+
+    def find(i: int) -> int:
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    edges: Dict[tuple, tuple] = {}    # (i, j) -> (method, confidence)
+    undecided: List[tuple] = []
+    stats = Counter(items=len(keys), blocks=len(blocks))
+
+    for members in blocks.values():
+        for x, i in enumerate(members):
+            for j in members[x + 1:]:
+                if keys[i][0] == keys[j][0]:
+                    continue
+                stats["pairs"] += 1
+                a, b = attrs_by_desc[keys[i][1]], attrs_by_desc[keys[j][1]]
+                if a["canon"] == b["canon"]:
+                    edges[(i, j)] = ("exact", 1.0)
+                    stats["exact"] += 1
+                    continue
+                quick = _hard_attr_compare(a, b)
+                if quick["decidable"]:
+                    stats["rules_same" if quick["same"] else "rules_different"] += 1
+                    if quick["same"]:
+                        edges[(i, j)] = ("rules", 0.95)
+                else:
+                    undecided.append((i, j))
+
+    stats["undecided"] = len(undecided)
+    if use_llm and undecided:
+        from concurrent.futures import ThreadPoolExecutor
+
+        def _judge(pair):
+            i, j = pair
+            return pair, _llm_judge(attrs_by_desc[keys[i][1]], attrs_by_desc[keys[j][1]], use_web=use_web)
+
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            for (i, j), verdict in pool.map(_judge, undecided):
+                stats["llm_calls"] += 1
+                conf = float(verdict.get("confidence") or 0)
+                if verdict.get("same_product") is True and conf >= min_confidence:
+                    edges[(i, j)] = ("llm", conf)
+                    stats["llm_same"] += 1
+
+    for i, j in edges:
+        parent[find(i)] = find(j)
+
+    rank = {"exact": 0, "rules": 1, "llm": 2}
+    grouped: Dict[int, Dict] = {}
+    for (i, j), (method, conf) in edges.items():
+        g = grouped.setdefault(find(i), {"members": set(), "method": "exact", "confidence": 1.0})
+        g["members"].update((keys[i], keys[j]))
+        if rank[method] > rank[g["method"]]:
+            g["method"] = method
+        g["confidence"] = min(g["confidence"], conf)
+
+    groups = [
+        {"members": sorted(g["members"]), "method": g["method"], "confidence": round(g["confidence"], 3)}
+        for g in grouped.values()
+    ]
+    groups.sort(key=lambda g: g["members"][0][1])
+    stats["groups"] = len(groups)
+    return groups, dict(stats)
+
+
+__all__ = ["judge_same_product", "parse_attrs", "canon", "web_search_snippets", "cluster_equivalents"]
@@ -1330,19 +1330,33 @@ function AnalyzePage({ data }) {
   const [filter, setFilter]       = useState("changed");
   const [expandedRow, setExpandedRow] = useState(null);
   const [preset, setPreset] = useState("90d");
+  const [histories, setHistories] = useState({});
+  const lastQuery = useRef("");
 
   const fetchData = useCallback((opts = {}) => {
     const s = opts.start || startDate;
     const e = opts.end   || endDate;
     if (!s || !e) return;
     setLoading(true);
-    fetch(`${data.priceIntelApi}?supply=${supply}&start_date=${s}&end_date=${e}`)
+    const query = `supply=${supply}&start_date=${s}&end_date=${e}`;
+    fetch(`${data.priceIntelApi}?${query}&mode=summary`)
       .then(r => r.json())
-      .then(d => setResults(d))
+      .then(d => { lastQuery.current = query; setHistories({}); setResults(d); })
       .catch(() => setResults(null))
       .finally(() => setLoading(false));
   }, [supply, startDate, endDate, data.priceIntelApi]);
 
+  // History is left out of the summary payload; load it when a row is expanded.
+  const toggleRow = (desc) => {
+    if (expandedRow === desc) { setExpandedRow(null); return; }
+    setExpandedRow(desc);
+    if (histories[desc]) return;
+    fetch(`${data.priceIntelHistoryApi}?${lastQuery.current}&description=${encodeURIComponent(desc)}`)
+      .then(r => r.json())
+      .then(d => setHistories(h => ({ ...h, [desc]: d.history?.[desc] || [] })))
+      .catch(() => setHistories(h => ({ ...h, [desc]: [] })));
+  };
+
   useEffect(() => { fetchData(); }, []);
 
   const applyPreset = (p) => {
@@ -1724,11 +1738,12 @@ function AnalyzePage({ data }) {
                   ? <tr><td colSpan={7} className="px-4 py-10 text-center text-sm text-slate-400">No items match the current filter.</td></tr>
                   : movers.map((r, i) => {
                     const isOpen = expandedRow === r.description;
+                    const history = histories[r.description];
                     const detailUrl = `/product_detail?description=${encodeURIComponent(r.description)}&supply=${supply}&ref=analyze`;
                     return (
                       <React.Fragment key={i}>
                         <tr
-                          onClick={() => setExpandedRow(isOpen ? null : r.description)}
+                          onClick={() => toggleRow(r.description)}
                           className={`cursor-pointer transition-colors hover:bg-sky-50 ${isOpen ? "bg-sky-50" : ""}`}
                         >
                           <td className="max-w-xs px-4 py-3">
@@ -1777,11 +1792,13 @@ function AnalyzePage({ data }) {
                                   {/* Right column — chart */}
                                   <div className="col-span-2 rounded-xl bg-white p-4 ring-1 ring-slate-200 flex flex-col">
                                     <p className="mb-3 text-xs font-semibold uppercase tracking-wide text-slate-400">
-                                      Price History — {r.history?.length || 0} purchases
+                                      Price History — {r.purchase_count} purchases
                                     </p>
-                                    {r.history?.length > 1
-                                      ? <div className="flex-1"><PriceHistoryChart history={r.history} pctChange={r.pct_change} /></div>
-                                      : <p className="text-sm text-slate-400 my-auto">Only one purchase recorded — no trend to display.</p>
+                                    {!history
+                                      ? <p className="text-sm text-slate-400 my-auto">Loading history…</p>
+                                      : history.length > 1
+                                        ? <div className="flex-1"><PriceHistoryChart history={history} pctChange={r.pct_change} /></div>
+                                        : <p className="text-sm text-slate-400 my-auto">Only one purchase recorded — no trend to display.</p>
                                     }
                                   </div>
                                 </div>
@@ -1806,6 +1823,95 @@ function AnalyzePage({ data }) {
   );
 }
 
+// ================================================================
+// ComparePage
+// ================================================================
+function ComparePage({ data }) {
+  const [groups, setGroups]   = useState(null);
+  const [loading, setLoading] = useState(true);
+  const [search, setSearch]   = useState("");
+
+  useEffect(() => {
+    fetch(data.compareApi)
+      .then(r => r.json())
+      .then(d => setGroups(d.groups || []))
+      .catch(() => setGroups([]))
+      .finally(() => setLoading(false));
+  }, [data.compareApi]);
+
+  const visible = useMemo(() => {
+    if (!groups) return [];
+    if (!search) return groups;
+    const q = search.toLowerCase();
+    return groups.filter(g => g.members.some(m =>
+      m.description.toLowerCase().includes(q) || (m.item_number || "").toLowerCase().includes(q)
+    ));
+  }, [groups, search]);
+
+  return (
+    <div className="space-y-6">
+      <div className="rounded-2xl bg-white p-6 shadow-sm ring-1 ring-slate-200">
+        <h1 className="text-2xl font-semibold text-slate-900">Supplier Comparison</h1>
+        <p className="mt-1 text-sm text-slate-500">
+          The same product across suppliers, by latest purchase price. Cheapest supplier first.
+        </p>
+        <input
+          type="text" value={search} onChange={e => setSearch(e.target.value)}
+          placeholder="Filter by description or item #…"
+          className="mt-4 w-full rounded-lg border border-slate-300 bg-white px-3 py-2 text-sm text-slate-700 shadow-sm focus:border-sky-500 focus:outline-none focus:ring-2 focus:ring-sky-200"
+        />
+      </div>
+
+      <div className="overflow-hidden rounded-2xl bg-white shadow-sm ring-1 ring-slate-200">
+        {loading
+          ? <p className="px-6 py-10 text-center text-sm text-slate-400">Loading…</p>
+          : visible.length === 0
+          ? <p className="px-6 py-10 text-center text-sm text-slate-400">
+              {groups?.length ? "No groups match the filter." : "No product groups yet — an admin can build them from the Admin page."}
+            </p>
+          : (
+            <table className="w-full text-left">
+              <thead className="bg-slate-50 text-xs font-semibold uppercase tracking-wide text-slate-500">
+                <tr>
+                  <th className="px-4 py-3">Supplier</th>
+                  <th className="px-4 py-3">Description</th>
+                  <th className="px-4 py-3 text-right">Last Price</th>
+                  <th className="px-4 py-3">Last Date</th>
+                  <th className="px-4 py-3 text-right">Spread</th>
+                </tr>
+              </thead>
+              {visible.map(g => (
+                <tbody key={g.group_id} className="divide-y divide-slate-50 border-t border-slate-200">
+                  {g.members.map((m, i) => (
+                    <tr key={`${m.supplier}-${i}`} className={i === 0 ? "bg-emerald-50/60" : ""}>
+                      <td className="px-4 py-2 text-sm font-semibold text-slate-700">{m.supplier}</td>
+                      <td className="max-w-md px-4 py-2">
+                        <p className="truncate text-sm text-slate-800">{m.description}</p>
+                        {m.item_number && <p className="text-xs text-slate-400">{m.item_number}</p>}
+                      </td>
+                      <td className={`px-4 py-2 text-right text-sm ${i === 0 ? "font-semibold text-emerald-600" : "text-slate-600"}`}>
+                        {m.last_price != null ? `$${m.last_price.toFixed(4)}` : "—"}
+                      </td>
+                      <td className="whitespace-nowrap px-4 py-2 text-xs text-slate-400">{m.last_date || "—"}</td>
+                      {i === 0 && (
+                        <td rowSpan={g.members.length} className="px-4 py-2 text-right align-top">
+                          <span className="inline-block rounded-full bg-rose-50 px-2.5 py-0.5 text-xs font-bold text-rose-600 ring-1 ring-rose-200">
+                            +{g.spread_pct}%
+                          </span>
+                          <p className="mt-1 text-xs text-slate-400">{g.method === "llm" ? `AI match · ${Math.round(g.confidence * 100)}%` : "Attribute match"}</p>
+                        </td>
+                      )}
+                    </tr>
+                  ))}
+                </tbody>
+              ))}
+            </table>
+          )}
+      </div>
+    </div>
+  );
+}
+
 // ================================================================
 // ProductDetailPage
 // ================================================================
@@ -3088,13 +3194,14 @@ function TemplatesPage({ data }) {
 // ================================================================
 function UploadPdfPage({ data }) {
   const SUPPLIERS = data.suppliers || [
+    { code: "AUTO", label: "Auto-detected" },
     { code: "LPS",  label: "Lion Plumbing Supply" },
     { code: "BPS",  label: "Berger Plumbing Supply" },
     { code: "S2",   label: "Supply 2" },
     { code: "BOND", label: "Bond Plumbing Supply" },
   ];
 
-  const [supplier, setSupplier]   = useState("LPS");
+  const [supplier, setSupplier]   = useState(SUPPLIERS[0].code);
   const [dragging, setDragging]   = useState(false);
   const [uploading, setUploading] = useState(false);
   const [saving, setSaving]       = useState(false);
@@ -3103,8 +3210,21 @@ function UploadPdfPage({ data }) {
   const [result, setResult]       = useState(null);   // confirmed-save result
   const [error, setError]         = useState("");
   const [invoices]                = useState(data.invoices || []);
+  const [batch, setBatch]         = useState(null);   // [{ filename, success, parsed, error, saved }]
+  const [batchIdx, setBatchIdx]   = useState(null);   // batch entry under review
+  const [jobId, setJobId]         = useState(null);   // background parse job behind `parsed`
   const fileInputRef = useRef(null);
 
+  const toPreview = (json, fallbackSupplier) => ({
+    doc_type:     json.doc_type,
+    order_number: json.order_number,
+    date:         json.date         || "",
+    job_name:     json.job_name     || "",
+    supplier:     json.supplier     || fallbackSupplier,
+    sha256:       json.sha256       || "",
+    items: (json.items || []).map((item, i) => ({ ...item, _id: i })),
+  });
+
   // ── Step 1: parse the PDF (does NOT save) ───────────────────────────────
   const parseFile = async (f) => {
     if (!f || !f.name.toLowerCase().endsWith(".pdf")) {
@@ -3117,26 +3237,36 @@ function UploadPdfPage({ data }) {
     setParsed(null);
     setResult(null);
 
+    setJobId(null);
+
     const formData = new FormData();
     formData.append("pdf_file", f);
     formData.append("supplier", supplier);
+    formData.append("async", "1");
 
     try {
       const resp = await fetch(data.uploadUrl || "/upload_pdf", {
         method: "POST",
         body: formData,
       });
-      const json = await resp.json();
+      let json = await resp.json();
+
+      // Cache misses come back as a queued job — poll until it finishes
+      if (resp.status === 202 && json.status_url) {
+        setJobId(json.job_id);
+        for (;;) {
+          await new Promise(r => setTimeout(r, 700));
+          const job = await (await fetch(json.status_url)).json();
+          if (job.status === "done")   { json = job.result; break; }
+          if (job.status === "failed" || !job.status) {
+            json = { success: false, error: job.error || "Parse failed." };
+            break;
+          }
+        }
+      }
 
       if (json.success) {
-        setParsed({
-          doc_type:     json.doc_type,
-          order_number: json.order_number,
-          date:         json.date         || "",
-          job_name:     json.job_name     || "",
-          supplier:     json.supplier     || supplier,
-          items: (json.items || []).map((item, i) => ({ ...item, _id: i })),
-        });
+        setParsed(toPreview(json, supplier));
       } else {
         setError(json.error || "Parse failed.");
       }
@@ -3147,6 +3277,66 @@ function UploadPdfPage({ data }) {
     }
   };
 
+  // ── Step 1 (many files): parse in parallel, results stream in as NDJSON ──
+  const parseBatch = async (files) => {
+    const pdfs = files.filter(f => f.name.toLowerCase().endsWith(".pdf"));
+    if (!pdfs.length) {
+      setError("Please select PDF files.");
+      return;
+    }
+    setUploading(true);
+    setError("");
+    setParsed(null);
+    setResult(null);
+    setBatch(pdfs.map(f => ({ filename: f.name, pending: true })));
+
+    const formData = new FormData();
+    pdfs.forEach(f => formData.append("pdf_files", f));
+    formData.append("supplier", supplier);
+
+    try {
+      const resp = await fetch(data.batchUploadUrl, { method: "POST", body: formData });
+      if (!resp.ok) {
+        const json = await resp.json().catch(() => ({}));
+        setError(json.error || "Batch upload failed.");
+        setBatch(null);
+        return;
+      }
+      const reader  = resp.body.getReader();
+      const decoder = new TextDecoder();
+      let buffer = "";
+      for (;;) {
+        const { value, done } = await reader.read();
+        if (done) break;
+        buffer += decoder.decode(value, { stream: true });
+        const lines = buffer.split("\n");
+        buffer = lines.pop();
+        lines.filter(Boolean).forEach(line => {
+          const msg = JSON.parse(line);
+          if (msg.done) return;
+          setBatch(prev => prev.map((b, i) => i !== msg.index ? b : {
+            filename: msg.filename,
+            success:  msg.success,
+            error:    msg.error,
+            parsed:   msg.success ? toPreview(msg, supplier) : null,
+          }));
+        });
+      }
+    } catch (e) {
+      setError("Network error during batch upload.");
+    } finally {
+      setUploading(false);
+    }
+  };
+
+  const reviewBatchEntry = (idx) => {
+    setBatchIdx(idx);
+    setFile({ name: batch[idx].filename });
+    setParsed(batch[idx].parsed);
+    setResult(null);
+    setError("");
+  };
+
   // ── Step 2: confirm & save the (possibly edited) data ───────────────────
   const confirmSave = async () => {
     if (!parsed) return;
@@ -3159,6 +3349,7 @@ function UploadPdfPage({ data }) {
         items: parsed.items.map(({ _id, ...rest }) => rest),
       },
       filename: file?.name || "",
+      job_id: batchIdx === null ? jobId : null,
     };
 
     try {
@@ -3173,7 +3364,15 @@ function UploadPdfPage({ data }) {
         setResult(json);
         setParsed(null);
         setFile(null);
-        window.location.reload();
+        setJobId(null);
+        if (batchIdx !== null) {
+          // Back to the batch list; the rest of the files are still waiting
+          setBatch(prev => prev.map((b, i) => i === batchIdx ? { ...b, saved: true } : b));
+          setBatchIdx(null);
+        } else if (!json.price_anomalies?.length) {
+          // Keep the banner up when prices were flagged so they can be reviewed
+          window.location.reload();
+        }
       } else if (json.duplicate) {
         setError(`Already imported: ${json.error}`);
       } else {
@@ -3203,16 +3402,19 @@ function UploadPdfPage({ data }) {
     }));
 
   // ── File input handlers ─────────────────────────────────────────────────
+  const handleFiles = (fileList) => {
+    const files = Array.from(fileList || []);
+    if (files.length > 1 && data.batchUploadUrl) parseBatch(files);
+    else if (files.length) parseFile(files[0]);
+  };
   const handleFileInput = (e) => {
-    const f = e.target.files?.[0];
-    if (f) parseFile(f);
+    handleFiles(e.target.files);
     e.target.value = "";
   };
   const handleDrop = (e) => {
     e.preventDefault();
     setDragging(false);
-    const f = e.dataTransfer.files?.[0];
-    if (f) parseFile(f);
+    handleFiles(e.dataTransfer.files);
   };
   const handleDragOver  = (e) => { e.preventDefault(); setDragging(true); };
   const handleDragLeave = () => setDragging(false);
@@ -3264,17 +3466,19 @@ function UploadPdfPage({ data }) {
                 : "border-slate-300 bg-white hover:border-sky-400 hover:bg-slate-50"
             )}
           >
-            <input ref={fileInputRef} type="file" accept=".pdf" className="hidden" onChange={handleFileInput} />
+            <input ref={fileInputRef} type="file" accept=".pdf" multiple className="hidden" onChange={handleFileInput} />
             {uploading ? (
               <>
                 <div className="h-8 w-8 animate-spin rounded-full border-4 border-sky-600 border-t-transparent" />
-                <p className="text-sm font-semibold text-sky-700">Parsing PDF…</p>
+                <p className="text-sm font-semibold text-sky-700">
+                  {batch ? `Parsing ${batch.filter(b => !b.pending).length} / ${batch.length} PDFs…` : "Parsing PDF…"}
+                </p>
               </>
             ) : (
               <>
                 <span className="text-4xl">📄</span>
                 <p className="text-sm font-semibold text-slate-700">
-                  Drop PDF here or <span className="text-sky-600 underline">click to browse</span>
+                  Drop PDFs here or <span className="text-sky-600 underline">click to browse</span>
                 </p>
                 <p className="text-xs text-slate-400">
                   {SUPPLIERS.find((s) => s.code === supplier)?.label} format
@@ -3285,6 +3489,45 @@ function UploadPdfPage({ data }) {
         </>
       )}
 
+      {/* Batch queue — review each parsed file, then confirm it */}
+      {batch && !parsed && (
+        <div className="overflow-hidden rounded-2xl bg-white ring-1 ring-slate-200">
+          <div className="flex items-center justify-between border-b border-slate-100 px-4 py-3">
+            <h2 className="text-sm font-semibold text-slate-800">
+              Batch — {batch.filter(b => b.saved).length} of {batch.filter(b => b.success).length} parsed files saved
+            </h2>
+            {!uploading && (
+              <button type="button" onClick={() => window.location.reload()}
+                className="text-xs font-medium text-sky-600 hover:text-sky-700">Done</button>
+            )}
+          </div>
+          <table className="w-full text-sm">
+            <tbody className="divide-y divide-slate-50">
+              {batch.map((b, i) => (
+                <tr key={i}>
+                  <td className="px-4 py-2 text-slate-700">{b.filename}</td>
+                  <td className="px-4 py-2 text-xs text-slate-500">
+                    {b.pending ? "Parsing…"
+                      : b.success ? `${b.parsed.order_number || "—"} · ${b.parsed.date || "no date"} · ${b.parsed.items.length} items`
+                      : <span className="text-rose-600">{b.error}</span>}
+                  </td>
+                  <td className="px-4 py-2 text-right">
+                    {b.saved
+                      ? <span className="text-xs font-semibold text-emerald-600">Saved</span>
+                      : b.success && (
+                        <button type="button" onClick={() => reviewBatchEntry(i)}
+                          className="rounded-lg bg-sky-600 px-3 py-1 text-xs font-semibold text-white hover:bg-sky-500">
+                          Review
+                        </button>
+                      )}
+                  </td>
+                </tr>
+              ))}
+            </tbody>
+          </table>
+        </div>
+      )}
+
       {/* Error banner */}
       {error && (
         <div className="rounded-xl bg-rose-50 px-4 py-3 text-sm text-rose-700 ring-1 ring-rose-200">
@@ -3418,7 +3661,7 @@ function UploadPdfPage({ data }) {
               {saving ? "Saving…" : "Confirm & Save to Turso"}
             </button>
             <button
-              onClick={() => { setParsed(null); setFile(null); setError(""); }}
+              onClick={() => { setParsed(null); setFile(null); setError(""); setBatchIdx(null); }}
               className="rounded-xl bg-slate-100 px-5 py-2 text-sm font-medium text-slate-700 hover:bg-slate-200 transition"
             >
               Cancel
@@ -3427,7 +3670,7 @@ function UploadPdfPage({ data }) {
         </div>
       )}
 
-      {/* Success banner (brief — page reloads immediately after) */}
+      {/* Success banner (brief — page reloads right after unless prices were flagged) */}
       {result && (
         <div className="rounded-2xl bg-emerald-50 p-5 ring-1 ring-emerald-200 space-y-2">
           <div className="flex items-center gap-2">
@@ -3442,6 +3685,41 @@ function UploadPdfPage({ data }) {
             <div><span className="font-medium">Date:</span> {result.date}</div>
             <div><span className="font-medium">Job:</span> {result.job_name || "—"}</div>
           </div>
+          {result.price_anomalies?.length > 0 && (
+            <div className="mt-3 rounded-xl bg-white p-4 ring-1 ring-amber-200">
+              <p className="text-sm font-semibold text-amber-700">
+                ⚠ {result.price_anomalies.length} price{result.price_anomalies.length !== 1 ? "s" : ""} outside the usual range
+              </p>
+              <table className="mt-2 w-full text-xs">
+                <thead className="text-left text-slate-400">
+                  <tr>
+                    <th className="py-1 pr-3 font-medium">Description</th>
+                    <th className="py-1 pr-3 text-right font-medium">Price</th>
+                    <th className="py-1 pr-3 text-right font-medium">Last</th>
+                    <th className="py-1 pr-3 text-right font-medium">Avg (n)</th>
+                    <th className="py-1 text-right font-medium">vs. Last</th>
+                  </tr>
+                </thead>
+                <tbody className="divide-y divide-slate-50">
+                  {result.price_anomalies.map((a, i) => (
+                    <tr key={i}>
+                      <td className="py-1 pr-3 text-slate-700">{a.description}</td>
+                      <td className="py-1 pr-3 text-right font-semibold text-slate-800">${a.unit_price.toFixed(4)}</td>
+                      <td className="py-1 pr-3 text-right text-slate-500">${a.last_price.toFixed(4)}</td>
+                      <td className="py-1 pr-3 text-right text-slate-500">${a.mean.toFixed(4)} ({a.history_count})</td>
+                      <td className={`py-1 text-right font-semibold ${a.flag === "high" ? "text-rose-600" : "text-emerald-600"}`}>
+                        {a.pct_vs_last >= 0 ? "+" : ""}{a.pct_vs_last}%
+                      </td>
+                    </tr>
+                  ))}
+                </tbody>
+              </table>
+              <button type="button" onClick={() => window.location.reload()}
+                className="mt-3 text-xs font-medium text-sky-600 hover:text-sky-700">
+                Done
+              </button>
+            </div>
+          )}
         </div>
       )}
 
@@ -4339,6 +4617,39 @@ function FixturesPanel({ pkg, pkgIdx, estimateName, onUpdatePkg, onDelete, onAdd
 // ================================================================
 // EstimateBuilderPage — create / edit a sectioned estimate
 // ================================================================
+// ── JSON Patch (RFC 6902) for incremental estimate saves ─────────────
+// Operations turning `src` into `dst`. Arrays trim their common head and
+// tail, so editing or adding one row sends that row, not the whole list.
+const _ptr = (k) => String(k).replace(/~/g, "~0").replace(/\//g, "~1");
+function jsonPatch(src, dst, path = "", ops = []) {
+  const kind = (v) => (Array.isArray(v) ? "array" : v === null ? "null" : typeof v);
+  if (kind(src) !== kind(dst)) {
+    ops.push({ op: "replace", path, value: dst });
+  } else if (kind(src) === "array") {
+    const same = (a, b) => JSON.stringify(a) === JSON.stringify(b);
+    let head = 0, tail = 0;
+    while (head < src.length && head < dst.length && same(src[head], dst[head])) head++;
+    while (tail < src.length - head && tail < dst.length - head
+           && same(src[src.length - 1 - tail], dst[dst.length - 1 - tail])) tail++;
+    const oldMid = src.length - head - tail, newMid = dst.length - head - tail;
+    if (oldMid === newMid) {
+      for (let i = head; i < head + oldMid; i++) jsonPatch(src[i], dst[i], `${path}/${i}`, ops);
+    } else {
+      for (let i = head + oldMid - 1; i >= head; i--) ops.push({ op: "remove", path: `${path}/${i}` });
+      for (let i = head; i < head + newMid; i++) ops.push({ op: "add", path: `${path}/${i}`, value: dst[i] });
+    }
+  } else if (kind(src) === "object") {
+    Object.keys(src).forEach((k) => { if (!(k in dst)) ops.push({ op: "remove", path: `${path}/${_ptr(k)}` }); });
+    Object.keys(dst).forEach((k) => {
+      if (!(k in src)) ops.push({ op: "add", path: `${path}/${_ptr(k)}`, value: dst[k] });
+      else jsonPatch(src[k], dst[k], `${path}/${_ptr(k)}`, ops);
+    });
+  } else if (src !== dst) {
+    ops.push({ op: "replace", path, value: dst });
+  }
+  return ops;
+}
+
 const isBelowLine = (s) => s.is_gas || !!s.below_line;
 
 function _buildInitialScenarios(content) {
@@ -4890,16 +5201,33 @@ function EstimateBuilderPage({ data }) {
   };
 
   // ── save ─────────────────────────────────────────────────────────
+  // After the first full save, saves send a JSON patch against the last saved
+  // payload; the server answers `conflict` if its copy moved on, and we fall
+  // back to a full save.
+  const lastSavedRef = useRef(null);   // { name, revision, json }
   const handleSave = () => {
     const folder = estimateFolder.trim();
     const fullName = folder ? `${folder}/${estimateName.trim()}` : estimateName.trim();
     if (!fullName) { window.alert("Estimate name required."); return; }
     setSaving(true); setSaveOk(false);
-    const payload = new URLSearchParams({ estimate_name: fullName, estimate_data: buildPayload() });
-    fetch(data.saveUrl, { method: "POST", headers: { "Content-Type": "application/x-www-form-urlencoded" }, body: payload.toString() })
-      .then((r) => r.json())
+    const json = buildPayload();
+    const fullSave = () => {
+      const payload = new URLSearchParams({ estimate_name: fullName, estimate_data: json });
+      return fetch(data.saveUrl, { method: "POST", headers: { "Content-Type": "application/x-www-form-urlencoded" }, body: payload.toString() })
+        .then((r) => r.json());
+    };
+    const last = lastSavedRef.current;
+    const request = last && last.name === fullName && data.patchUrl
+      ? fetch(data.patchUrl, {
+          method: "POST",
+          headers: { "Content-Type": "application/json" },
+          body: JSON.stringify({ estimate_name: fullName, revision: last.revision, patch: jsonPatch(JSON.parse(last.json), JSON.parse(json)) }),
+        }).then((r) => r.json()).then((res) => (res.conflict ? fullSave() : res))
+      : fullSave();
+    request
       .then((res) => {
         if (res.ok) {
+          lastSavedRef.current = { name: fullName, revision: res.revision, json };
           setSaveOk(true); setEstimateName(fullName); fetchAttachments(fullName);
           if (res.sync_warning) {
             setSyncWarn("Cloud sync failed — data saved locally. Will retry on next save.");
@@ -6014,6 +6342,7 @@ const pageComponentMap = {
   view_all: ViewAllPage,
   search: SearchPage,
   analyze: AnalyzePage,
+  compare: ComparePage,
   product_detail: ProductDetailPage,
   material_list: MaterialListPage,
   templates: TemplatesPage,
@@ -0,0 +1,55 @@
+"""Saving an estimate's catalog costs one Turso round trip, however many rows it has."""
+
+import pytest
+
+import db
+
+
+@pytest.fixture
+def round_trips(monkeypatch):
+    """Point db at a stubbed Turso pipeline and count the requests sent to it."""
+    calls = []
+
+    def fake_pipeline(requests):
+        calls.append(requests)
+        out = []
+        for req in requests:
+            if req["type"] == "batch":
+                steps = req["batch"]["steps"]
+                out.append({"type": "ok", "response": {"type": "batch", "result": {
+                    "step_results": [{"cols": [], "rows": []}] * len(steps),
+                    "step_errors":  [None] * len(steps),
+                }}})
+            else:
+                out.append({"type": "ok", "response": {"type": "execute", "result": {"cols": [], "rows": []}}})
+        return out
+
+    monkeypatch.setattr(db, "USE_TURSO", True)
+    monkeypatch.setattr(db, "_pipeline", fake_pipeline)
+    return calls
+
+
+def _entries(n):
+    return [
+        {"description": f"Item {i}", "unit_cost": i * 1.5, "comments": "",
+         "add_comments": "", "category": "Fixtures"}
+        for i in range(n)
+    ]
+
+
+@pytest.mark.parametrize("rows", [1, 300])
+def test_sync_estimate_catalog_is_one_round_trip(round_trips, rows):
+    db.sync_estimate_catalog("Job A", _entries(rows))
+
+    assert len(round_trips) == 1
+    (request,) = round_trips[0]
+    assert request["type"] == "batch"
+
+
+def test_sync_estimate_catalog_sends_every_row(round_trips):
+    db.sync_estimate_catalog("Job A", _entries(300))
+
+    steps  = round_trips[0][0]["batch"]["steps"]
+    upsert = [s for s in steps if s["stmt"]["sql"].startswith("INSERT INTO estimate_catalog ")]
+    sent   = sum(len(s["stmt"]["args"]) for s in upsert) // 7
+    assert sent == 300
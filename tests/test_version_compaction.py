@@ -0,0 +1,52 @@
+"""compact_versions keeps patch chains short across prune / save / recompact cycles."""
+
+import json
+from datetime import datetime, timedelta
+
+import pytest
+
+import db
+
+
+@pytest.fixture
+def local_db(monkeypatch, tmp_path):
+    monkeypatch.setattr(db, "USE_TURSO", False)
+    monkeypatch.setattr(db, "LOCAL_DB_PATH", str(tmp_path / "zamora.db"))
+    db.init_db()
+
+
+def _add_versions(count, first, hours_apart, end):
+    with db._local_conn() as conn:
+        for i in range(count):
+            data = json.dumps({"products": [{"d": f"item {j}", "q": j} for j in range(40)] + [{"v": first + i}]})
+            saved_at = (end - timedelta(hours=(count - 1 - i) * hours_apart)).strftime("%Y-%m-%d %H:%M:%S")
+            conn.execute("INSERT INTO template_versions (template_id, data, saved_by, saved_at) VALUES (1, ?, 'x', ?)",
+                         (data, saved_at))
+
+
+def _max_depth():
+    with db._local_conn() as conn:
+        rows = conn.execute("SELECT id, base_id FROM template_versions ORDER BY id").fetchall()
+    depth = {}
+    for r in rows:
+        depth[r["id"]] = 0 if r["base_id"] is None else depth[r["base_id"]] + 1
+    return max(depth.values())
+
+
+def test_prune_then_recompact_keeps_chains_within_keyframe_every(local_db):
+    now = datetime.utcnow()
+    _add_versions(30, 0, 9, now - timedelta(hours=9))
+    db.compact_versions("templates", keyframe_every=10)
+    assert _max_depth() == 9
+
+    for cycle in range(5):
+        db.prune_versions("templates", keep_all_hours=24, hourly_days=2, pause=0)
+        _add_versions(6, 100 + cycle * 6, 0.1, datetime.utcnow())
+        db.compact_versions("templates", keyframe_every=10)
+        assert _max_depth() <= 9
+        with db._local_conn() as conn:
+            conn.execute("UPDATE template_versions SET saved_at = datetime(saved_at, '-1 day')")
+
+    with db._local_conn() as conn:
+        ids = [r["id"] for r in conn.execute("SELECT id FROM template_versions")]
+    assert all(json.loads(db._version_data("templates", i)) for i in ids)
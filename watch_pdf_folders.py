@@ -0,0 +1,306 @@
+"""
+watch_pdf_folders.py — Ingest supplier PDFs dropped into shared folders.
+
+Watches one folder per supplier (config.WATCH_FOLDERS or --folder), with
+inotify on Linux and a polling scan everywhere else.  New or changed PDFs are
+parsed with parse_pdf in a process pool, de-duplicated against the imported
+order numbers and file hashes, and committed in bulk via
+db.save_parsed_documents.  Every file handled is recorded in a state file
+(size + mtime + hash + outcome), so a restart only looks at what changed.
+
+The web app keeps its catalog in memory; it shows daemon imports after its
+next catalog refresh (an upload or a restart).
+
+Usage:
+    python watch_pdf_folders.py                                  # run until stopped
+    python watch_pdf_folders.py --folder "BPS=Invoices berger" --folder LPS=/mnt/lps
+    python watch_pdf_folders.py --once                           # catch up, then exit
+    python watch_pdf_folders.py --poll --interval 30             # force polling
+"""
+
+import argparse
+import ctypes
+import ctypes.util
+import os
+import select
+import signal
+import struct
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import config
+from pdf_ingest import file_sig, load_state, parse_file, write_state
+
+CHUNK = 25
+
+
+# ── inotify (Linux) ───────────────────────────────────────────────────────────
+
+class _Inotify:
+    """Minimal ctypes binding: directory watches for finished writes and moves-in."""
+
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_TO    = 0x00000080
+    IN_Q_OVERFLOW  = 0x00004000
+    IN_NONBLOCK    = 0o4000
+    IN_CLOEXEC     = 0o2000000
+    _EVENT         = struct.Struct("iIII")   # wd, mask, cookie, name length
+
+    def __init__(self):
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        self._add = libc.inotify_add_watch
+        self._add.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        self.fd = libc.inotify_init1(self.IN_NONBLOCK | self.IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self.paths: dict[int, str] = {}
+
+    def watch(self, folder: str) -> None:
+        wd = self._add(self.fd, os.fsencode(folder), self.IN_CLOSE_WRITE | self.IN_MOVED_TO)
+        if wd < 0:
+            raise OSError(ctypes.get_errno(), f"inotify_add_watch failed for {folder}")
+        self.paths[wd] = folder
+
+    def read(self, timeout: float) -> tuple[list, bool]:
+        """Wait up to timeout seconds; returns (file paths written/moved in, overflowed)."""
+        if not select.select([self.fd], [], [], timeout)[0]:
+            return [], False
+        try:
+            buf = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return [], False
+        out, overflow, pos = [], False, 0
+        while pos + self._EVENT.size <= len(buf):
+            wd, mask, _cookie, length = self._EVENT.unpack_from(buf, pos)
+            pos += self._EVENT.size
+            name = buf[pos:pos + length].rstrip(b"\0").decode("utf-8", "replace")
+            pos += length
+            if mask & self.IN_Q_OVERFLOW:
+                overflow = True
+            elif wd in self.paths and name:
+                out.append(os.path.join(self.paths[wd], name))
+        return out, overflow
+
+    def close(self) -> None:
+        os.close(self.fd)
+
+
+# ── folders + ingest ──────────────────────────────────────────────────────────
+
+def _parse_folders(spec: list) -> dict:
+    """["BPS=/a", "LPS=/b"] → {abs folder: supplier}."""
+    folders = {}
+    for entry in spec:
+        supplier, sep, folder = entry.partition("=")
+        if not sep or not supplier.strip() or not folder.strip():
+            raise ValueError(f"Expected SUPPLIER=folder, got {entry!r}")
+        folders[os.path.abspath(folder.strip())] = supplier.strip().upper()
+    return folders
+
+
+class Ingester:
+    """Tracks seen files and imports new ones in bulk."""
+
+    def __init__(self, folders: dict, state_path: str, jobs: int, settle: float):
+        from db import imported_invoice_keys
+
+        self.folders    = folders
+        self.state_path = state_path
+        self.state      = load_state(state_path)
+        self.settle     = settle
+        self.jobs       = jobs
+        self.pool       = ProcessPoolExecutor(max_workers=jobs) if jobs > 1 else None
+        self.orders, self.hashes = imported_invoice_keys()
+        self.pending: dict[str, float] = {}     # path → time it was last seen changing
+        self.totals = {"saved": 0, "duplicate": 0, "error": 0, "items": 0}
+
+    def _is_new(self, path: str) -> bool:
+        entry = self.state.get(path)
+        return entry is None or entry.get("sig") != file_sig(path)
+
+    def scan(self) -> None:
+        """Queue every PDF in the watched folders that the state file hasn't seen."""
+        now = time.time()
+        for folder in self.folders:
+            try:
+                with os.scandir(folder) as it:
+                    for e in it:
+                        if e.is_file() and e.name.lower().endswith(".pdf") and self._is_new(e.path):
+                            self.pending.setdefault(e.path, now)
+            except FileNotFoundError:
+                print(f"  [!] folder missing: {folder}")
+
+    def notice(self, path: str) -> None:
+        if path.lower().endswith(".pdf") and os.path.dirname(path) in self.folders:
+            self.pending[path] = time.time()
+
+    def ready(self, force: bool = False) -> list:
+        """Pending files that stopped changing at least `settle` seconds ago."""
+        cutoff = time.time() - self.settle
+        out = []
+        for path, seen in list(self.pending.items()):
+            sig = file_sig(path)
+            if sig is None:
+                del self.pending[path]                  # deleted or moved away
+            elif force or (seen <= cutoff and sig[1] / 1e9 <= cutoff):
+                out.append(path)
+                del self.pending[path]
+        return sorted(out)
+
+    def ingest(self, paths: list) -> None:
+        from db import save_parsed_documents
+
+        if not paths:
+            return
+        started = time.perf_counter()
+        suppliers = [self.folders[os.path.dirname(p)] for p in paths]
+        if self.pool:
+            try:
+                results = list(self.pool.map(parse_file, paths, suppliers, chunksize=4))
+            except BrokenProcessPool as e:
+                # A parser process died (e.g. OOM-killed): start a fresh pool
+                # and retry the whole batch on the next pass
+                print(f"  [!] parser pool broke ({e}); retrying {len(paths)} file(s)")
+                self.pool.shutdown(wait=False, cancel_futures=True)
+                self.pool = ProcessPoolExecutor(max_workers=self.jobs)
+                for path in paths:
+                    self.pending.setdefault(path, 0.0)
+                return
+        else:
+            results = map(parse_file, paths, suppliers)
+
+        batch: list[tuple[str, dict]] = []
+        for path, (digest, parsed, error) in zip(paths, results):
+            entry = {"sig": file_sig(path), "sha256": digest}
+            name  = os.path.basename(path)
+            if parsed is None:
+                print(f"  ERROR  {name}: {error}")
+                self.state[path] = {**entry, "status": "error", "error": error}
+                self.totals["error"] += 1
+                continue
+            key = (parsed["order_number"], parsed["doc_type"])
+            if key in self.orders or digest in self.hashes:
+                print(f"  SKIP   {name}  (duplicate: {parsed['order_number']})")
+                self.state[path] = {**entry, "status": "duplicate"}
+                self.totals["duplicate"] += 1
+                continue
+            self.orders.add(key)
+            self.hashes.add(digest)
+            batch.append((path, parsed))
+
+        for i in range(0, len(batch), CHUNK):
+            chunk = batch[i:i + CHUNK]
+            try:
+                ids = save_parsed_documents([(parsed, os.path.basename(path)) for path, parsed in chunk])
+            except Exception as e:
+                for path, parsed in chunk:
+                    # Not saved: forget its keys so the retry isn't taken for a duplicate
+                    self.orders.discard((parsed["order_number"], parsed["doc_type"]))
+                    self.hashes.discard(parsed["sha256"])
+                    print(f"  ERROR  {os.path.basename(path)}: {e}")
+                    # No sig: retried on the next scan
+                    self.state[path] = {"status": "error", "error": str(e)}
+                    self.totals["error"] += 1
+                continue
+            for (path, parsed), invoice_id in zip(chunk, ids):
+                entry = {"sig": file_sig(path), "sha256": parsed["sha256"]}
+                name  = os.path.basename(path)
+                if invoice_id == -1:
+                    print(f"  SKIP   {name}  (duplicate: {parsed['order_number']})")
+                    self.state[path] = {**entry, "status": "duplicate"}
+                    self.totals["duplicate"] += 1
+                else:
+                    print(f"  OK     {name}  -> invoice_id={invoice_id}  ({len(parsed['items'])} items)")
+                    self.state[path] = {**entry, "status": "saved", "invoice_id": invoice_id}
+                    self.totals["saved"] += 1
+                    self.totals["items"] += len(parsed["items"])
+
+        write_state(self.state_path, self.state)
+        elapsed = time.perf_counter() - started
+        print(f"  -- {len(paths)} file(s) in {elapsed:.2f}s ({len(paths) / max(elapsed, 1e-9):.1f} files/s)")
+
+    def close(self) -> None:
+        if self.pool:
+            self.pool.shutdown(cancel_futures=True)
+        write_state(self.state_path, self.state)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Import supplier PDFs dropped into watched folders.")
+    parser.add_argument("--folder", action="append", metavar="SUPPLIER=PATH",
+                        help="Folder to watch and the supplier it holds (repeatable). "
+                             "Default: config.WATCH_FOLDERS.")
+    parser.add_argument("--state", default=config.WATCH_STATE_FILE, help="State file path.")
+    parser.add_argument("--jobs", type=int, default=os.cpu_count() or 1, help="Parser processes.")
+    parser.add_argument("--settle", type=float, default=2.0,
+                        help="Seconds a file must stop changing before it is read (default 2).")
+    parser.add_argument("--interval", type=float, default=10.0, help="Polling interval in seconds (default 10).")
+    parser.add_argument("--poll", action="store_true", help="Poll even where inotify is available.")
+    parser.add_argument("--once", action="store_true", help="Import what is there now, then exit.")
+    args = parser.parse_args()
+
+    try:
+        folders = _parse_folders(args.folder or [e for e in config.WATCH_FOLDERS.split(";") if e.strip()])
+    except ValueError as e:
+        print(f"ERROR: {e}")
+        sys.exit(1)
+    if not folders:
+        print("ERROR: no folders to watch.")
+        sys.exit(1)
+
+    from db import init_db
+    init_db()
+
+    ingester = Ingester(folders, args.state, args.jobs, args.settle)
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+
+    inotify = None
+    if not args.poll and not args.once and sys.platform.startswith("linux"):
+        try:
+            inotify = _Inotify()
+            for folder in folders:
+                if os.path.isdir(folder):
+                    inotify.watch(folder)
+        except (OSError, AttributeError) as e:
+            print(f"  [!] inotify unavailable ({e}); polling instead")
+            inotify = None
+
+    print(f"\nWatching {len(folders)} folder(s) — {'inotify' if inotify else 'polling'}; state: {args.state}")
+    for folder, supplier in folders.items():
+        print(f"  {supplier:<5} {folder}")
+    print()
+
+    try:
+        ingester.scan()
+        if args.once:
+            ingester.ingest(ingester.ready(force=True))
+            return
+        last_scan = time.time()
+        while True:
+            if inotify:
+                paths, overflow = inotify.read(timeout=min(args.settle, 1.0))
+                for path in paths:
+                    ingester.notice(path)
+                # Rescan when events were dropped, and now and then as a safety net
+                if overflow or time.time() - last_scan >= max(args.interval, 300):
+                    ingester.scan()
+                    last_scan = time.time()
+            else:
+                time.sleep(min(args.interval, args.settle) if ingester.pending else args.interval)
+                ingester.scan()
+            ingester.ingest(ingester.ready())
+    except KeyboardInterrupt:
+        pass
+    finally:
+        ingester.close()
+        if inotify:
+            inotify.close()
+        t = ingester.totals
+        print(f"\nStopped — saved {t['saved']} ({t['items']} items), "
+              f"skipped {t['duplicate']} duplicate(s), {t['error']} error(s).\n")
+
+
+if __name__ == "__main__":
+    main()